@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import time
+from dlab.fab import get_notebook_image_hash, put_notebook_image_inputs
+
+parser = argparse.ArgumentParser(description='Local stand-in of the notebook image pipeline: bakes the template into '
+                                             'a docker image with configure_<template>_node.py, the same way a '
+                                             'shared cloud image is baked from a notebook instance, and measures '
+                                             'configure on a stock and on the baked image. Runs in the template '
+                                             'container with the environment of a notebook create request')
+parser.add_argument('--application', type=str, default='jupyter')
+parser.add_argument('--base_image', type=str, default='ubuntu:16.04', help='Stands for the stock OS image')
+parser.add_argument('--keyfile', type=str, default='/root/keys/KEYNAME.pem')
+parser.add_argument('--os_user', type=str, default='dlab-user')
+parser.add_argument('--params', type=str, default='',
+                    help='Arguments of configure_<template>_node.py besides --hostname, --keyfile and --os_user, '
+                         'e.g. "--spark_version 2.1.0 --hadoop_version 2.7 --scala_version 2.11.8 --r_mirror ..."')
+parser.add_argument('--workspace', type=str, default='/tmp/dlab_image_bake')
+args = parser.parse_args()
+
+container_name = 'dlab-image-bake'
+
+# sshd and a sudoer with the key of the provisioning, like the initial user of a cloud instance
+stock_dockerfile = '''FROM {base_image}
+RUN (apt-get update && apt-get install -y openssh-server sudo python) || yum install -y openssh-server sudo python
+RUN mkdir -p /var/run/sshd && ssh-keygen -A && useradd -m -s /bin/bash {os_user} && \\
+    echo "{os_user} ALL=(ALL) NOPASSWD:ALL" > /etc/sudoers.d/{os_user} && \\
+    mkdir -p /home/{os_user}/.ssh /home/{os_user}/.ensure_dir
+COPY authorized_keys /home/{os_user}/.ssh/authorized_keys
+RUN chown -R {os_user}: /home/{os_user} && chmod 600 /home/{os_user}/.ssh/authorized_keys
+CMD ["/usr/sbin/sshd", "-D"]
+'''
+
+
+def image_exists(image):
+    return subprocess.call(['docker', 'image', 'inspect', image], stdout=open(os.devnull, 'w'),
+                           stderr=subprocess.STDOUT) == 0
+
+
+def build_stock_image():
+    if os.path.exists(args.workspace):
+        shutil.rmtree(args.workspace)
+    os.makedirs(args.workspace)
+    with open(os.path.join(args.workspace, 'authorized_keys'), 'w') as keys_file:
+        keys_file.write(subprocess.check_output(['ssh-keygen', '-y', '-f', args.keyfile]))
+    with open(os.path.join(args.workspace, 'Dockerfile'), 'w') as dockerfile:
+        dockerfile.write(stock_dockerfile.format(base_image=args.base_image, os_user=args.os_user))
+    image = 'dlab-local/stock:{}'.format(args.base_image.replace(':', '-').replace('/', '-'))
+    subprocess.check_call(['docker', 'build', '-q', '-t', image, args.workspace])
+    return image
+
+
+def start_instance(image):
+    subprocess.call('docker rm -f {} > /dev/null 2>&1'.format(container_name), shell=True)
+    subprocess.check_call(['docker', 'run', '-d', '--privileged', '--name', container_name, image])
+    hostname = subprocess.check_output(['docker', 'inspect', '-f', '{{.NetworkSettings.IPAddress}}',
+                                        container_name]).strip()
+    for i in range(60):
+        if subprocess.call(['ssh', '-i', args.keyfile, '-o', 'StrictHostKeyChecking=no', '-o',
+                            'UserKnownHostsFile=/dev/null', '{}@{}'.format(args.os_user, hostname), 'true'],
+                           stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT) == 0:
+            return hostname
+        time.sleep(1)
+    raise Exception('Instance container did not start')
+
+
+def configure(hostname):
+    # The template container has the configure script of its template only
+    script = glob.glob('/root/scripts/configure_*_node.py')[0]
+    start = time.time()
+    subprocess.check_call('{} --hostname {} --keyfile {} --os_user {} {}'.format(
+        script, hostname, args.keyfile, args.os_user, args.params), shell=True)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    image_hash = get_notebook_image_hash(args.application)
+    baked_image = 'dlab-local/{}-notebook-image:{}'.format(args.application, image_hash)
+    try:
+        timings = list()
+        if image_exists(baked_image):
+            print('Image {} is baked already'.format(baked_image))
+        else:
+            hostname = start_instance(build_stock_image())
+            timings.append(('stock image', configure(hostname)))
+            put_notebook_image_inputs(args.os_user, args.application, True, hostname, args.keyfile)
+            subprocess.check_call(['docker', 'commit', container_name, baked_image])
+            print('Image {} is baked'.format(baked_image))
+        # Notebook created from the image of the same inputs: configure steps only find their markers
+        hostname = start_instance(baked_image)
+        timings.append(('baked image', configure(hostname)))
+        for name, duration in timings:
+            print('{} configure on {:<12} {:>8.1f}s'.format(args.application, name, duration))
+    finally:
+        subprocess.call('docker rm -f {} > /dev/null 2>&1'.format(container_name), shell=True)
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import ast
+import json
+import os
+import tempfile
+import threading
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import requests.adapters
+from azure.common.client_factory import get_client_from_auth_file
+from azure.mgmt.authorization import AuthorizationManagementClient
+from azure.mgmt.compute import ComputeManagementClient
+from azure.mgmt.resource import ResourceManagementClient
+from azure.mgmt.network import NetworkManagementClient
+from azure.mgmt.storage import StorageManagementClient
+from azure.mgmt.datalake.store import DataLakeStoreAccountManagementClient
+from azure.datalake.store import lib
+from dlab import client_lib
+from dlab.meta_lib import AzureMeta
+from dlab.actions_lib import AzureActions
+
+parser = argparse.ArgumentParser(description='Compares the Azure clients and tokens created by every AzureMeta()/'
+                                             'AzureActions() with the shared client context, against a local mock '
+                                             'of the AAD and ARM endpoints. Runs in the Azure provisioning container')
+parser.add_argument('--script', type=str, default='/root/scripts/edge_prepare.py',
+                    help='Script whose AzureMeta()/AzureActions() constructions are replayed')
+args = parser.parse_args()
+
+mock_stats = {'auth': 0, 'arm': 0, 'connections': 0}
+management_clients = (ComputeManagementClient, ResourceManagementClient, NetworkManagementClient,
+                      StorageManagementClient, DataLakeStoreAccountManagementClient, AuthorizationManagementClient)
+auth_file_content = {
+    'clientId': '00000000-0000-0000-0000-000000000001',
+    'clientSecret': 'benchmark',
+    'subscriptionId': '00000000-0000-0000-0000-000000000002',
+    'tenantId': '00000000-0000-0000-0000-000000000003',
+    'activeDirectoryEndpointUrl': 'https://login.microsoftonline.com',
+    'resourceManagerEndpointUrl': 'https://management.azure.com/',
+    'activeDirectoryGraphResourceId': 'https://graph.windows.net/',
+    'managementEndpointUrl': 'https://management.core.windows.net/'
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        mock_stats['connections'] += 1
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        if '/oauth2/' in self.path:
+            mock_stats['auth'] += 1
+            now = int(time.time())
+            self.reply(json.dumps({'token_type': 'Bearer', 'expires_in': '3600', 'ext_expires_in': '3600',
+                                   'expires_on': str(now + 3600), 'not_before': str(now), 'access_token': 'mock',
+                                   'resource': 'https://management.azure.com/'}))
+        else:
+            self.do_GET()
+
+    def do_GET(self):
+        mock_stats['arm'] += 1
+        name = urlparse.urlparse(self.path).path.rstrip('/').split('/')[-1]
+        self.reply(json.dumps({'id': urlparse.urlparse(self.path).path, 'name': name, 'location': 'westus',
+                               'properties': {'provisioningState': 'Succeeded'}}))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def route_to_mock(mock_url):
+    # Every request of the SDKs, AAD and ARM alike, is sent to the mock. The pools of the sessions are kept,
+    # so connection reuse is measured as it happens against Azure
+    send = requests.adapters.HTTPAdapter.send
+
+    def mock_send(self, request, **kwargs):
+        url = urlparse.urlparse(request.url)
+        request.url = urlparse.urlunparse(('http', mock_url) + tuple(url[2:]))
+        kwargs['verify'] = False
+        return send(self, request, **kwargs)
+
+    requests.adapters.HTTPAdapter.send = mock_send
+
+
+def count_constructions(script):
+    # AzureMeta() and AzureActions() outside of the except blocks, the ones of a successful run
+    class Visitor(ast.NodeVisitor):
+        constructions = 0
+
+        def visit_ExceptHandler(self, node):
+            pass
+
+        def visit_Call(self, node):
+            if getattr(node.func, 'id', '') in ('AzureMeta', 'AzureActions') and not node.args:
+                Visitor.constructions += 1
+            self.generic_visit(node)
+
+    with open(script) as script_file:
+        Visitor().visit(ast.parse(script_file.read()))
+    return Visitor.constructions
+
+
+def legacy_construction(index):
+    # What every AzureMeta()/AzureActions() did before: six clients with credentials of their own and a
+    # Data Lake token
+    clients = dict()
+    for client_class in management_clients:
+        clients[client_class] = get_client_from_auth_file(client_class)
+    lib.auth(tenant_id=auth_file_content['tenantId'], client_secret=auth_file_content['clientSecret'],
+             client_id=auth_file_content['clientId'], resource='https://datalake.azure.net/')
+    return clients[ResourceManagementClient]
+
+
+def context_construction(index):
+    view = AzureMeta() if index % 2 else AzureActions()
+    return view.resource_client
+
+
+def run(name, constructions, construct):
+    for key in mock_stats:
+        mock_stats[key] = 0
+    start = time.time()
+    for i in range(constructions):
+        construct(i).resource_groups.get('benchmark-{}'.format(i))
+    return name, time.time() - start, dict(mock_stats)
+
+
+if __name__ == "__main__":
+    server = MockServer(('127.0.0.1', 0), MockHandler)
+    threading.Thread(target=server.serve_forever).start()
+    route_to_mock('127.0.0.1:{}'.format(server.server_address[1]))
+    constructions = count_constructions(args.script)
+    auth_file = tempfile.NamedTemporaryFile(suffix='.json')
+    try:
+        auth_file.write(json.dumps(auth_file_content))
+        auth_file.flush()
+        client_lib.auth_location = auth_file.name
+        os.environ['AZURE_AUTH_LOCATION'] = auth_file.name
+        results = [run('clients per construction', constructions, legacy_construction),
+                   run('shared context', constructions, context_construction)]
+    finally:
+        server.shutdown()
+        auth_file.close()
+    print('{} constructs AzureMeta/AzureActions {} times on success, each followed by one ARM call'.format(
+        os.path.basename(args.script), constructions))
+    for name, duration, stats in results:
+        print('{:<26} wall: {:>7.3f}s  auth requests: {:>4}  ARM calls: {:>4}  connections: {:>4}'.format(
+            name, duration, stats['auth'], stats['arm'], stats['connections']))
+    print('Auth requests saved: {}'.format(results[0][2]['auth'] - results[1][2]['auth']))
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import base64
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import httplib
+
+parser = argparse.ArgumentParser(description='Counts LDAP operations of the edge nginx with and without the '
+                                             'auth_ldap cache against a local OpenLDAP container')
+parser.add_argument('--nginx', type=str, default='nginx', help='Nginx binary built with nginx-auth-ldap')
+parser.add_argument('--ldap_image', type=str, default='osixia/openldap:1.2.1')
+parser.add_argument('--requests', type=int, default=2000, help='Authenticated requests per measurement')
+parser.add_argument('--sessions', type=int, default=4, help='Concurrent browser sessions')
+parser.add_argument('--cache_size', type=int, default=1000)
+parser.add_argument('--cache_ttl', type=int, default=300, help='Seconds')
+parser.add_argument('--port', type=int, default=18080, help='Port of the edge, the next one is used by LDAP')
+parser.add_argument('--workspace', type=str, default='/tmp/dlab_ldap_cache_benchmark')
+args = parser.parse_args()
+
+container_name = 'dlab-ldap-cache-benchmark'
+admin_dn = 'cn=admin,dc=dlab,dc=local'
+admin_password = 'admin-password'
+user_name = 'dlab-user'
+user_password = 'dlab-password'
+
+ldap_users = '''dn: ou=People,dc=dlab,dc=local
+objectClass: organizationalUnit
+ou: People
+
+dn: uid={0},ou=People,dc=dlab,dc=local
+objectClass: top
+objectClass: account
+objectClass: posixAccount
+cn: {0}
+uid: {0}
+uidNumber: 10000
+gidNumber: 10000
+homeDirectory: /home/{0}
+userPassword: {1}
+'''.format(user_name, user_password)
+
+# LDAP part of edge/templates/nginx.conf, the page stands for a notebook behind the edge
+nginx_conf = '''
+worker_processes 1;
+pid {workspace}/nginx.pid;
+error_log {workspace}/error.log;
+events {{
+    worker_connections 1024;
+}}
+http {{
+    access_log off;
+    {cache}
+    ldap_server ldap1 {{
+        url ldap://127.0.0.1:{ldap_port}/ou=People,dc=dlab,dc=local?uid,mail?sub?(&(objectClass=posixAccount));
+        binddn "{admin_dn}";
+        binddn_passwd "{admin_password}";
+        require valid_user;
+        request_timeout 30s;
+    }}
+    server {{
+        listen 127.0.0.1:{port};
+        auth_ldap "Forbidden";
+        auth_ldap_servers ldap1;
+        location / {{
+            root {workspace}/html;
+        }}
+    }}
+}}
+'''
+
+cache_modes = (
+    ('no cache', 'auth_ldap_cache_enabled off;'),
+    ('cache', 'auth_ldap_cache_enabled on;\n    auth_ldap_cache_expiration_time {0};\n    '
+              'auth_ldap_cache_size {1};'.format(args.cache_ttl * 1000, args.cache_size))
+)
+
+
+def start_ldap():
+    subprocess.call('docker rm -f {} > /dev/null 2>&1'.format(container_name), shell=True)
+    # Log level 256 writes every connection and operation of slapd into the container log
+    subprocess.check_call(['docker', 'run', '-d', '--name', container_name, '-p',
+                           '127.0.0.1:{}:389'.format(args.port + 1), '-e', 'LDAP_ORGANISATION=DLab',
+                           '-e', 'LDAP_DOMAIN=dlab.local', '-e', 'LDAP_ADMIN_PASSWORD=' + admin_password,
+                           '-e', 'LDAP_LOG_LEVEL=256', args.ldap_image])
+    for i in range(60):
+        if subprocess.call(['docker', 'exec', container_name, 'ldapsearch', '-x', '-H', 'ldap://localhost',
+                            '-b', 'dc=dlab,dc=local', '-D', admin_dn, '-w', admin_password, '-s', 'base'],
+                           stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT) == 0:
+            break
+        time.sleep(1)
+    else:
+        raise Exception('OpenLDAP container did not start')
+    ldapadd = subprocess.Popen(['docker', 'exec', '-i', container_name, 'ldapadd', '-x', '-H', 'ldap://localhost',
+                                '-D', admin_dn, '-w', admin_password], stdin=subprocess.PIPE)
+    ldapadd.communicate(ldap_users)
+    if ldapadd.returncode:
+        raise Exception('Failed to add LDAP users')
+
+
+def ldap_operations():
+    # Searches and binds slapd has served so far
+    output = subprocess.check_output(['docker', 'logs', container_name], stderr=subprocess.STDOUT)
+    return len(re.findall(r' SRCH base=', output)), len(re.findall(r' BIND dn=', output))
+
+
+def send_requests():
+    # Every session is a browser with basic auth credentials, polling the notebook on one keep-alive connection
+    headers = {'Authorization': 'Basic ' + base64.b64encode('{}:{}'.format(user_name, user_password))}
+    failed = [0]
+    lock = threading.Lock()
+    pending = [args.requests]
+
+    def session():
+        connection = httplib.HTTPConnection('127.0.0.1', args.port)
+        while True:
+            with lock:
+                if not pending[0]:
+                    return
+                pending[0] -= 1
+            connection.request('GET', '/index.html', headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                with lock:
+                    failed[0] += 1
+
+    threads = [threading.Thread(target=session) for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failed[0]
+
+
+def measure(name, cache):
+    workspace = os.path.join(args.workspace, name.replace(' ', '_'))
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+    os.makedirs(os.path.join(workspace, 'html'))
+    with open(os.path.join(workspace, 'html', 'index.html'), 'w') as page_file:
+        page_file.write('<html>notebook</html>')
+    with open(os.path.join(workspace, 'nginx.conf'), 'w') as conf_file:
+        conf_file.write(nginx_conf.format(workspace=workspace, cache=cache, port=args.port,
+                                          ldap_port=args.port + 1, admin_dn=admin_dn,
+                                          admin_password=admin_password))
+    subprocess.check_call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf')])
+    try:
+        time.sleep(0.5)
+        searches_before, binds_before = ldap_operations()
+        start = time.time()
+        failed = send_requests()
+        duration = time.time() - start
+        # slapd flushes its log asynchronously
+        time.sleep(1)
+        searches_after, binds_after = ldap_operations()
+        return searches_after - searches_before, binds_after - binds_before, failed, duration
+    finally:
+        subprocess.call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf'), '-s', 'stop'])
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    start_ldap()
+    try:
+        print('{} authenticated requests in {} sessions'.format(args.requests, args.sessions))
+        rates = dict()
+        for name, cache in cache_modes:
+            searches, binds, failed, duration = measure(name, cache)
+            rates[name] = (searches + binds) / duration
+            print('{:<9} LDAP searches: {:>6}  binds: {:>6}  LDAP queries/s: {:>8.1f}  failed: {:>4}  '
+                  'wall: {:>6.2f}s'.format(name, searches, binds, rates[name], failed, duration))
+        if rates['no cache']:
+            print('LDAP query rate dropped by {:.1f}%'.format((1 - rates['cache'] / rates['no cache']) * 100))
+    finally:
+        subprocess.call('docker rm -f {} > /dev/null 2>&1'.format(container_name), shell=True)
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import httplib
+
+parser = argparse.ArgumentParser(description='Compares edge routing with a regex location per notebook and with '
+                                             'the $dlab_upstream map through a local nginx')
+parser.add_argument('--nginx', type=str, default='nginx', help='Nginx binary')
+parser.add_argument('--notebooks', type=str, default='10,100,500', help='Comma separated numbers of notebooks')
+parser.add_argument('--duration', type=int, default=10, help='Seconds per measurement')
+parser.add_argument('--connections', type=int, default=16)
+parser.add_argument('--port', type=int, default=18080, help='Port of the edge, the next one is used by the backend')
+parser.add_argument('--workspace', type=str, default='/tmp/dlab_routing_benchmark')
+args = parser.parse_args()
+
+nginx_conf = '''
+worker_processes 1;
+pid {workspace}/nginx.pid;
+error_log {workspace}/error.log;
+events {{
+    worker_connections 4096;
+}}
+http {{
+    access_log off;
+    map_hash_max_size 4096;
+    map_hash_bucket_size 128;
+    {http}
+    server {{
+        listen 127.0.0.1:{backend_port};
+        location / {{
+            return 200 "ok";
+        }}
+    }}
+    server {{
+        listen 127.0.0.1:{port};
+        {server}
+    }}
+}}
+'''
+
+proxy_headers = '''
+        proxy_set_header Host $http_host;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+'''
+
+
+def regex_config(notebooks, backend):
+    # Previous edge/templates/locations/jupyter.conf and ungit.conf for every notebook
+    server = ''
+    for i in range(notebooks):
+        server += 'location ~* /notebook{0}/.* {{ proxy_pass http://{1};{2} }}\n'.format(i, backend, proxy_headers)
+        server += 'location ~* /notebook{0}-ungit/.* {{ proxy_pass http://{1};{2} }}\n'.format(i, backend,
+                                                                                              proxy_headers)
+    return '', server
+
+
+def map_config(notebooks, backend):
+    # edge/templates/conf.d/proxy.conf with jupyter.map/ungit.map entries of every notebook
+    entries = ''
+    upstreams = ''
+    for i in range(notebooks):
+        for name in ('notebook{}'.format(i), 'notebook{}-ungit'.format(i)):
+            entries += '{0} {0};\n'.format(name)
+            upstreams += 'upstream {0} {{ server {1}; }}\n'.format(name, backend)
+    http = 'map $dlab_resource $dlab_upstream {{ default ""; {0} }}\n{1}'.format(entries, upstreams)
+    server = 'location ~ ^/(?<dlab_resource>[^/]+)/ {{ if ($dlab_upstream = "") {{ return 404; }} ' \
+             'proxy_pass http://$dlab_upstream;{0} }}'.format(proxy_headers)
+    return http, server
+
+
+def run_wrk(url):
+    output = subprocess.check_output(['wrk', '-t2', '-c{}'.format(args.connections),
+                                      '-d{}s'.format(args.duration), url])
+    return float(re.search(r'Requests/sec:\s+([\d.]+)', output).group(1))
+
+
+def run_clients(path):
+    # Fallback when wrk is not installed: keep-alive clients in threads
+    counts = [0] * args.connections
+    deadline = time.time() + args.duration
+
+    def client(index):
+        connection = httplib.HTTPConnection('127.0.0.1', args.port)
+        while time.time() < deadline:
+            connection.request('GET', path)
+            connection.getresponse().read()
+            counts[index] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / float(args.duration)
+
+
+def measure(name, notebooks, config):
+    workspace = os.path.join(args.workspace, '{}_{}'.format(name, notebooks))
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+    os.makedirs(workspace)
+    http, server = config(notebooks, '127.0.0.1:{}'.format(args.port + 1))
+    with open(os.path.join(workspace, 'nginx.conf'), 'w') as conf_file:
+        conf_file.write(nginx_conf.format(workspace=workspace, http=http, server=server, port=args.port,
+                                          backend_port=args.port + 1))
+    subprocess.check_call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf')])
+    try:
+        time.sleep(0.5)
+        # The last notebook is the worst case for regex locations, which are tested in order
+        path = '/notebook{}/api/status'.format(notebooks - 1)
+        if subprocess.call('which wrk > /dev/null 2>&1', shell=True) == 0:
+            return run_wrk('http://127.0.0.1:{}{}'.format(args.port, path))
+        return run_clients(path)
+    finally:
+        subprocess.call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf'), '-s', 'stop'])
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    for notebooks in [int(i) for i in args.notebooks.split(',')]:
+        regex_rate = measure('regex', notebooks, regex_config)
+        map_rate = measure('map', notebooks, map_config)
+        print('{:<5} notebooks  regex locations: {:>9.0f} req/s  map: {:>9.0f} req/s  ({:+.1f}%)'.format(
+            notebooks, regex_rate, map_rate, (map_rate / regex_rate - 1) * 100))
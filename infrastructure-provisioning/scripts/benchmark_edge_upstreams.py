@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import os
+import shutil
+import subprocess
+import threading
+import time
+import httplib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+parser = argparse.ArgumentParser(description='Compares direct proxy_pass to a notebook with keepalive upstreams '
+                                             'and the static cache of the edge through a local nginx')
+parser.add_argument('--nginx', type=str, default='nginx', help='Nginx binary')
+parser.add_argument('--page_loads', type=int, default=200, help='Page loads per measurement')
+parser.add_argument('--assets', type=int, default=30, help='Static files per page')
+parser.add_argument('--sessions', type=int, default=4, help='Concurrent browser sessions')
+parser.add_argument('--latency', type=float, default=2, help='Milliseconds the notebook spends per request')
+parser.add_argument('--port', type=int, default=18080, help='Port of the edge, the next one is used by the notebook')
+parser.add_argument('--workspace', type=str, default='/tmp/dlab_upstream_benchmark')
+args = parser.parse_args()
+
+nginx_conf = '''
+worker_processes 1;
+pid {workspace}/nginx.pid;
+error_log {workspace}/error.log;
+events {{
+    worker_connections 4096;
+}}
+http {{
+    access_log off;
+    {http}
+    server {{
+        listen 127.0.0.1:{port};
+        {server}
+    }}
+}}
+'''
+
+proxy_headers = '''
+        proxy_set_header Host $http_host;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+'''
+
+
+def direct_config(backend, workspace):
+    # Previous edge/templates/locations/jupyter.conf
+    server = 'location ~* /notebook/.* {{ proxy_pass http://{0};{1} proxy_set_header Connection "upgrade"; }}'.format(
+        backend, proxy_headers)
+    return '', server
+
+
+def upstream_config(backend, workspace):
+    # edge/templates/conf.d/proxy.conf with locations/jupyter.upstream of one notebook
+    http = '''
+    upstream notebook-jupyter {{ server {0}; keepalive 8; }}
+    map $http_upgrade $dlab_connection_upgrade {{ default upgrade; "" ""; }}
+    proxy_cache_path {1}/cache levels=1:2 keys_zone=dlab_static:16m max_size=1g inactive=7d use_temp_path=off;
+    map $request_uri $dlab_static_resource {{ default ""; ~^/([^/]+)/static/ $1; }}
+    map $dlab_static_resource $dlab_no_cache {{ default ""; "" 1; }}
+    '''.format(backend, workspace)
+    server = '''
+        proxy_cache dlab_static;
+        proxy_cache_key $dlab_static_resource$request_uri;
+        proxy_cache_valid 200 1d;
+        proxy_cache_lock on;
+        proxy_cache_bypass $dlab_no_cache;
+        proxy_no_cache $dlab_no_cache;
+        location ~ ^/(?<dlab_resource>[^/]+)/ {{ proxy_pass http://notebook-jupyter;{0}
+        proxy_set_header Connection $dlab_connection_upgrade; }}'''.format(proxy_headers)
+    return http, server
+
+
+class NotebookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+    requests = 0
+    lock = threading.Lock()
+
+
+class NotebookHandler(BaseHTTPRequestHandler):
+    # Imitates a notebook server: pages and versioned static files over HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(args.latency / 1000.0)
+        if '/static/' in self.path:
+            body = 'x' * 32768
+            cache_control = 'max-age=31536000'
+        else:
+            body = '<html>{}</html>'.format(''.join(['<script src="/notebook/static/{}.js?v=1"></script>'.format(i)
+                                                    for i in range(args.assets)]))
+            cache_control = 'no-cache'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_pages(page_loads):
+    # Every page load is a new browser session: the page, then its static files on one keep-alive connection
+    latencies = list()
+    lock = threading.Lock()
+    pending = [page_loads]
+
+    def session():
+        while True:
+            with lock:
+                if not pending[0]:
+                    return
+                pending[0] -= 1
+            start = time.time()
+            connection = httplib.HTTPConnection('127.0.0.1', args.port)
+            for path in ['/notebook/tree'] + ['/notebook/static/{}.js?v=1'.format(i) for i in range(args.assets)]:
+                connection.request('GET', path)
+                connection.getresponse().read()
+            connection.close()
+            with lock:
+                latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=session) for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies)
+
+
+def measure(name, config):
+    workspace = os.path.join(args.workspace, name)
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+    os.makedirs(workspace)
+    notebook = NotebookServer(('127.0.0.1', args.port + 1), NotebookHandler)
+    threading.Thread(target=notebook.serve_forever).start()
+    http, server = config('127.0.0.1:{}'.format(args.port + 1), workspace)
+    with open(os.path.join(workspace, 'nginx.conf'), 'w') as conf_file:
+        conf_file.write(nginx_conf.format(workspace=workspace, http=http, server=server, port=args.port))
+    subprocess.check_call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf')])
+    try:
+        time.sleep(0.5)
+        latencies = load_pages(args.page_loads)
+        return notebook.connections, notebook.requests, latencies
+    finally:
+        subprocess.call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf'), '-s', 'stop'])
+        notebook.shutdown()
+        notebook.server_close()
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    requests = args.page_loads * (args.assets + 1)
+    print('{} page loads, {} requests through the edge'.format(args.page_loads, requests))
+    for name, config in (('direct', direct_config), ('upstream', upstream_config)):
+        connections, served, latencies = measure(name, config)
+        print('{:<9} notebook connections: {:>6}  notebook requests: {:>6}  page load mean: {:>7.1f} ms  '
+              'p95: {:>7.1f} ms'.format(name, connections, served, sum(latencies) / len(latencies) * 1000,
+                                        latencies[int(len(latencies) * 0.95) - 1] * 1000))
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import ast
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+import httplib2
+import google_auth_httplib2
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+from google.cloud import storage
+from dlab import client_lib
+from dlab.meta_lib import GCPMeta
+from dlab.actions_lib import GCPActions
+
+parser = argparse.ArgumentParser(description='Compares the GCP clients built by every GCPMeta()/GCPActions() with '
+                                             'the shared client context, against a local stub of the Google APIs. '
+                                             'Runs in the GCP provisioning container, where the discovery cache '
+                                             'is baked')
+parser.add_argument('--script', type=str, default='/root/scripts/edge_prepare.py',
+                    help='Script whose GCPMeta()/GCPActions() constructions are replayed')
+parser.add_argument('--project', type=str, default='dlab-benchmark')
+args = parser.parse_args()
+
+stub_stats = {'discovery': 0, 'api': 0, 'connections': 0}
+discovery_cache = client_lib.discovery_cache_dir
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        stub_stats['connections'] += 1
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # /discovery/v1/apis/<api>/<version>/rest answered with the baked document, pointed to the stub
+        if self.path.startswith('/discovery/'):
+            stub_stats['discovery'] += 1
+            api, version = self.path.split('/')[4:6]
+            with open(os.path.join(discovery_cache, '{}.{}.json'.format(api, version))) as document_file:
+                document = json.load(document_file)
+            root_url = 'http://{}:{}/'.format(*self.server.server_address)
+            document['baseUrl'] = document['baseUrl'].replace(document['rootUrl'], root_url)
+            document['rootUrl'] = root_url
+            self.reply(json.dumps(document))
+        else:
+            stub_stats['api'] += 1
+            self.reply(json.dumps({'kind': 'compute#network', 'name': 'benchmark'}))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def count_constructions(script):
+    # GCPMeta() and GCPActions() outside of the except blocks, the ones of a successful run
+    class Visitor(ast.NodeVisitor):
+        constructions = 0
+
+        def visit_ExceptHandler(self, node):
+            pass
+
+        def visit_Call(self, node):
+            if getattr(node.func, 'id', '') in ('GCPMeta', 'GCPActions') and not node.args:
+                Visitor.constructions += 1
+            self.generic_visit(node)
+
+    with open(script) as script_file:
+        Visitor().visit(ast.parse(script_file.read()))
+    return Visitor.constructions
+
+
+def legacy_construction(stub_url):
+    # What every GCPMeta()/GCPActions() did before: five services built from fetched discovery documents
+    credentials = AnonymousCredentials()
+    clients = dict()
+    for api, version in client_lib.services:
+        clients[api] = build(api, version, http=google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http()),
+                             discoveryServiceUrl=stub_url + 'discovery/v1/apis/{api}/{apiVersion}/rest',
+                             cache_discovery=False)
+    storage.Client(project=args.project, credentials=credentials)
+    return clients['compute']
+
+
+def context_construction(index):
+    lib = GCPMeta() if index % 2 else GCPActions()
+    return lib.service
+
+
+def run(name, constructions, construct):
+    for key in stub_stats:
+        stub_stats[key] = 0
+    start = time.time()
+    for i in range(constructions):
+        construct(i).networks().get(project=args.project, network='benchmark').execute()
+    duration = time.time() - start
+    return name, duration, dict(stub_stats)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('gcp_project_id', args.project)
+    os.environ.setdefault('conf_resource', 'edge')
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever).start()
+    stub_url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    constructions = count_constructions(args.script)
+    workspace = tempfile.mkdtemp()
+    try:
+        client_lib.get_credentials = lambda: (AnonymousCredentials(), args.project)
+        client_lib.discovery_url = stub_url + 'discovery/v1/apis/{api}/{version}/rest'
+        client_lib.discovery_cache_dir = workspace
+        results = [run('build per construction', constructions, lambda i: legacy_construction(stub_url)),
+                   run('context, empty cache', constructions, context_construction)]
+        # The next script of the request: a new process with the cache filled
+        client_lib.context = None
+        results.append(run('context, baked cache', constructions, context_construction))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workspace)
+    print('{} constructs GCPMeta/GCPActions {} times on success, each followed by one API call'.format(
+        os.path.basename(args.script), constructions))
+    for name, duration, stats in results:
+        print('{:<24} wall: {:>7.3f}s  discovery fetches: {:>4}  API calls: {:>4}  connections: {:>4}'.format(
+            name, duration, stats['discovery'], stats['api'], stats['connections']))
+    print('HTTP calls saved: {}'.format(results[0][2]['discovery'] + results[0][2]['api'] -
+                                        results[-1][2]['discovery'] - results[-1][2]['api']))
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import json
+import os
+import subprocess
+import time
+import uuid
+
+parser = argparse.ArgumentParser(description='Compares per-request overhead of container-per-request provisioning '
+                                             'with the long-lived worker (entrypoint.py --daemon)')
+parser.add_argument('--image', type=str, default='docker.dlab-edge', help='Provisioning image to benchmark')
+parser.add_argument('--action', type=str, default='status')
+parser.add_argument('--requests', type=int, default=20)
+parser.add_argument('--key_dir', type=str, default='/opt/dlab/keys', help='Directory mounted as /root/keys')
+parser.add_argument('--workspace', type=str, default='/tmp/dlab_worker_benchmark')
+parser.add_argument('--config', type=str, default='{"conf_resource": "edge", "edge_user_name": "benchmark"}',
+                    help='JSON config passed to every request')
+parser.add_argument('--real_run', action='store_true',
+                    help='Execute the action itself, by default requests are dry runs and only overhead is measured')
+parser.add_argument('--timeout', type=int, default=600)
+args = parser.parse_args()
+
+
+def wait_for_response(response_dir, request_id, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if [i for i in os.listdir(response_dir) if request_id in i and i.endswith('.json')]:
+            return True
+        time.sleep(0.01)
+    raise Exception('No response for request {} in {} seconds'.format(request_id, timeout))
+
+
+def request_config():
+    config = json.loads(args.config)
+    if not args.real_run:
+        config['dry_run'] = 'true'
+    return config
+
+
+def benchmark_container_per_request(response_dir):
+    timings = list()
+    for i in range(args.requests):
+        request_id = str(uuid.uuid4())
+        start = time.time()
+        process = subprocess.Popen(['docker', 'run', '-i', '--rm', '-v', '{}:/root/keys'.format(args.key_dir),
+                                    '-v', '{}:/response'.format(response_dir), '-e', 'request_id={}'.format(request_id),
+                                    args.image, '--action', args.action], stdin=subprocess.PIPE)
+        process.communicate(json.dumps(request_config()))
+        wait_for_response(response_dir, request_id, args.timeout)
+        timings.append(time.time() - start)
+    return timings
+
+
+def benchmark_worker(response_dir, spool_dir):
+    container = subprocess.check_output(['docker', 'run', '-d', '-v', '{}:/root/keys'.format(args.key_dir),
+                                         '-v', '{}:/response'.format(response_dir),
+                                         '-v', '{}:/spool'.format(spool_dir), args.image, '--daemon']).strip()
+    timings = list()
+    try:
+        for i in range(args.requests):
+            request_id = str(uuid.uuid4())
+            request = {'action': args.action, 'environment': {'request_id': request_id}, 'config': request_config()}
+            start = time.time()
+            with open(os.path.join(spool_dir, request_id + '.tmp'), 'w') as request_file:
+                request_file.write(json.dumps(request))
+            os.rename(os.path.join(spool_dir, request_id + '.tmp'), os.path.join(spool_dir, request_id + '.json'))
+            wait_for_response(response_dir, request_id, args.timeout)
+            timings.append(time.time() - start)
+    finally:
+        subprocess.call(['docker', 'rm', '-f', container])
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print('{:<24} requests: {:<4} mean: {:.3f}s p50: {:.3f}s p95: {:.3f}s'.format(
+        name, len(timings), sum(timings) / len(timings), timings[len(timings) // 2],
+        timings[min(len(timings) - 1, int(len(timings) * 0.95))]))
+
+
+if __name__ == "__main__":
+    response_dir = os.path.join(args.workspace, 'response')
+    spool_dir = os.path.join(args.workspace, 'spool')
+    for directory in (response_dir, spool_dir):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    report('container per request', benchmark_container_per_request(response_dir))
+    report('long-lived worker', benchmark_worker(response_dir, spool_dir))
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import time
+from fabric.api import *
+from dlab.fab import RemoteBatch
+
+parser = argparse.ArgumentParser(description='Compares one sudo() per command with RemoteBatch on a notebook. '
+                                             'Runs in the provisioning container, where dlab libraries are installed')
+parser.add_argument('--hostname', type=str, default='')
+parser.add_argument('--keyfile', type=str, default='')
+parser.add_argument('--user', type=str, default='')
+parser.add_argument('--repeats', type=int, default=3)
+args = parser.parse_args()
+
+# Commands shaped like the ported notebook_lib functions, but without side effects.
+# Remote commands the debian functions sent before the marker was touched: ensure_r with the R libraries
+# of RStudio, install_tensor after the reboot, configure_jupyter and ensure_additional_python_libs of Jupyter
+functions = (
+    ('ensure_r', 24),
+    ('install_rstudio', 21),
+    ('install_tensor', 30),
+    ('configure_jupyter', 27),
+    ('ensure_additional_python_libs', 3),
+)
+
+
+def command(index):
+    return 'test -d /tmp && echo step {} > /dev/null'.format(index)
+
+
+def run_separately(steps):
+    start = time.time()
+    for i in range(steps):
+        sudo(command(i))
+    sudo('touch /tmp/dlab_benchmark_marker')
+    return steps + 1, time.time() - start
+
+
+def check_user():
+    # run() steps and uploaded files belong to the user of the connection, not to the local user of the
+    # provisioning container, with the user given and taken from env.host_string alike
+    for batch in (RemoteBatch('benchmark user', user=args.user), RemoteBatch('benchmark user')):
+        batch.run('test "$(whoami)" = "{0}" && test "$HOME" = "$(getent passwd {0} | cut -d: -f6)"'.format(
+            args.user))
+        batch.put(__file__, '/tmp/dlab_benchmark_put')
+        batch.sudo('test "$(stat -c %U /tmp/dlab_benchmark_put)" = "{}"'.format(args.user))
+        batch.sudo('rm -f /tmp/dlab_benchmark_put')
+        batch.execute()
+
+
+def run_batch(steps):
+    start = time.time()
+    batch = RemoteBatch('benchmark', '/tmp/dlab_benchmark_marker', user=args.user)
+    for i in range(steps):
+        batch.sudo(command(i))
+    batch.execute()
+    # The script upload and its run
+    return 2, time.time() - start
+
+
+if __name__ == "__main__":
+    env['connection_attempts'] = 100
+    env.key_filename = [args.keyfile]
+    env.host_string = '{}@{}'.format(args.user, args.hostname)
+    results = list()
+    with hide('running', 'stdout'):
+        sudo('true')
+        check_user()
+        for name, steps in functions:
+            separate = min([run_separately(steps) for i in range(args.repeats)], key=lambda result: result[1])
+            batched = min([run_batch(steps) for i in range(args.repeats)], key=lambda result: result[1])
+            results.append((name, separate, batched))
+        sudo('rm -f /tmp/dlab_benchmark_marker')
+    for name, separate, batched in results:
+        print('{:<30} round trips: {:>3} -> {:>3}  wall: {:>6.2f}s -> {:>6.2f}s'.format(
+            name, separate[0], batched[0], separate[1], batched[1]))
+    print('Round trips saved: {}'.format(sum([separate[0] - batched[0] for name, separate, batched in results])))
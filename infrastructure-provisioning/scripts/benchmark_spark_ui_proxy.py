@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+import httplib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+parser = argparse.ArgumentParser(description='Measures bytes sent and CPU of the edge nginx for a Spark master UI '
+                                             'with rewriting of all types, of text/html only and with '
+                                             'spark.ui.reverseProxy')
+parser.add_argument('--nginx', type=str, default='nginx', help='Nginx binary')
+parser.add_argument('--workers', type=int, default=20, help='Workers listed by the master UI')
+parser.add_argument('--page_loads', type=int, default=500, help='Page loads per measurement')
+parser.add_argument('--sessions', type=int, default=4, help='Concurrent browser sessions')
+parser.add_argument('--port', type=int, default=18080, help='Port of the edge, the next one is used by the UI')
+parser.add_argument('--workspace', type=str, default='/tmp/dlab_spark_ui_benchmark')
+args = parser.parse_args()
+
+nginx_conf = '''
+worker_processes 1;
+pid {workspace}/nginx.pid;
+error_log {workspace}/error.log;
+events {{
+    worker_connections 4096;
+}}
+http {{
+    access_log off;
+    upstream cluster-master {{ server 127.0.0.1:{backend_port}; keepalive 8; }}
+    map $request_uri $dlab_spark_accept_encoding {{ default ""; ~/(static|api)/ $http_accept_encoding; }}
+    server {{
+        listen 127.0.0.1:{port};
+        location ^~ /cluster/ {{
+            rewrite ^/cluster/(.*)$ /$1 break;
+            proxy_pass http://cluster-master;
+            proxy_http_version 1.1;
+            proxy_set_header Connection "";
+            {location}
+        }}
+    }}
+}}
+'''
+
+sub_filters = '''
+            sub_filter_once off;
+            sub_filter '/static/' '/cluster/static/';
+            sub_filter '/app/' '/cluster/app/';
+            sub_filter '<a href="/"' '<a href="/cluster/"';
+            sub_filter '//master:7077' '//$host/cluster-client-master';
+            sub_filter '//master:6066' '//$host/cluster-cluster-master';
+'''
+# Previous edge/templates/locations/spark.conf, the text/html only mode and the spark.ui.reverseProxy mode
+modes = (
+    ('all types', 'proxy_set_header Accept-Encoding "";\n            sub_filter_types *;' + sub_filters),
+    ('text/html', 'proxy_set_header Accept-Encoding $dlab_spark_accept_encoding;' + sub_filters),
+    ('reverse proxy', '')
+)
+
+static_files = {
+    '/static/bootstrap.min.css': ''.join(['.span{0} {{ width: {0}px; background: url("/static/img/{0}.png") }}\n'
+                                          .format(i) for i in range(2500)]),
+    '/static/jquery-1.11.1.min.js': ''.join(['function f{0}(a){{return a.find("#id{0}").attr("href")}}\n'.format(i)
+                                             for i in range(2000)]),
+    '/static/dataTables.bootstrap.min.js': ''.join(['$.fn.dataTable.ext.f{0}=function(){{}};\n'.format(i)
+                                                    for i in range(1500)]),
+    '/static/utils.js': ''.join(['function formatDuration{0}(ms) {{ return ms / {0}; }}\n'.format(i)
+                                 for i in range(300)]),
+}
+
+
+def master_page():
+    # Master UI: workers and applications tables with absolute links to every node
+    rows = ''.join(['<tr><td><a href="http://10.0.0.{0}:8081">worker-2018{0:04d}-10.0.0.{0}-35000</a></td>'
+                    '<td>10.0.0.{0}:35000</td><td>ALIVE</td><td>8 (8 Used)</td><td>30.0 GB (30.0 GB Used)</td></tr>'
+                    .format(i + 2) for i in range(args.workers)])
+    apps = ''.join(['<tr><td><a href="/app/?appId=app-2018{0:04d}">app-2018{0:04d}</a></td>'
+                    '<td><a href="http://notebook:4040">PySparkShell</a></td><td>{1}</td></tr>'
+                    .format(i, args.workers * 8) for i in range(10)])
+    return ('<html><head>{0}</head><body><a href="/"><img src="/static/spark-logo-77x50px-hd.png"/></a>'
+            '<li>URL: spark://master:7077</li><li>REST URL: spark://master:6066</li>'
+            '<table>{1}</table><table>{2}</table></body></html>').format(
+        ''.join(['<script src="{}"></script>'.format(path) for path in sorted(static_files)]), rows, apps)
+
+
+def api_applications():
+    return '[' + ','.join(['{{"id":"app-2018{0:04d}","name":"PySparkShell","attempts":[{{"completed":false}}]}}'
+                           .format(i) for i in range(10)]) + ']'
+
+
+class SparkUIServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SparkUIHandler(BaseHTTPRequestHandler):
+    # Imitates the Jetty of the Spark UI, which gzips responses when the client accepts it
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path in static_files:
+            body = static_files[self.path]
+            content_type = 'text/css' if self.path.endswith('.css') else 'application/javascript'
+        elif self.path.startswith('/api/'):
+            body = api_applications()
+            content_type = 'application/json'
+        else:
+            body = master_page()
+            content_type = 'text/html;charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressed = io.BytesIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=6) as gzip_file:
+                gzip_file.write(body)
+            body = compressed.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def load_pages():
+    # A page load is the master page, its static files and the applications API on one connection
+    paths = ['/cluster/'] + ['/cluster' + path for path in sorted(static_files)] + \
+            ['/cluster/api/v1/applications']
+    received = [0]
+    lock = threading.Lock()
+    pending = [args.page_loads]
+
+    def session():
+        connection = httplib.HTTPConnection('127.0.0.1', args.port)
+        while True:
+            with lock:
+                if not pending[0]:
+                    return
+                pending[0] -= 1
+            size = 0
+            for path in paths:
+                connection.request('GET', path, headers={'Accept-Encoding': 'gzip, deflate'})
+                size += len(connection.getresponse().read())
+            with lock:
+                received[0] += size
+
+    threads = [threading.Thread(target=session) for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return received[0]
+
+
+def worker_cpu_time(master_pid):
+    # User and system time of the nginx workers in seconds
+    ticks = 0
+    for pid in subprocess.check_output(['pgrep', '-P', str(master_pid)]).split():
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / float(os.sysconf('SC_CLK_TCK'))
+
+
+def measure(index, location):
+    workspace = os.path.join(args.workspace, str(index))
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+    os.makedirs(workspace)
+    with open(os.path.join(workspace, 'nginx.conf'), 'w') as conf_file:
+        conf_file.write(nginx_conf.format(workspace=workspace, location=location, port=args.port,
+                                          backend_port=args.port + 1))
+    subprocess.check_call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf')])
+    try:
+        time.sleep(0.5)
+        with open(os.path.join(workspace, 'nginx.pid')) as pid_file:
+            master_pid = int(pid_file.read())
+        cpu_before = worker_cpu_time(master_pid)
+        start = time.time()
+        received = load_pages()
+        return received, worker_cpu_time(master_pid) - cpu_before, time.time() - start
+    finally:
+        subprocess.call([args.nginx, '-p', workspace, '-c', os.path.join(workspace, 'nginx.conf'), '-s', 'stop'])
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    ui = SparkUIServer(('127.0.0.1', args.port + 1), SparkUIHandler)
+    threading.Thread(target=ui.serve_forever).start()
+    try:
+        print('Spark master UI with {} workers, {} page loads'.format(args.workers, args.page_loads))
+        for index, (name, location) in enumerate(modes):
+            received, cpu, duration = measure(index, location)
+            print('{:<14} sent: {:>8.1f} KB/page  edge CPU: {:>6.2f}s ({:>5.2f} ms/page)  wall: {:>6.2f}s'.format(
+                name, received / 1024.0 / args.page_loads, cpu, cpu * 1000 / args.page_loads, duration))
+    finally:
+        ui.shutdown()
+        ui.server_close()
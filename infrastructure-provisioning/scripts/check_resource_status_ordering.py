@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pymongo import MongoClient
+
+parser = argparse.ArgumentParser(description='Checks the ordering guarantees of update_resource_statuses of the SSN '
+                                             'resource_status.py against a local mongod started in a temporary '
+                                             'directory')
+parser.add_argument('--mongod', type=str, default='mongod', help='Path of the mongod binary')
+parser.add_argument('--port', type=int, default=27099)
+parser.add_argument('--resources', type=int, default=20, help='Resources updated by the concurrent batches')
+parser.add_argument('--workers', type=int, default=8, help='Concurrent senders of batches')
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'ssn', 'scripts'))
+from resource_status import update_resource_statuses
+
+failures = list()
+
+
+def start_mongod(dbpath, timeout=60):
+    process = subprocess.Popen([args.mongod, '--dbpath', dbpath, '--port', str(args.port), '--bind_ip', '127.0.0.1'],
+                               stdout=open(os.path.join(dbpath, 'mongod.log'), 'a'), stderr=subprocess.STDOUT)
+    client = MongoClient('127.0.0.1', args.port, serverSelectionTimeoutMS=500)
+    start = time.time()
+    while True:
+        try:
+            client.admin.command('ping')
+            return process
+        except Exception:
+            if process.poll() is not None or time.time() - start > timeout:
+                raise Exception('mongod did not start, see {}'.format(os.path.join(dbpath, 'mongod.log')))
+            time.sleep(0.2)
+
+
+def stored(statuses, resource):
+    document = statuses.find_one({'_id': resource}) or {}
+    return document.get('value'), document.get('updated')
+
+
+def check(name, actual, expected):
+    if actual == expected:
+        print('OK    {}'.format(name))
+    else:
+        print('FAIL  {}: {} instead of {}'.format(name, actual, expected))
+        failures.append(name)
+
+
+def check_sequential(statuses):
+    update_resource_statuses([['edge', 'creating', 1]], statuses)
+    update_resource_statuses([['edge', 'running', 2]], statuses)
+    check('newer update replaces the stored status', stored(statuses, 'edge'), ('running', 2))
+    update_resource_statuses([['edge', 'creating', 1]], statuses)
+    check('older update does not replace a newer status', stored(statuses, 'edge'), ('running', 2))
+    update_resource_statuses([['edge', 'stopping', 3], ['edge', 'stopped', 4]], statuses)
+    update_resource_statuses([['edge', 'stopping', 3], ['edge', 'stopped', 4]], statuses)
+    check('retried batch leaves the same status', stored(statuses, 'edge'), ('stopped', 4))
+    update_resource_statuses([['ssn', 'running', 6], ['ssn', 'starting', 5]], statuses)
+    check('latest update of a batch wins whatever its position', stored(statuses, 'ssn'), ('running', 6))
+    statuses.insert_one({'_id': 'nb', 'value': 'running'})
+    update_resource_statuses([['nb', 'stopped', 1]], statuses)
+    check('status stored without a time is replaced', stored(statuses, 'nb'), ('stopped', 1))
+
+
+def check_concurrent(statuses):
+    # Updates of every resource with distinct times, sent in shuffled batches by concurrent senders.
+    # Stale upserts of resources not stored yet race with newer ones and fail with duplicate keys
+    updates = [['resource-{}'.format(i), 'status-{}'.format(j), 100 + j + random.random() / 2]
+               for i in range(args.resources) for j in range(args.workers * 2)]
+    random.shuffle(updates)
+    expected = dict()
+    for resource, status, updated in updates:
+        if resource not in expected or expected[resource][1] < updated:
+            expected[resource] = (status, updated)
+    batches = [updates[i::args.workers * 4] for i in range(args.workers * 4)]
+    errors = list()
+
+    def send(batches):
+        try:
+            for batch in batches:
+                update_resource_statuses(batch, statuses)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=send, args=(batches[i::args.workers],)) for i in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    check('concurrent batches raise no errors', errors, [])
+    check('concurrent batches keep the newest status of every resource',
+          dict([(resource, stored(statuses, resource)) for resource in expected]), expected)
+
+
+def check_reconnect(statuses, dbpath, process):
+    # mongod goes down and comes back while the update waits between its attempts
+    process.terminate()
+    process.wait()
+    restarted = list()
+    restart = threading.Timer(1, lambda: restarted.append(start_mongod(dbpath)))
+    restart.start()
+    start = time.time()
+    update_resource_statuses([['edge', 'terminated', 10]], statuses)
+    restart.join()
+    print('      written {:.1f}s after mongod was stopped'.format(time.time() - start))
+    check('update is retried until mongod is back', stored(statuses, 'edge'), ('terminated', 10))
+    return restarted[0]
+
+
+if __name__ == "__main__":
+    dbpath = tempfile.mkdtemp()
+    process = start_mongod(dbpath)
+    try:
+        statuses = MongoClient('127.0.0.1', args.port, serverSelectionTimeoutMS=500).dlabdb.statuses
+        check_sequential(statuses)
+        statuses.drop()
+        check_concurrent(statuses)
+        process = check_reconnect(statuses, dbpath, process)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(dbpath)
+    if failures:
+        print('{} checks failed'.format(len(failures)))
+        sys.exit(1)
+    print('All checks passed')
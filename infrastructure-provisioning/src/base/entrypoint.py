@@ -19,17 +19,52 @@
 # ******************************************************************************
 
 import os
-from ConfigParser import SafeConfigParser
 import argparse
 from fabric.api import *
 import json
 import sys
 import select
+import glob
+import time
+import fcntl
+import runpy
+import ctypes
+import ctypes.util
+import traceback
+from dlab.config import load_config
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--action', type=str, default='')
+parser.add_argument('--daemon', action='store_true',
+                    help='Keep running and serve requests from the spool directory instead of a single action')
+parser.add_argument('--spool_dir', type=str, default='/spool')
+parser.add_argument('--workers', type=int, default=1, help='Number of requests served concurrently in daemon mode')
+parser.add_argument('--poll_interval', type=float, default=0.2)
 args = parser.parse_args()
 
+actions = {
+    'create': '/bin/create.py',
+    'status': '/bin/status.py',
+    'stop': '/bin/stop.py',
+    'start': '/bin/start.py',
+    'terminate': '/bin/terminate.py',
+    'configure': '/bin/configure.py',
+    'recreate': '/bin/recreate.py',
+    'reupload_key': '/bin/reupload_key.py',
+    'lib_install': '/bin/install_libs.py',
+    'lib_list': '/bin/list_libs.py',
+    'git_creds': '/bin/git_creds.py',
+    'create_image': '/bin/create_image.py',
+    'terminate_image': '/bin/terminate_image.py'
+}
+
+# Modules imported once by the daemon, so every forked request starts with them loaded
+preloaded_modules = ['boto3', 'botocore', 'googleapiclient.discovery', 'google.cloud.storage',
+                     'azure.common.client_factory', 'dlab.fab', 'dlab.meta_lib', 'dlab.actions_lib']
+
+result_file = '/root/result.json'
+worker_lock_file = '/var/lock/dlab_worker.lock'
+
 
 def get_from_stdin():
     lines = []
@@ -44,128 +79,176 @@ def get_from_stdin():
     else:
         return "{}"
 
-if __name__ == "__main__":
-    # Get request ID as if it will need everywhere
-    request_id = 'ssn'
-    try:
-        request_id = os.environ['request_id']
-    except:
-        os.environ['request_id'] = 'ssn'
 
-    # Get config from STDIN
-    stdin_contents = get_from_stdin()
-    try:
-        passed_as_json = json.loads(stdin_contents)
-    except:
-        with open("/response/{}.json".format(request_id), 'w') as response_file:
-            reply = dict()
-            reply['request_id'] = os.environ['request_id']
-            reply['status'] = 'err'
-            reply['response'] = dict()
-            reply['response']['result'] = "Malformed config passed in stdin"
-            reply['response']['stdin_contents'] = stdin_contents
-            response_file.write(json.dumps(reply))
-        sys.exit(1)
+def write_malformed_config_response(request_id, stdin_contents):
+    with open("/response/{}.json".format(request_id), 'w') as response_file:
+        reply = dict()
+        reply['request_id'] = request_id
+        reply['status'] = 'err'
+        reply['response'] = dict()
+        reply['response']['result'] = "Malformed config passed in stdin"
+        reply['response']['stdin_contents'] = stdin_contents
+        response_file.write(json.dumps(reply))
 
-    # Get config (defaults) from files. Will not overwrite any env
-    for filename in os.listdir('/root/conf'):
-        if filename.endswith('.ini'):
-            config = SafeConfigParser()
-            config.read(os.path.join('/root/conf', filename))
-            for section in config.sections():
-                for option in config.options(section):
-                    varname = "{0}_{1}".format(section, option)
-                    if varname not in os.environ:
-                        os.environ[varname] = config.get(section, option)
-
-    # Overwrite config if overwrite.ini is provided
-    for filename in os.listdir('/root/conf'):
-        if filename.endswith('overwrite.ini'):
-            config = SafeConfigParser()
-            config.read(os.path.join('/root/conf', filename))
-            for section in config.sections():
-                for option in config.options(section):
-                    varname = "{0}_{1}".format(section, option)
-                    os.environ[varname] = config.get(section, option)
 
+def apply_config(environ, defaults, overwrites, passed_as_json):
+    # Defaults will not overwrite any env, overwrite.ini and stdin config will
+    for varname in defaults:
+        if varname not in environ:
+            environ[varname] = defaults[varname]
+    environ.update(overwrites)
     for option in passed_as_json:
         try:
-            os.environ[option] = passed_as_json[option]
+            environ[option] = passed_as_json[option]
         except:
-            os.environ[option] = str(passed_as_json[option])
+            environ[option] = str(passed_as_json[option])
 
-    # Pre-execution steps: checking for dry running
-    dry_run = False
-    try:
-        if os.environ['dry_run'] == 'true':
-            dry_run = True
-    except:
-        pass
 
-    with hide('running'):
-        local('chmod 600 /root/keys/*.pem')
+def prepare_keys():
+    for key_file in glob.glob('/root/keys/*.pem'):
+        os.chmod(key_file, 0600)
 
-    if dry_run:
+
+def run_action(action, request_id, in_process=False):
+    # Pre-execution steps: checking for dry running
+    if os.environ.get('dry_run') == 'true':
         with open("/response/{}.json".format(request_id), 'w') as response_file:
-            response = {"request_id": request_id, "action": args.action, "dry_run": "true"}
+            response = {"request_id": request_id, "action": action, "dry_run": "true"}
             response_file.write(json.dumps(response))
-
-    # Run execution routines
-    elif args.action == 'create':
-        with hide('running'):
-            local("/bin/create.py")
-
-    elif args.action == 'status':
-        with hide('running'):
-            local("/bin/status.py")
-
-    elif args.action == 'describe':
+    elif action == 'describe':
         with open('/root/description.json') as json_file:
             description = json.load(json_file)
             description['request_id'] = request_id
             with open("/response/{}.json".format(request_id), 'w') as response_file:
                 response_file.write(json.dumps(description))
+    elif action in actions:
+        if in_process:
+            sys.argv = [actions[action]]
+            try:
+                runpy.run_path(actions[action], run_name='__main__')
+            except SystemExit as err:
+                return err.code or 0
+        else:
+            with hide('running'):
+                local(actions[action])
+    return 0
+
+
+def isolate_request():
+    # Gives the request private /tmp and /root/result.json in its own mount namespace. Without
+    # CAP_SYS_ADMIN that is not possible, so requests are serialized on a lock file instead. The lock is
+    # held as long as the returned file is open, the caller keeps it until the request has finished.
+    clone_newns, ms_bind, ms_rec, ms_private = 0x00020000, 4096, 16384, 1 << 18
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not os.path.exists(result_file):
+        open(result_file, 'a').close()
+    if libc.unshare(clone_newns) == 0 and \
+            libc.mount('none', '/', None, ms_rec | ms_private, None) == 0 and \
+            libc.mount('tmpfs', '/tmp', 'tmpfs', 0, None) == 0:
+        open('/tmp/result.json', 'w').close()
+        if libc.mount('/tmp/result.json', result_file, None, ms_bind, None) == 0:
+            return None
+    lock = open(worker_lock_file, 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    open(result_file, 'w').close()
+    return lock
+
+
+def handle_request(request_path, base_environ, defaults, overwrites):
+    os.environ.clear()
+    os.environ.update(base_environ)
+    try:
+        with open(request_path) as request_file:
+            request = json.load(request_file)
+        # "environment" acts as docker run -e, "config" as the JSON passed in stdin
+        os.environ.update(request.get('environment', {}))
+    except:
+        traceback.print_exc(file=sys.stdout)
+        request = dict()
+    request_id = os.environ.setdefault('request_id', 'ssn')
+    if not isinstance(request.get('config'), dict):
+        write_malformed_config_response(request_id, str(request.get('config')))
+        return 1
+    lock = isolate_request()
+    try:
+        apply_config(os.environ, defaults, overwrites, request['config'])
+        prepare_keys()
+        return run_action(request.get('action', ''), request_id, in_process=True)
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def serve_spool(spool_dir, workers, poll_interval):
+    # Requests are written as <spool_dir>/<name>.json (atomically, via rename) and contain
+    # {"action": ..., "environment": {...}, "config": {...}}. Each one is claimed by renaming it,
+    # served in a forked child of this warm process and removed once the child has exited.
+    for module in preloaded_modules:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    defaults, overwrites = load_config()
+    base_environ = dict(os.environ)
+    if not os.path.exists(spool_dir):
+        os.makedirs(spool_dir)
+    running = dict()
+    print("Serving requests from {} with {} workers".format(spool_dir, workers))
+    while True:
+        for pid in list(running):
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                request_path, started = running.pop(pid)
+                print("Request {} finished with status {} in {:.2f}s".format(
+                    os.path.basename(request_path), os.WEXITSTATUS(status), time.time() - started))
+                os.remove(request_path)
+        for filename in sorted(os.listdir(spool_dir)):
+            if len(running) >= workers:
+                break
+            if not filename.endswith('.json'):
+                continue
+            request_path = os.path.join(spool_dir, filename + '.running')
+            try:
+                os.rename(os.path.join(spool_dir, filename), request_path)
+            except OSError:
+                continue
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    code = handle_request(request_path, base_environ, defaults, overwrites)
+                except:
+                    traceback.print_exc(file=sys.stdout)
+                finally:
+                    sys.stdout.flush()
+                    os._exit(code if isinstance(code, int) else 1)
+            running[pid] = (request_path, time.time())
+        time.sleep(poll_interval)
 
-    elif args.action == 'stop':
-        with hide('running'):
-            local("/bin/stop.py")
-
-    elif args.action == 'start':
-        with hide('running'):
-            local("/bin/start.py")
-
-    elif args.action == 'terminate':
-        with hide('running'):
-            local("/bin/terminate.py")
-
-    elif args.action == 'configure':
-        with hide('running'):
-            local("/bin/configure.py")
-
-    elif args.action == 'recreate':
-        with hide('running'):
-            local("/bin/recreate.py")
 
-    elif args.action == 'reupload_key':
-        with hide('running'):
-            local("/bin/reupload_key.py")
+if __name__ == "__main__":
+    if args.daemon:
+        serve_spool(args.spool_dir, args.workers, args.poll_interval)
 
-    elif args.action == 'lib_install':
-        with hide('running'):
-            local("/bin/install_libs.py")
+    # Get request ID as if it will need everywhere
+    request_id = 'ssn'
+    try:
+        request_id = os.environ['request_id']
+    except:
+        os.environ['request_id'] = 'ssn'
 
-    elif args.action == 'lib_list':
-        with hide('running'):
-            local("/bin/list_libs.py")
+    # Get config from STDIN
+    stdin_contents = get_from_stdin()
+    try:
+        passed_as_json = json.loads(stdin_contents)
+    except:
+        write_malformed_config_response(os.environ['request_id'], stdin_contents)
+        sys.exit(1)
 
-    elif args.action == 'git_creds':
-        with hide('running'):
-            local("/bin/git_creds.py")
+    # Get config (defaults) from the snapshot compiled at build time, overwrite.ini values overwrite env
+    defaults, overwrites = load_config()
+    apply_config(os.environ, defaults, overwrites, passed_as_json)
 
-    elif args.action == 'create_image':
-        with hide('running'):
-            local("/bin/create_image.py")
+    prepare_keys()
 
-    elif args.action == 'terminate_image':
-        with hide('running'):
-            local("/bin/terminate_image.py")
\ No newline at end of file
+    run_action(args.action, request_id)
@@ -38,6 +38,7 @@ parser.add_argument('--scala_version', type=str, default='')
 parser.add_argument('--r_mirror', type=str, default='')
 parser.add_argument('--master_ip', type=str, default='')
 parser.add_argument('--node_type', type=str, default='')
+parser.add_argument('--proxy_base', type=str, default='', help='Location of the cluster on the edge')
 args = parser.parse_args()
 
 spark_version = args.spark_version
@@ -103,6 +104,17 @@ def start_spark(os_user, master_ip, node):
             sudo('systemctl start spark-slave.service')
         sudo('touch /home/{0}/.ensure_dir/start_spark-{1}_ensured'.format(os_user, node))
 
+def configure_ui_reverse_proxy(os_user, proxy_base):
+    # Master and workers UIs link to each other and to applications through the master under proxy_base,
+    # so the edge passes them through without rewriting. The edge strips proxy_base from the requests,
+    # spark.ui.proxyBase puts it back in front of the /static/, /app/ and /proxy/ links of the pages
+    if not ensured(os_user, 'spark_ui_reverse_proxy_ensured', {"proxy_base": proxy_base}):
+        sudo('sed -i "/spark.ui.reverseProxy/d; /spark.ui.proxyBase/d" /opt/spark/conf/spark-defaults.conf')
+        sudo('echo "spark.ui.reverseProxy    true" >> /opt/spark/conf/spark-defaults.conf')
+        sudo('echo "spark.ui.reverseProxyUrl    {}" >> /opt/spark/conf/spark-defaults.conf'.format(proxy_base))
+        sudo('echo "spark.ui.proxyBase    {}" >> /opt/spark/conf/spark-defaults.conf'.format(proxy_base))
+        set_ensured(os_user, 'spark_ui_reverse_proxy_ensured', {"proxy_base": proxy_base})
+
 ##############
 # Run script #
 ##############
@@ -148,6 +160,9 @@ if __name__ == "__main__":
     ensure_local_jars(args.os_user, jars_dir)
     print("Configure local Spark")
     configure_local_spark(args.os_user, jars_dir, args.region, templates_dir, '')
+    if args.proxy_base and spark_ui_reverse_proxy_supported(spark_version):
+        print("Configure Spark UI reverse proxy")
+        configure_ui_reverse_proxy(args.os_user, args.proxy_base)
 
     # INSTALL TENSORFLOW AND OTHER DEEP LEARNING LIBRARIES
     if os.environ['application'] in ('tensor', 'tensor-rstudio', 'deeplearning'):
@@ -76,13 +76,13 @@ gitlab_certfile = os.environ['conf_gitlab_certfile']
 
 
 def install_itorch(os_user):
-    if not exists('/home/{}/.ensure_dir/itorch_ensured'.format(os_user)):
+    if not ensured(os_user, 'itorch_ensured'):
         run('git clone https://github.com/facebook/iTorch.git')
         with cd('/home/{}/iTorch/'.format(os_user)):
             run('luarocks make')
         sudo('cp -rf /home/{0}/.ipython/kernels/itorch/ /home/{0}/.local/share/jupyter/kernels/'.format(os_user))
         sudo('chown -R {0}:{0} /home/{0}/.local/share/jupyter/'.format(os_user))
-        sudo('touch /home/{}/.ensure_dir/itorch_ensured'.format(os_user))
+        set_ensured(os_user, 'itorch_ensured')
 
 
 if __name__ == "__main__":
@@ -96,7 +96,7 @@ if __name__ == "__main__":
     try:
         if not exists('/home/' + args.os_user + '/.ensure_dir'):
             sudo('mkdir /home/' + args.os_user + '/.ensure_dir')
-            sudo('touch /home/' + args.os_user + '/.ensure_dir/deep_learning')
+            set_ensured(args.os_user, 'deep_learning')
     except:
         sys.exit(1)
     print("Mount additional volume")
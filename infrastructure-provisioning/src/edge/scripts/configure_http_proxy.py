@@ -20,10 +20,11 @@
 
 from fabric.api import *
 from fabric.contrib.files import exists
-from dlab.edge_lib import configure_http_proxy_server
+from dlab.edge_lib import configure_http_proxy_server, configure_package_mirror
 import argparse
 import json
 import sys
+import os
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--hostname', type=str, default='')
@@ -42,11 +43,22 @@ if __name__ == "__main__":
         env.key_filename = [args.keyfile]
         env.host_string = '{}@{}'.format(args.user, args.hostname)
         deeper_config = json.loads(args.additional_config)
+        if os.environ.get('edge_package_cache_enabled') == 'true':
+            deeper_config['package_cache'] = True
+            deeper_config['package_cache_template_file'] = '/root/templates/squid_package_cache.conf'
+            deeper_config['package_cache_size'] = os.environ['edge_package_cache_size']
+            deeper_config['package_cache_max_object_size'] = os.environ['edge_package_cache_max_object_size']
+            deeper_config['package_mirror_template_file'] = '/root/templates/package_mirror.service'
+            deeper_config['package_mirror_version'] = os.environ['edge_package_mirror_version']
+            deeper_config['package_mirror_port'] = os.environ['edge_package_mirror_port']
     except:
         sys.exit(2)
 
     print("Installing proxy for notebooks.")
-    if configure_http_proxy_server(deeper_config):
-        sys.exit(0)
-    else:
+    if not configure_http_proxy_server(deeper_config):
         sys.exit(1)
+    if deeper_config.get('package_cache'):
+        print("Installing package mirror for notebooks.")
+        if not configure_package_mirror(deeper_config):
+            sys.exit(1)
+    sys.exit(0)
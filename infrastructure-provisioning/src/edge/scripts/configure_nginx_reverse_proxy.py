@@ -53,7 +53,8 @@ if __name__ == "__main__":
         install_nginx_ldap(args.hostname, os.environ['reverse_proxy_nginx_version'],
                            os.environ['ldap_hostname'], os.environ['ldap_dn'],
                            os.environ['ldap_ou'], os.environ['ldap_service_password'],
-                           os.environ['ldap_service_username'], os.environ['aws_iam_user'])
+                           os.environ['ldap_service_username'], os.environ['aws_iam_user'],
+                           os.environ.get('ldap_auth_cache_size', 1000), os.environ.get('ldap_auth_cache_ttl', 300))
     except Exception as err:
         print("Failed install nginx reverse proxy: " + str(err))
         sys.exit(1)
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+from fabric.api import *
+import argparse
+import json
+import sys
+
+parser = argparse.ArgumentParser(description='Prints hit/miss counters of the edge package cache as JSON')
+parser.add_argument('--hostname', type=str, default='')
+parser.add_argument('--keyfile', type=str, default='')
+parser.add_argument('--user', type=str, default='')
+parser.add_argument('--access_log', type=str, default='/var/log/squid/access.log')
+args = parser.parse_args()
+
+# Squid native log: time elapsed client code/status bytes method URL ...
+# Requests are grouped by package type, cache hits are served from disk or memory, or revalidated
+squid_summary = '''awk '{
+    type = "other";
+    if ($6 == "CONNECT") type = "https";
+    else if ($7 ~ /\\.(deb|udeb)$/ || $7 ~ /\\/dists\\//) type = "apt";
+    else if ($7 ~ /\\.(rpm|drpm)$/ || $7 ~ /\\/repodata\\//) type = "yum";
+    else if ($7 ~ /\\/src\\/contrib\\//) type = "cran";
+    else if ($7 ~ /\\.(jar|pom)$/ || $7 ~ /maven-metadata\\.xml$/) type = "maven";
+    else if ($7 ~ /\\.whl$/ || $7 ~ /\\/\\+(simple|f)\\//) type = "pypi";
+    result = ($4 ~ /HIT|REFRESH_UNMODIFIED/) ? "hit" : "miss";
+    requests[type " " result]++;
+    bytes[type " " result] += $5;
+} END {
+    for (key in requests) print key, requests[key], bytes[key];
+}' '''
+
+
+def get_squid_stats():
+    stats = dict()
+    output = sudo(squid_summary + args.access_log)
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 4:
+            continue
+        package_type, result, requests, size = fields
+        item = stats.setdefault(package_type, {"requests": 0, "hits": 0, "bytes": 0, "hit_bytes": 0})
+        item['requests'] += int(requests)
+        item['bytes'] += int(size)
+        if result == 'hit':
+            item['hits'] += int(requests)
+            item['hit_bytes'] += int(size)
+    for item in stats.values():
+        item['hit_ratio'] = round(float(item['hits']) / item['requests'], 3) if item['requests'] else 0
+    return stats
+
+
+def get_mirror_stats():
+    # Files the PyPI mirror has downloaded once and serves from disk since then
+    with settings(warn_only=True):
+        output = sudo('find /var/cache/devpi -path "*/+f/*" -type f -printf "%s\\n" 2>/dev/null')
+    sizes = [int(size) for size in output.split()]
+    return {"files": len(sizes), "bytes": sum(sizes)}
+
+
+##############
+# Run script #
+##############
+if __name__ == "__main__":
+    env['connection_attempts'] = 100
+    env.key_filename = [args.keyfile]
+    env.host_string = '{}@{}'.format(args.user, args.hostname)
+    try:
+        with hide('running', 'stdout'):
+            stats = {"squid": get_squid_stats(), "pypi_mirror": get_mirror_stats()}
+        print(json.dumps(stats, indent=2, sort_keys=True))
+    except Exception as err:
+        print("Failed to collect package cache stats: " + str(err))
+        sys.exit(1)
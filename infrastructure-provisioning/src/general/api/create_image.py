@@ -22,12 +22,15 @@ import os
 import json
 import sys
 from fabric.api import local
+from dlab.fab import run_fab_task
+from dlab.trace import start_trace, export_trace
 
 
 if __name__ == "__main__":
+    start_trace()
     success = True
     try:
-        local('cd /root; fab create_image')
+        run_fab_task('create_image')
     except:
         success = False
 
@@ -50,6 +53,8 @@ if __name__ == "__main__":
                                                                           os.environ['edge_user_name'],
                                                                           os.environ['request_id'])
 
+    export_trace("/response/{}_{}_{}.json".format(os.environ['conf_resource'], os.environ['edge_user_name'],
+                                                  os.environ['request_id']))
     with open("/response/{}_{}_{}.json".format(os.environ['conf_resource'], os.environ['edge_user_name'],
                                                os.environ['request_id']), 'w') as response_file:
         response_file.write(json.dumps(reply))
@@ -22,12 +22,15 @@ import os
 import json
 import sys
 from fabric.api import local
+from dlab.fab import run_fab_task
+from dlab.trace import start_trace, export_trace
 
 
 if __name__ == "__main__":
+    start_trace()
     success = True
     try:
-        local('cd /root; fab terminate')
+        run_fab_task('terminate')
     except:
         success = False
 
@@ -49,6 +52,7 @@ if __name__ == "__main__":
     if os.environ['conf_resource'] == 'ssn':
         reply['response']['log'] = "/response/{}.log".format(os.environ['request_id'])
 
+        export_trace("/response/{}.json".format(os.environ['request_id']))
         with open("/response/{}.json".format(os.environ['request_id']), 'w') as response_file:
             response_file.write(json.dumps(reply))
     else:
@@ -56,6 +60,8 @@ if __name__ == "__main__":
                                                                               os.environ['edge_user_name'],
                                                                               os.environ['request_id'])
 
+        export_trace("/response/{}_{}_{}.json".format(os.environ['conf_resource'], os.environ['edge_user_name'],
+                                                      os.environ['request_id']))
         with open("/response/{}_{}_{}.json".format(os.environ['conf_resource'], os.environ['edge_user_name'],
                                                    os.environ['request_id']), 'w') as response_file:
             response_file.write(json.dumps(reply))
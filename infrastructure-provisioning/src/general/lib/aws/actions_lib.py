@@ -34,6 +34,7 @@ import traceback
 import urllib2
 import meta_lib
 import dlab.fab
+from dlab.state import ensured, set_ensured
 
 
 def backoff_log(err):
@@ -220,19 +221,91 @@ def create_subnet(vpc_id, subnet, tag):
 def create_security_group(security_group_name, vpc_id, security_group_rules, egress, tag):
     ec2 = boto3.resource('ec2')
     group = ec2.create_security_group(GroupName=security_group_name, Description='security_group_name', VpcId=vpc_id)
-    time.sleep(10)
+    ec2.meta.client.get_waiter('security_group_exists').wait(GroupIds=[group.id])
     create_tag(group.id, tag)
-    try:
-        group.revoke_egress(IpPermissions=[{"IpProtocol": "-1", "IpRanges": [{"CidrIp": "0.0.0.0/0"}], "UserIdGroupPairs": [], "PrefixListIds": []}])
-    except:
-        print("Mentioned rule does not exist")
-    for rule in security_group_rules:
-        group.authorize_ingress(IpPermissions=[rule])
-    for rule in egress:
-        group.authorize_egress(IpPermissions=[rule])
+    reconcile_sg_rules(group.id, security_group_rules, egress)
     return group.id
 
 
+def split_sg_permissions(permissions):
+    # Breaks IpPermissions into single-source rules, so that rules granted in one call
+    # and rules returned by describe_security_groups can be compared one by one
+    rules = list()
+    sources = [('IpRanges', 'CidrIp'), ('Ipv6Ranges', 'CidrIpv6'), ('UserIdGroupPairs', 'GroupId'),
+               ('PrefixListIds', 'PrefixListId')]
+    for permission in permissions:
+        base_rule = {'IpProtocol': str(permission['IpProtocol'])}
+        if base_rule['IpProtocol'] != '-1':
+            base_rule['FromPort'] = permission.get('FromPort', -1)
+            base_rule['ToPort'] = permission.get('ToPort', -1)
+        for source_type, source_key in sources:
+            for source in permission.get(source_type, []):
+                rule = dict(base_rule)
+                rule[source_type] = [{source_key: source[source_key]}]
+                rules.append(rule)
+    return rules
+
+
+def wait_sg_rules_propagated(sg_id, ingress_rules, egress_rules, timeout=60):
+    client = boto3.client('ec2')
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        group = client.describe_security_groups(GroupIds=[sg_id])['SecurityGroups'][0]
+        ingress_diff = dlab.fab.get_rules_diff(ingress_rules, split_sg_permissions(group['IpPermissions']))
+        egress_diff = dlab.fab.get_rules_diff(egress_rules, split_sg_permissions(group['IpPermissionsEgress']))
+        if not ingress_diff[0] and not egress_diff[0]:
+            return True
+        time.sleep(2)
+    print("Rules of security group {} are not visible after {} seconds".format(sg_id, timeout))
+    return False
+
+
+def reconcile_sg_rules(sg_id, ingress=None, egress=None, revoke=True):
+    # Brings the security group to the desired rule set with one describe call and at most one
+    # authorize/revoke call per direction. None leaves the direction untouched, revoke=False only adds rules.
+    # Returns the number of changed rules, waiting for propagation only when something was changed.
+    try:
+        client = boto3.client('ec2')
+        group = client.describe_security_groups(GroupIds=[sg_id])['SecurityGroups'][0]
+        changes = 0
+        desired_rules = {'ingress': list(), 'egress': list()}
+        for direction, rules, current in (('ingress', ingress, group['IpPermissions']),
+                                          ('egress', egress, group['IpPermissionsEgress'])):
+            if rules is None:
+                continue
+            desired_rules[direction] = split_sg_permissions(rules)
+            to_add, to_remove = dlab.fab.get_rules_diff(desired_rules[direction], split_sg_permissions(current))
+            if to_add:
+                print("Adding {} {} rules to security group {}".format(len(to_add), direction, sg_id))
+                try:
+                    getattr(client, 'authorize_security_group_{}'.format(direction))(GroupId=sg_id,
+                                                                                    IpPermissions=to_add)
+                except ClientError as err:
+                    if err.response['Error']['Code'] != 'InvalidPermission.Duplicate':
+                        raise
+                    for rule in to_add:
+                        if direction == 'ingress':
+                            add_inbound_sg_rule(sg_id, rule)
+                        else:
+                            add_outbound_sg_rule(sg_id, rule)
+                changes += len(to_add)
+            if to_remove and revoke:
+                print("Revoking {} {} rules from security group {}".format(len(to_remove), direction, sg_id))
+                getattr(client, 'revoke_security_group_{}'.format(direction))(GroupId=sg_id,
+                                                                             IpPermissions=to_remove)
+                changes += len(to_remove)
+        if changes:
+            wait_sg_rules_propagated(sg_id, desired_rules['ingress'], desired_rules['egress'])
+        else:
+            print("Security group {} is up to date".format(sg_id))
+        return changes
+    except Exception as err:
+        logging.info("Unable to reconcile SG rules: " + str(err) + "\n Traceback: " + traceback.format_exc())
+        append_result(str({"error": "Unable to reconcile SG rules", "error_message": str(err) + "\n Traceback: " + traceback.format_exc()}))
+        traceback.print_exc(file=sys.stdout)
+        raise
+
+
 def enable_auto_assign_ip(subnet_id):
     try:
         client = boto3.client('ec2')
@@ -867,61 +940,8 @@ def remove_kernels(emr_name, tag_name, nb_tag_value, ssh_user, key_path, emr_ver
         inst = ec2.instances.filter(
             Filters=[{'Name': 'instance-state-name', 'Values': ['running']},
                      {'Name': 'tag:{}'.format(tag_name), 'Values': ['{}'.format(nb_tag_value)]}])
-        instances = list(inst)
-        if instances:
-            for instance in instances:
-                private = getattr(instance, 'private_dns_name')
-                env.hosts = "{}".format(private)
-                env.user = "{}".format(ssh_user)
-                env.key_filename = "{}".format(key_path)
-                env.host_string = env.user + "@" + env.hosts
-                sudo('rm -rf /home/{}/.local/share/jupyter/kernels/*_{}'.format(ssh_user, emr_name))
-                if exists('/home/{}/.ensure_dir/dataengine-service_{}_interpreter_ensured'.format(ssh_user, emr_name)):
-                    if os.environ['notebook_multiple_clusters'] == 'true':
-                        try:
-                            livy_port = sudo("cat /opt/" + emr_version + "/" + emr_name
-                                             + "/livy/conf/livy.conf | grep livy.server.port | tail -n 1 | awk '{printf $3}'")
-                            process_number = sudo("netstat -natp 2>/dev/null | grep ':" + livy_port +
-                                                  "' | awk '{print $7}' | sed 's|/.*||g'")
-                            sudo('kill -9 ' + process_number)
-                            sudo('systemctl disable livy-server-' + livy_port)
-                        except:
-                            print("Wasn't able to find Livy server for this EMR!")
-                    sudo('sed -i \"s/^export SPARK_HOME.*/export SPARK_HOME=\/opt\/spark/\" /opt/zeppelin/conf/zeppelin-env.sh')
-                    sudo("rm -rf /home/{}/.ensure_dir/dataengine-service_interpreter_ensure".format(ssh_user))
-                    zeppelin_url = 'http://' + private + ':8080/api/interpreter/setting/'
-                    opener = urllib2.build_opener(urllib2.ProxyHandler({}))
-                    req = opener.open(urllib2.Request(zeppelin_url))
-                    r_text = req.read()
-                    interpreter_json = json.loads(r_text)
-                    interpreter_prefix = emr_name
-                    for interpreter in interpreter_json['body']:
-                        if interpreter_prefix in interpreter['name']:
-                            print("Interpreter with ID: {0} and name: {1} will be removed from zeppelin!".
-                                  format(interpreter['id'], interpreter['name']))
-                            request = urllib2.Request(zeppelin_url + interpreter['id'], data='')
-                            request.get_method = lambda: 'DELETE'
-                            url = opener.open(request)
-                            print(url.read())
-                    sudo('chown ' + ssh_user + ':' + ssh_user + ' -R /opt/zeppelin/')
-                    sudo('systemctl daemon-reload')
-                    sudo("service zeppelin-notebook stop")
-                    sudo("service zeppelin-notebook start")
-                    zeppelin_restarted = False
-                    while not zeppelin_restarted:
-                        sudo('sleep 5')
-                        result = sudo('nmap -p 8080 localhost | grep "closed" > /dev/null; echo $?')
-                        result = result[:1]
-                        if result == '1':
-                            zeppelin_restarted = True
-                    sudo('sleep 5')
-                    sudo('rm -rf /home/{}/.ensure_dir/dataengine-service_{}_interpreter_ensured'.format(ssh_user, emr_name))
-                if exists('/home/{}/.ensure_dir/rstudio_dataengine-service_ensured'.format(ssh_user)):
-                    dlab.fab.remove_rstudio_dataengines_kernel(emr_name, ssh_user)
-                sudo('rm -rf  /opt/' + emr_version + '/' + emr_name + '/')
-                print("Notebook's {} kernels were removed".format(env.hosts))
-        else:
-            print("There are no notebooks to clean kernels.")
+        dlab.fab.remove_cluster_kernels([getattr(instance, 'private_dns_name') for instance in inst], ssh_user, key_path,
+                                        emr_name, '/opt/{}/{}/'.format(emr_version, emr_name), 'dataengine-service')
     except Exception as err:
         logging.info("Unable to remove kernels on Notebook: " + str(err) + "\n Traceback: " + traceback.print_exc(file=sys.stdout))
         append_result(str({"error": "Unable to remove kernels on Notebook", "error_message": str(err) + "\n Traceback: " + traceback.print_exc(file=sys.stdout)}))
@@ -1218,7 +1238,7 @@ def spark_defaults(args):
 
 
 def ensure_local_jars(os_user, jars_dir):
-    if not exists('/home/{}/.ensure_dir/local_jars_ensured'.format(os_user)):
+    if not ensured(os_user, 'local_jars_ensured'):
         try:
             sudo('mkdir -p ' + jars_dir)
             sudo('wget http://central.maven.org/maven2/org/apache/hadoop/hadoop-aws/2.7.4/hadoop-aws-2.7.4.jar -O ' +
@@ -1227,13 +1247,13 @@ def ensure_local_jars(os_user, jars_dir):
                  jars_dir + 'aws-java-sdk-1.7.4.jar')
             sudo('wget http://maven.twttr.com/com/hadoop/gplcompression/hadoop-lzo/0.4.20/hadoop-lzo-0.4.20.jar -O ' +
                  jars_dir + 'hadoop-lzo-0.4.20.jar')
-            sudo('touch /home/{}/.ensure_dir/local_jars_ensured'.format(os_user))
+            set_ensured(os_user, 'local_jars_ensured')
         except:
             sys.exit(1)
 
 
 def configure_local_spark(os_user, jars_dir, region, templates_dir, memory_type='driver'):
-    if not exists('/home/{}/.ensure_dir/local_spark_configured'.format(os_user)):
+    if not ensured(os_user, 'local_spark_configured'):
         try:
             if region == 'us-east-1':
                 endpoint_url = 'https://s3.amazonaws.com'
@@ -1247,7 +1267,7 @@ def configure_local_spark(os_user, jars_dir, region, templates_dir, memory_type=
             if os.environ['application'] == 'zeppelin':
                 sudo('echo \"spark.jars $(ls -1 ' + jars_dir + '* | tr \'\\n\' \',\')\" >> /tmp/notebook_spark-defaults_local.conf')
             sudo('\cp /tmp/notebook_spark-defaults_local.conf /opt/spark/conf/spark-defaults.conf')
-            sudo('touch /home/{}/.ensure_dir/local_spark_configured'.format(os_user))
+            set_ensured(os_user, 'local_spark_configured')
         except:
             sys.exit(1)
     try:
@@ -1391,56 +1411,8 @@ def configure_dataengine_spark(cluster_name, jars_dir, cluster_dir, region, data
 def remove_dataengine_kernels(tag_name, notebook_name, os_user, key_path, cluster_name):
     try:
         private = meta_lib.get_instance_private_ip_address(tag_name, notebook_name)
-        env.hosts = "{}".format(private)
-        env.user = "{}".format(os_user)
-        env.key_filename = "{}".format(key_path)
-        env.host_string = env.user + "@" + env.hosts
-        sudo('rm -rf /home/{}/.local/share/jupyter/kernels/*_{}'.format(os_user, cluster_name))
-        if exists('/home/{}/.ensure_dir/dataengine_{}_interpreter_ensured'.format(os_user, cluster_name)):
-            if os.environ['notebook_multiple_clusters'] == 'true':
-                try:
-                    livy_port = sudo("cat /opt/" + cluster_name +
-                                     "/livy/conf/livy.conf | grep livy.server.port | tail -n 1 | awk '{printf $3}'")
-                    process_number = sudo("netstat -natp 2>/dev/null | grep ':" + livy_port +
-                                          "' | awk '{print $7}' | sed 's|/.*||g'")
-                    sudo('kill -9 ' + process_number)
-                    sudo('systemctl disable livy-server-' + livy_port)
-                except:
-                    print("Wasn't able to find Livy server for this EMR!")
-            sudo(
-                'sed -i \"s/^export SPARK_HOME.*/export SPARK_HOME=\/opt\/spark/\" /opt/zeppelin/conf/zeppelin-env.sh')
-            sudo("rm -rf /home/{}/.ensure_dir/dataengine_interpreter_ensure".format(os_user))
-            zeppelin_url = 'http://' + private + ':8080/api/interpreter/setting/'
-            opener = urllib2.build_opener(urllib2.ProxyHandler({}))
-            req = opener.open(urllib2.Request(zeppelin_url))
-            r_text = req.read()
-            interpreter_json = json.loads(r_text)
-            interpreter_prefix = cluster_name
-            for interpreter in interpreter_json['body']:
-                if interpreter_prefix in interpreter['name']:
-                    print("Interpreter with ID: {} and name: {} will be removed from zeppelin!".format(
-                        interpreter['id'], interpreter['name']))
-                    request = urllib2.Request(zeppelin_url + interpreter['id'], data='')
-                    request.get_method = lambda: 'DELETE'
-                    url = opener.open(request)
-                    print(url.read())
-            sudo('chown ' + os_user + ':' + os_user + ' -R /opt/zeppelin/')
-            sudo('systemctl daemon-reload')
-            sudo("service zeppelin-notebook stop")
-            sudo("service zeppelin-notebook start")
-            zeppelin_restarted = False
-            while not zeppelin_restarted:
-                sudo('sleep 5')
-                result = sudo('nmap -p 8080 localhost | grep "closed" > /dev/null; echo $?')
-                result = result[:1]
-                if result == '1':
-                    zeppelin_restarted = True
-            sudo('sleep 5')
-            sudo('rm -rf /home/{}/.ensure_dir/dataengine_{}_interpreter_ensured'.format(os_user, cluster_name))
-        if exists('/home/{}/.ensure_dir/rstudio_dataengine_ensured'.format(os_user)):
-            dlab.fab.remove_rstudio_dataengines_kernel(cluster_name, os_user)
-        sudo('rm -rf  /opt/' + cluster_name + '/')
-        print("Notebook's {} kernels were removed".format(env.hosts))
+        dlab.fab.remove_cluster_kernels([private], os_user, key_path, cluster_name, '/opt/{}/'.format(cluster_name),
+                                        'dataengine')
     except Exception as err:
         logging.info("Unable to remove kernels on Notebook: " + str(err) + "\n Traceback: " + traceback.print_exc(
             file=sys.stdout))
@@ -1450,26 +1422,26 @@ def remove_dataengine_kernels(tag_name, notebook_name, os_user, key_path, cluste
 
 
 def prepare_disk(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/disk_ensured'):
+    if not ensured(os_user, 'disk_ensured'):
         try:
             disk_name = sudo("lsblk | grep disk | awk '{print $1}' | sort | tail -n 1")
             sudo('''bash -c 'echo -e "o\nn\np\n1\n\n\nw" | fdisk /dev/{}' '''.format(disk_name))
             sudo('mkfs.ext4 -F /dev/{}1'.format(disk_name))
             sudo('mount /dev/{}1 /opt/'.format(disk_name))
             sudo(''' bash -c "echo '/dev/{}1 /opt/ ext4 errors=remount-ro 0 1' >> /etc/fstab" '''.format(disk_name))
-            sudo('touch /home/' + os_user + '/.ensure_dir/disk_ensured')
+            set_ensured(os_user, 'disk_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_local_spark(os_user, spark_link, spark_version, hadoop_version, local_spark_path):
-    if not exists('/home/' + os_user + '/.ensure_dir/local_spark_ensured'):
+    if not ensured(os_user, 'local_spark_ensured'):
         try:
             sudo('wget ' + spark_link + ' -O /tmp/spark-' + spark_version + '-bin-hadoop' + hadoop_version + '.tgz')
             sudo('tar -zxvf /tmp/spark-' + spark_version + '-bin-hadoop' + hadoop_version + '.tgz -C /opt/')
             sudo('mv /opt/spark-' + spark_version + '-bin-hadoop' + hadoop_version + ' ' + local_spark_path)
             sudo('chown -R ' + os_user + ':' + os_user + ' ' + local_spark_path)
-            sudo('touch /home/' + os_user + '/.ensure_dir/local_spark_ensured')
+            set_ensured(os_user, 'local_spark_ensured')
         except:
             sys.exit(1)
 
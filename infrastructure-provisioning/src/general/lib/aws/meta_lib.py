@@ -155,6 +155,32 @@ def get_instance_private_ip_address(tag_name, instance_name):
         traceback.print_exc(file=sys.stdout)
 
 
+def get_instances_private_ip_addresses(tag_name, instance_names):
+    # One describe call for all instances, returns {instance name: private IP}
+    try:
+        actions_lib.create_aws_config_files()
+        ec2 = boto3.resource('ec2')
+        instances = ec2.instances.filter(
+            Filters=[{'Name': 'tag:{}'.format(tag_name), 'Values': list(instance_names)},
+                     {'Name': 'instance-state-name', 'Values': ['running']}])
+        ips = {}
+        for instance in instances:
+            for tag in instance.tags or []:
+                if tag['Key'] == tag_name:
+                    ips[tag['Value']] = instance.private_ip_address
+        missing = [name for name in instance_names if name not in ips]
+        if missing:
+            raise Exception("Unable to find instance IP addresses with instance names: " + ', '.join(missing))
+        return ips
+    except Exception as err:
+        logging.error("Error with getting private ip addresses by names: " + str(err) + "\n Traceback: " +
+                      traceback.format_exc())
+        append_result(str({"error": "Error with getting private ip addresses by names",
+                           "error_message": str(err) + "\n Traceback: " + traceback.format_exc()}))
+        traceback.print_exc(file=sys.stdout)
+        raise
+
+
 @backoff.on_predicate(backoff.fibo, max_tries=5)
 def get_ami_id_by_name(ami_name, state="*"):
     ec2 = boto3.resource('ec2')
@@ -33,28 +33,51 @@ from fabric.api import *
 from fabric.contrib.files import exists
 import urllib2
 import meta_lib
+import client_lib
 import logging
 import traceback
 import sys, time
 import os, json
 import dlab.fab
 import dlab.common_lib
+from dlab.state import ensured, set_ensured
 
 
 class AzureActions:
     def __init__(self):
-        os.environ['AZURE_AUTH_LOCATION'] = '/root/azure_auth.json'
-        self.compute_client = get_client_from_auth_file(ComputeManagementClient)
-        self.resource_client = get_client_from_auth_file(ResourceManagementClient)
-        self.network_client = get_client_from_auth_file(NetworkManagementClient)
-        self.storage_client = get_client_from_auth_file(StorageManagementClient)
-        self.datalake_client = get_client_from_auth_file(DataLakeStoreAccountManagementClient)
-        self.authorization_client = get_client_from_auth_file(AuthorizationManagementClient)
-        self.sp_creds = json.loads(open(os.environ['AZURE_AUTH_LOCATION']).read())
-        self.dl_filesystem_creds = lib.auth(tenant_id=json.dumps(self.sp_creds['tenantId']).replace('"', ''),
-                                            client_secret=json.dumps(self.sp_creds['clientSecret']).replace('"', ''),
-                                            client_id=json.dumps(self.sp_creds['clientId']).replace('"', ''),
-                                            resource='https://datalake.azure.net/')
+        self.context = client_lib.get_context()
+
+    @property
+    def compute_client(self):
+        return self.context.get_client(ComputeManagementClient)
+
+    @property
+    def resource_client(self):
+        return self.context.get_client(ResourceManagementClient)
+
+    @property
+    def network_client(self):
+        return self.context.get_client(NetworkManagementClient)
+
+    @property
+    def storage_client(self):
+        return self.context.get_client(StorageManagementClient)
+
+    @property
+    def datalake_client(self):
+        return self.context.get_client(DataLakeStoreAccountManagementClient)
+
+    @property
+    def authorization_client(self):
+        return self.context.get_client(AuthorizationManagementClient)
+
+    @property
+    def sp_creds(self):
+        return self.context.sp_creds
+
+    @property
+    def dl_filesystem_creds(self):
+        return self.context.get_datalake_credentials()
 
     def create_resource_group(self, resource_group_name, region):
         try:
@@ -175,15 +198,9 @@ class AzureActions:
                 {
                     'location': region,
                     'tags': tags,
+                    'security_rules': list_rules
                 }
             ).wait()
-            for rule in list_rules:
-                self.network_client.security_rules.create_or_update(
-                    resource_group_name,
-                    network_security_group_name,
-                    security_rule_name=rule['name'],
-                    security_rule_parameters=rule
-                ).wait()
             return result
         except Exception as err:
             logging.info(
@@ -193,6 +210,48 @@ class AzureActions:
                                    file=sys.stdout)}))
             traceback.print_exc(file=sys.stdout)
 
+    def reconcile_security_rules(self, resource_group_name, network_security_group_name, list_rules, revoke=False):
+        # Diffs the rules of an existing security group against list_rules and applies all changes
+        # with a single update of the group. Returns the number of changed rules.
+        def rule_key(rule):
+            return json.dumps(dict((field, rule.get(field)) for field in (
+                'name', 'protocol', 'source_port_range', 'destination_port_range', 'source_address_prefix',
+                'destination_address_prefix', 'access', 'priority', 'direction')), sort_keys=True)
+
+        try:
+            security_group = self.network_client.network_security_groups.get(resource_group_name,
+                                                                             network_security_group_name)
+            current_rules = [rule.as_dict() for rule in security_group.security_rules or []]
+            to_add, to_remove = dlab.fab.get_rules_diff(list_rules, current_rules, rule_key)
+            updated_names = [rule['name'] for rule in to_add]
+            if revoke:
+                removed_names = [rule['name'] for rule in to_remove]
+            else:
+                removed_names = list()
+            if not to_add and not removed_names:
+                print("Security group {} is up to date".format(network_security_group_name))
+                return 0
+            security_rules = [rule for rule in current_rules
+                              if rule['name'] not in updated_names and rule['name'] not in removed_names]
+            security_rules.extend(to_add)
+            self.network_client.network_security_groups.create_or_update(
+                resource_group_name,
+                network_security_group_name,
+                {
+                    'location': security_group.location,
+                    'tags': security_group.tags,
+                    'security_rules': security_rules
+                }
+            ).wait()
+            return len(set(updated_names + removed_names))
+        except Exception as err:
+            logging.info(
+                "Unable to reconcile security group rules: " + str(err) + "\n Traceback: " + traceback.format_exc())
+            append_result(str({"error": "Unable to reconcile security group rules",
+                               "error_message": str(err) + "\n Traceback: " + traceback.format_exc()}))
+            traceback.print_exc(file=sys.stdout)
+            raise
+
     def remove_security_group(self, resource_group_name, network_security_group_name):
         try:
             result = self.network_client.network_security_groups.delete(
@@ -909,56 +968,8 @@ class AzureActions:
     def remove_dataengine_kernels(self, resource_group_name, notebook_name, os_user, key_path, cluster_name):
         try:
             private = meta_lib.AzureMeta().get_private_ip_address(resource_group_name, notebook_name)
-            env.hosts = "{}".format(private)
-            env.user = "{}".format(os_user)
-            env.key_filename = "{}".format(key_path)
-            env.host_string = env.user + "@" + env.hosts
-            sudo('rm -rf /home/{}/.local/share/jupyter/kernels/*_{}'.format(os_user, cluster_name))
-            if exists('/home/{}/.ensure_dir/dataengine_{}_interpreter_ensured'.format(os_user, cluster_name)):
-                if os.environ['notebook_multiple_clusters'] == 'true':
-                    try:
-                        livy_port = sudo("cat /opt/" + cluster_name +
-                                         "/livy/conf/livy.conf | grep livy.server.port | tail -n 1 | awk '{printf $3}'")
-                        process_number = sudo("netstat -natp 2>/dev/null | grep ':" + livy_port +
-                                              "' | awk '{print $7}' | sed 's|/.*||g'")
-                        sudo('kill -9 ' + process_number)
-                        sudo('systemctl disable livy-server-' + livy_port)
-                    except:
-                        print("Wasn't able to find Livy server for this dataengine!")
-                sudo(
-                    'sed -i \"s/^export SPARK_HOME.*/export SPARK_HOME=\/opt\/spark/\" /opt/zeppelin/conf/zeppelin-env.sh')
-                sudo("rm -rf /home/{}/.ensure_dir/dataengine_interpreter_ensure".format(os_user))
-                zeppelin_url = 'http://' + private + ':8080/api/interpreter/setting/'
-                opener = urllib2.build_opener(urllib2.ProxyHandler({}))
-                req = opener.open(urllib2.Request(zeppelin_url))
-                r_text = req.read()
-                interpreter_json = json.loads(r_text)
-                interpreter_prefix = cluster_name
-                for interpreter in interpreter_json['body']:
-                    if interpreter_prefix in interpreter['name']:
-                        print("Interpreter with ID: {0} and name: {1} will be removed from zeppelin!".
-                              format(interpreter['id'], interpreter['name']))
-                        request = urllib2.Request(zeppelin_url + interpreter['id'], data='')
-                        request.get_method = lambda: 'DELETE'
-                        url = opener.open(request)
-                        print(url.read())
-                sudo('chown ' + os_user + ':' + os_user + ' -R /opt/zeppelin/')
-                sudo('systemctl daemon-reload')
-                sudo("service zeppelin-notebook stop")
-                sudo("service zeppelin-notebook start")
-                zeppelin_restarted = False
-                while not zeppelin_restarted:
-                    sudo('sleep 5')
-                    result = sudo('nmap -p 8080 localhost | grep "closed" > /dev/null; echo $?')
-                    result = result[:1]
-                    if result == '1':
-                        zeppelin_restarted = True
-                sudo('sleep 5')
-                sudo('rm -rf /home/{}/.ensure_dir/dataengine_{}_interpreter_ensured'.format(os_user, cluster_name))
-            if exists('/home/{}/.ensure_dir/rstudio_dataengine_ensured'.format(os_user)):
-                dlab.fab.remove_rstudio_dataengines_kernel(cluster_name, os_user)
-            sudo('rm -rf  /opt/' + cluster_name + '/')
-            print("Notebook's {} kernels were removed".format(env.hosts))
+            dlab.fab.remove_cluster_kernels([private], os_user, key_path, cluster_name,
+                                            '/opt/{}/'.format(cluster_name), 'dataengine')
         except Exception as err:
             logging.info("Unable to remove kernels on Notebook: " + str(err) + "\n Traceback: " + traceback.print_exc(
                 file=sys.stdout))
@@ -1001,7 +1012,7 @@ class AzureActions:
 
 
 def ensure_local_jars(os_user, jars_dir):
-    if not exists('/home/{}/.ensure_dir/local_jars_ensured'.format(os_user)):
+    if not ensured(os_user, 'local_jars_ensured'):
         try:
             hadoop_version = sudo("ls /opt/spark/jars/hadoop-common* | sed -n 's/.*\([0-9]\.[0-9]\.[0-9]\).*/\\1/p'")
             print("Downloading local jars for Azure")
@@ -1023,7 +1034,7 @@ def ensure_local_jars(os_user, jars_dir):
             if os.environ['application'] == 'tensor' or os.environ['application'] == 'deeplearning':
                 sudo('wget https://dl.bintray.com/spark-packages/maven/tapanalyticstoolkit/spark-tensorflow-connector/{0}/spark-tensorflow-connector-{0}.jar \
                      -O {1}spark-tensorflow-connector-{0}.jar'.format('1.0.0-s_2.11', jars_dir))
-            sudo('touch /home/{}/.ensure_dir/local_jars_ensured'.format(os_user))
+            set_ensured(os_user, 'local_jars_ensured')
         except Exception as err:
             logging.info(
                 "Unable to download local jars: " + str(err) + "\n Traceback: " + traceback.print_exc(file=sys.stdout))
@@ -1066,12 +1077,12 @@ def configure_local_spark(os_user, jars_dir, region, templates_dir, memory_type=
         else:
             sudo('rm -f /opt/hadoop/etc/hadoop/core-site.xml')
             sudo('mv /tmp/core-site.xml /opt/hadoop/etc/hadoop/core-site.xml')
-        if not exists('/home/{}/.ensure_dir/local_spark_configured'.format(os_user)):
+        if not ensured(os_user, 'local_spark_configured'):
             put(templates_dir + 'notebook_spark-defaults_local.conf', '/tmp/notebook_spark-defaults_local.conf')
             sudo("jar_list=`find {} -name '*.jar' | tr '\\n' ','` ; echo \"spark.jars   $jar_list\" >> \
                   /tmp/notebook_spark-defaults_local.conf".format(jars_dir))
             sudo('\cp /tmp/notebook_spark-defaults_local.conf /opt/spark/conf/spark-defaults.conf')
-            sudo('touch /home/{}/.ensure_dir/local_spark_configured'.format(os_user))
+            set_ensured(os_user, 'local_spark_configured')
     except Exception as err:
         logging.info(
             "Unable to configure Spark: " + str(err) + "\n Traceback: " + traceback.print_exc(file=sys.stdout))
@@ -1117,7 +1128,7 @@ def prepare_vm_for_image(creds=False, os_user='', hostname='', keyfile=''):
 
 
 def prepare_disk(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/disk_ensured'):
+    if not ensured(os_user, 'disk_ensured'):
         try:
             remount_azure_disk()
             disk_name = sudo("lsblk | grep disk | awk '{print $1}' | sort | tail -n 1")
@@ -1127,20 +1138,20 @@ def prepare_disk(os_user):
             sudo('mkfs.ext4 -F /dev/{}1'.format(disk_name))
             sudo('mount /dev/{}1 /opt/'.format(disk_name))
             sudo(''' bash -c "echo '/dev/{}1 /opt/ ext4 errors=remount-ro 0 1' >> /etc/fstab" '''.format(disk_name))
-            sudo('touch /home/' + os_user + '/.ensure_dir/disk_ensured')
+            set_ensured(os_user, 'disk_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_local_spark(os_user, spark_link, spark_version, hadoop_version, local_spark_path):
-    if not exists('/home/' + os_user + '/.ensure_dir/local_spark_ensured'):
+    if not ensured(os_user, 'local_spark_ensured'):
         try:
             if os.environ['azure_datalake_enable'] == 'false':
                 sudo('wget ' + spark_link + ' -O /tmp/spark-' + spark_version + '-bin-hadoop' + hadoop_version + '.tgz')
                 sudo('tar -zxvf /tmp/spark-' + spark_version + '-bin-hadoop' + hadoop_version + '.tgz -C /opt/')
                 sudo('mv /opt/spark-' + spark_version + '-bin-hadoop' + hadoop_version + ' ' + local_spark_path)
                 sudo('chown -R ' + os_user + ':' + os_user + ' ' + local_spark_path)
-                sudo('touch /home/' + os_user + '/.ensure_dir/local_spark_ensured')
+                set_ensured(os_user, 'local_spark_ensured')
             else:
                 # Downloading Spark without Hadoop
                 sudo('wget https://archive.apache.org/dist/spark/spark-{0}/spark-{0}-bin-without-hadoop.tgz -O /tmp/spark-{0}-bin-without-hadoop.tgz'
@@ -1164,7 +1175,7 @@ def ensure_local_spark(os_user, spark_link, spark_version, hadoop_version, local
                 spark_dist_classpath = sudo('/opt/hadoop/bin/hadoop classpath')
                 sudo('echo "export SPARK_DIST_CLASSPATH={}" >> /opt/spark/conf/spark-env.sh'.format(
                     spark_dist_classpath))
-                sudo('touch /home/{}/.ensure_dir/local_spark_ensured'.format(os_user))
+                set_ensured(os_user, 'local_spark_ensured')
         except:
             sys.exit(1)
 
@@ -0,0 +1,94 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+import os
+import json
+from azure.common.client_factory import get_client_from_auth_file
+from azure.common.credentials import ServicePrincipalCredentials
+from azure.datalake.store import lib
+
+# AzureMeta and AzureActions are constructed for almost every call, all of them share the clients of one
+# context per process: the auth file is read once, one service principal token is requested and refreshed
+# for all management clients, every client is created on its first use, and the requests of the clients go
+# through one HTTP session, which keeps its connections to ARM open. The Data Lake token is requested only
+# when Data Lake is used, the Data Lake credential refreshes it itself.
+auth_location = '/root/azure_auth.json'
+
+context = None
+stats = {'contexts': 0, 'clients': 0, 'tokens': 0}
+
+
+class SharedSessionCredentials(ServicePrincipalCredentials):
+    # msrest asks the credentials for a new signed session on every request and closes it afterwards.
+    # The session of the current token is kept open and reused, a refreshed token gets a new one.
+    def __init__(self, *args, **kwargs):
+        self.session = None
+        self.session_token = None
+        ServicePrincipalCredentials.__init__(self, *args, **kwargs)
+
+    def set_token(self):
+        ServicePrincipalCredentials.set_token(self)
+        stats['tokens'] += 1
+
+    def signed_session(self, *args, **kwargs):
+        if args or kwargs:
+            return ServicePrincipalCredentials.signed_session(self, *args, **kwargs)
+        if self.session is None or self.session_token is not self.token:
+            self.session = ServicePrincipalCredentials.signed_session(self)
+            self.session.close = lambda: None
+            self.session_token = self.token
+        return self.session
+
+
+class AzureContext:
+    def __init__(self):
+        self.pid = os.getpid()
+        os.environ['AZURE_AUTH_LOCATION'] = auth_location
+        self.sp_creds = json.loads(open(os.environ['AZURE_AUTH_LOCATION']).read())
+        self.credentials = SharedSessionCredentials(
+            client_id=self.sp_creds['clientId'],
+            secret=self.sp_creds['clientSecret'],
+            tenant=self.sp_creds['tenantId'],
+            resource=self.sp_creds.get('activeDirectoryResourceId', self.sp_creds['resourceManagerEndpointUrl']))
+        self.clients = dict()
+        self.dl_filesystem_creds = None
+        stats['contexts'] += 1
+
+    def get_client(self, client_class):
+        # Subscription and endpoint still come from the auth file, only the credentials are shared
+        if client_class not in self.clients:
+            self.clients[client_class] = get_client_from_auth_file(client_class, credentials=self.credentials)
+            stats['clients'] += 1
+        return self.clients[client_class]
+
+    def get_datalake_credentials(self):
+        if self.dl_filesystem_creds is None:
+            self.dl_filesystem_creds = lib.auth(tenant_id=self.sp_creds['tenantId'],
+                                                client_secret=self.sp_creds['clientSecret'],
+                                                client_id=self.sp_creds['clientId'],
+                                                resource='https://datalake.azure.net/')
+            stats['tokens'] += 1
+        return self.dl_filesystem_creds
+
+
+def get_context():
+    # Sessions must not be shared with forked processes, a forked request gets a context of its own
+    global context
+    if context is None or context.pid != os.getpid():
+        context = AzureContext()
+    return context
@@ -33,22 +33,44 @@ import traceback
 import sys
 import os
 import json
+import client_lib
 
 
 class AzureMeta:
     def __init__(self):
-        os.environ['AZURE_AUTH_LOCATION'] = '/root/azure_auth.json'
-        self.compute_client = get_client_from_auth_file(ComputeManagementClient)
-        self.resource_client = get_client_from_auth_file(ResourceManagementClient)
-        self.network_client = get_client_from_auth_file(NetworkManagementClient)
-        self.storage_client = get_client_from_auth_file(StorageManagementClient)
-        self.datalake_client = get_client_from_auth_file(DataLakeStoreAccountManagementClient)
-        self.authorization_client = get_client_from_auth_file(AuthorizationManagementClient)
-        self.sp_creds = json.loads(open(os.environ['AZURE_AUTH_LOCATION']).read())
-        self.dl_filesystem_creds = lib.auth(tenant_id=json.dumps(self.sp_creds['tenantId']).replace('"', ''),
-                                            client_secret=json.dumps(self.sp_creds['clientSecret']).replace('"', ''),
-                                            client_id=json.dumps(self.sp_creds['clientId']).replace('"', ''),
-                                            resource='https://datalake.azure.net/')
+        self.context = client_lib.get_context()
+
+    @property
+    def compute_client(self):
+        return self.context.get_client(ComputeManagementClient)
+
+    @property
+    def resource_client(self):
+        return self.context.get_client(ResourceManagementClient)
+
+    @property
+    def network_client(self):
+        return self.context.get_client(NetworkManagementClient)
+
+    @property
+    def storage_client(self):
+        return self.context.get_client(StorageManagementClient)
+
+    @property
+    def datalake_client(self):
+        return self.context.get_client(DataLakeStoreAccountManagementClient)
+
+    @property
+    def authorization_client(self):
+        return self.context.get_client(AuthorizationManagementClient)
+
+    @property
+    def sp_creds(self):
+        return self.context.sp_creds
+
+    @property
+    def dl_filesystem_creds(self):
+        return self.context.get_datalake_credentials()
 
     def get_resource_group(self, resource_group_name):
         try:
@@ -24,6 +24,7 @@ from googleapiclient import errors
 import google.auth
 from dlab.fab import *
 import meta_lib
+import client_lib
 import os
 import json
 import logging
@@ -34,43 +35,39 @@ from fabric.api import *
 import urllib2
 import dlab.fab
 import dlab.common_lib
+from dlab.state import ensured, set_ensured
 import backoff
 
 
 class GCPActions:
     def __init__(self, auth_type='service_account'):
-        @backoff.on_exception(backoff.expo,
-                              google.auth.exceptions.DefaultCredentialsError,
-                              max_tries=15)
-        def get_gcp_cred():
-            credentials, project = google.auth.default()
-            return credentials, project
-
         self.auth_type = auth_type
         self.project = os.environ['gcp_project_id']
+        self.context = client_lib.get_context()
 
-        if os.environ['conf_resource'] == 'ssn':
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "/root/service_account.json"
-            credentials, project = google.auth.default()
-            if credentials.requires_scopes:
-                credentials = credentials.with_scopes(
-                    ['https://www.googleapis.com/auth/compute',
-                     'https://www.googleapis.com/auth/iam',
-                     'https://www.googleapis.com/auth/cloud-platform'])
-            self.service = build('compute', 'v1', credentials=credentials)
-            self.service_iam = build('iam', 'v1', credentials=credentials)
-            self.dataproc = build('dataproc', 'v1', credentials=credentials)
-            self.service_storage = build('storage', 'v1', credentials=credentials)
-            self.storage_client = storage.Client(project=project, credentials=credentials)
-            self.service_resource = build('cloudresourcemanager', 'v1', credentials=credentials)
-        else:
-            credentials, project = get_gcp_cred()
-            self.service = build('compute', 'v1', credentials=credentials)
-            self.service_iam = build('iam', 'v1', credentials=credentials)
-            self.dataproc = build('dataproc', 'v1', credentials=credentials)
-            self.service_storage = build('storage', 'v1', credentials=credentials)
-            self.storage_client = storage.Client(project=project, credentials=credentials)
-            self.service_resource = build('cloudresourcemanager', 'v1', credentials=credentials)
+    @property
+    def service(self):
+        return self.context.get_service('compute')
+
+    @property
+    def service_iam(self):
+        return self.context.get_service('iam')
+
+    @property
+    def dataproc(self):
+        return self.context.get_service('dataproc')
+
+    @property
+    def service_storage(self):
+        return self.context.get_service('storage')
+
+    @property
+    def storage_client(self):
+        return self.context.get_storage_client()
+
+    @property
+    def service_resource(self):
+        return self.context.get_service('cloudresourcemanager')
 
     def create_vpc(self, vpc_name):
         network_params = {'name': vpc_name, 'autoCreateSubnetworks': False}
@@ -157,6 +154,59 @@ class GCPActions:
                                    file=sys.stdout)}))
             traceback.print_exc(file=sys.stdout)
 
+    def reconcile_firewalls(self, firewall_rules):
+        # Creates missing firewalls and updates the ones whose spec differs, based on one list call.
+        # Operations are submitted together and waited for afterwards, nothing is waited for if nothing changed.
+        def firewall_key(rule):
+            return json.dumps({
+                'name': rule['name'],
+                'network': rule.get('network', '').split('/')[-1],
+                'direction': rule.get('direction', 'INGRESS'),
+                'priority': int(rule.get('priority', 1000)),
+                'allowed': sorted(json.dumps(i, sort_keys=True) for i in rule.get('allowed', [])),
+                'denied': sorted(json.dumps(i, sort_keys=True) for i in rule.get('denied', [])),
+                'sourceRanges': sorted(rule.get('sourceRanges', [])),
+                'destinationRanges': sorted(rule.get('destinationRanges', [])),
+                'sourceTags': sorted(rule.get('sourceTags', [])),
+                'targetTags': sorted(rule.get('targetTags', [])),
+                'targetServiceAccounts': sorted(rule.get('targetServiceAccounts', []))}, sort_keys=True)
+
+        try:
+            if not firewall_rules:
+                return 0
+            names_filter = 'name eq "({})"'.format('|'.join(rule['name'] for rule in firewall_rules))
+            current_rules = list()
+            request = self.service.firewalls().list(project=self.project, filter=names_filter)
+            while request is not None:
+                response = request.execute()
+                current_rules.extend(response.get('items', []))
+                request = self.service.firewalls().list_next(previous_request=request, previous_response=response)
+            current_names = [rule['name'] for rule in current_rules]
+            to_apply = dlab.fab.get_rules_diff(firewall_rules, current_rules, firewall_key)[0]
+            operations = meta_lib.OperationTracker()
+            for rule in to_apply:
+                if rule['name'] in current_names:
+                    print("Updating Firewall {}".format(rule['name']))
+                    operations.submit(self.service.firewalls().update(
+                        project=self.project, firewall=rule['name'], body=rule).execute(),
+                        'Firewall {} updated.'.format(rule['name']))
+                else:
+                    print("Creating Firewall {}".format(rule['name']))
+                    operations.submit(self.service.firewalls().insert(project=self.project, body=rule).execute(),
+                                      'Firewall {} created.'.format(rule['name']))
+            for rule in firewall_rules:
+                if rule not in to_apply:
+                    print("REQUESTED FIREWALL {} ALREADY EXISTS".format(rule['name']))
+            operations.wait()
+            return len(to_apply)
+        except Exception as err:
+            logging.info(
+                "Unable to reconcile Firewalls: " + str(err) + "\n Traceback: " + traceback.format_exc())
+            append_result(str({"error": "Unable to reconcile Firewalls",
+                               "error_message": str(err) + "\n Traceback: " + traceback.format_exc()}))
+            traceback.print_exc(file=sys.stdout)
+            raise
+
     def remove_firewall(self, firewall_name):
         request = self.service.firewalls().delete(project=self.project, firewall=firewall_name)
         try:
@@ -622,11 +672,13 @@ class GCPActions:
                                    file=sys.stdout)}))
             traceback.print_exc(file=sys.stdout)
 
-    def create_static_address(self, address_name, region):
+    def create_static_address(self, address_name, region, tracker=None):
         params = {"name": address_name}
         request = self.service.addresses().insert(project=self.project, region=region, body=params)
         try:
             result = request.execute()
+            if tracker is not None:
+                return tracker.submit(result, 'Static address {} created.'.format(address_name), region=region)
             meta_lib.GCPMeta().wait_for_operation(result['name'], region=region)
             print('Static address {} created.'.format(address_name))
             return result
@@ -872,19 +924,36 @@ class GCPActions:
 
     def delete_dataproc_jobs(self, cluster_filter):
         try:
-            jobs = meta_lib.GCPMeta().get_dataproc_jobs()
-            cluster_jobs_ids = [job['reference']['jobId'] for job in jobs
-                                if cluster_filter in job['placement']['clusterName']]
-            for job_id in list(set(cluster_jobs_ids)):
-                print('The cluster jobs is being deleted... Please wait')
-                try:
-                    req = self.dataproc.projects().regions().jobs().delete(projectId=self.project,
-                                                                           region=os.environ['gcp_region'],
-                                                                           jobId=job_id)
-                    req.execute()
-                except errors.HttpError as err:
-                    if err.resp.status == 404:
-                        print('Job with ID: {} have not been found.'.format(job_id))
+            start = time.time()
+            jobs = meta_lib.GCPMeta().get_dataproc_jobs(cluster_filter)
+            cluster_jobs_ids = list(set([job['reference']['jobId'] for job in jobs
+                                         if job['placement']['clusterName'] == cluster_filter]))
+            scan_time = time.time() - start
+            print('The cluster jobs are being deleted... Please wait')
+            results = {'deleted': 0, 'not_found': 0, 'errors': []}
+
+            def job_deleted(request_id, response, exception):
+                if exception is None:
+                    results['deleted'] += 1
+                elif isinstance(exception, errors.HttpError) and exception.resp.status == 404:
+                    print('Job with ID: {} have not been found.'.format(request_id))
+                    results['not_found'] += 1
+                else:
+                    results['errors'].append('{}: {}'.format(request_id, str(exception)))
+
+            start = time.time()
+            # Deletes go to the API 100 at a time, each batch in one HTTP request
+            for i in range(0, len(cluster_jobs_ids), 100):
+                batch = self.dataproc.new_batch_http_request(callback=job_deleted)
+                for job_id in cluster_jobs_ids[i:i + 100]:
+                    batch.add(self.dataproc.projects().regions().jobs().delete(projectId=self.project,
+                                                                             region=os.environ['gcp_region'],
+                                                                             jobId=job_id), request_id=job_id)
+                batch.execute()
+            print('Jobs of cluster {}: {} scanned in {:.1f}s, {} deleted and {} not found in {:.1f}s'.format(
+                cluster_filter, len(jobs), scan_time, results['deleted'], results['not_found'], time.time() - start))
+            if results['errors']:
+                raise Exception('Unable to delete jobs: ' + '; '.join(results['errors']))
         except Exception as err:
             logging.info(
                 "Unable to delete dataproc jobs: " + str(err) + "\n Traceback: " + traceback.print_exc(
@@ -966,53 +1035,9 @@ class GCPActions:
     def remove_kernels(self, notebook_name, dataproc_name, dataproc_version, ssh_user, key_path):
         try:
             notebook_ip = meta_lib.GCPMeta().get_private_ip_address(notebook_name)
-            env.hosts = "{}".format(notebook_ip)
-            env.user = "{}".format(ssh_user)
-            env.key_filename = "{}".format(key_path)
-            env.host_string = env.user + "@" + env.hosts
-            sudo('rm -rf /home/{}/.local/share/jupyter/kernels/*_{}'.format(ssh_user, dataproc_name))
-            if exists('/home/{}/.ensure_dir/dataengine-service_{}_interpreter_ensured'.format(ssh_user, dataproc_name)):
-                if os.environ['notebook_multiple_clusters'] == 'true':
-                    try:
-                        livy_port = sudo("cat /opt/" + dataproc_version + "/" + dataproc_name
-                                         + "/livy/conf/livy.conf | grep livy.server.port | tail -n 1 | awk '{printf $3}'")
-                        process_number = sudo("netstat -natp 2>/dev/null | grep ':" + livy_port +
-                                              "' | awk '{print $7}' | sed 's|/.*||g'")
-                        sudo('kill -9 ' + process_number)
-                        sudo('systemctl disable livy-server-' + livy_port)
-                    except:
-                        print("Wasn't able to find Livy server for this EMR!")
-                sudo('sed -i \"s/^export SPARK_HOME.*/export SPARK_HOME=\/opt\/spark/\" /opt/zeppelin/conf/zeppelin-env.sh')
-                sudo("rm -rf /home/{}/.ensure_dir/dataengine-service_interpreter_ensure".format(ssh_user))
-                zeppelin_url = 'http://' + notebook_ip + ':8080/api/interpreter/setting/'
-                opener = urllib2.build_opener(urllib2.ProxyHandler({}))
-                req = opener.open(urllib2.Request(zeppelin_url))
-                r_text = req.read()
-                interpreter_json = json.loads(r_text)
-                interpreter_prefix = dataproc_name
-                for interpreter in interpreter_json['body']:
-                    if interpreter_prefix in interpreter['name']:
-                        print("Interpreter with ID: {} and name: {} will be removed from zeppelin!".format(
-                            interpreter['id'], interpreter['name']))
-                        request = urllib2.Request(zeppelin_url + interpreter['id'], data='')
-                        request.get_method = lambda: 'DELETE'
-                        url = opener.open(request)
-                        print(url.read())
-                sudo('chown {0}:{0} -R /opt/zeppelin/'.format(ssh_user))
-                sudo('systemctl restart zeppelin-notebook.service')
-                zeppelin_restarted = False
-                while not zeppelin_restarted:
-                    sudo('sleep 5')
-                    result = sudo('nmap -p 8080 localhost | grep "closed" > /dev/null; echo $?')
-                    result = result[:1]
-                    if result == '1':
-                        zeppelin_restarted = True
-                sudo('sleep 5')
-                sudo('rm -rf /home/{}/.ensure_dir/dataengine-service_{}_interpreter_ensured'.format(ssh_user, dataproc_name))
-            if exists('/home/{}/.ensure_dir/rstudio_dataengine-service_ensured'.format(ssh_user)):
-                dlab.fab.remove_rstudio_dataengines_kernel(dataproc_name, ssh_user)
-            sudo('rm -rf  /opt/{0}/{1}/'.format(dataproc_version, dataproc_name))
-            print("Notebook's {} kernels were removed".format(env.hosts))
+            dlab.fab.remove_cluster_kernels([notebook_ip], ssh_user, key_path, dataproc_name,
+                                            '/opt/{0}/{1}/'.format(dataproc_version, dataproc_name),
+                                            'dataengine-service')
         except Exception as err:
             logging.info(
                 "Unable to delete dataproc kernels from notebook: " + str(err) + "\n Traceback: " + traceback.print_exc(
@@ -1159,7 +1184,7 @@ class GCPActions:
 
 
 def ensure_local_jars(os_user, jars_dir):
-    if not exists('/home/{}/.ensure_dir/gs_kernel_ensured'.format(os_user)):
+    if not ensured(os_user, 'gs_kernel_ensured'):
         try:
             templates_dir = '/root/templates/'
             sudo('mkdir -p {}'.format(jars_dir))
@@ -1174,7 +1199,7 @@ def ensure_local_jars(os_user, jars_dir):
             if os.environ['application'] == 'zeppelin':
                 sudo('echo \"spark.jars $(ls -1 ' + jars_dir + '* | tr \'\\n\' \',\')\" >> /tmp/notebook_spark-defaults_local.conf')
             sudo('\cp /tmp/notebook_spark-defaults_local.conf /opt/spark/conf/spark-defaults.conf')
-            sudo('touch /home/{}/.ensure_dir/gs_kernel_ensured'.format(os_user))
+            set_ensured(os_user, 'gs_kernel_ensured')
         except:
             sys.exit(1)
 
@@ -1194,38 +1219,38 @@ def installing_python(region, bucket, user_name, cluster_name, application='', p
 
 
 def prepare_disk(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/disk_ensured'):
+    if not ensured(os_user, 'disk_ensured'):
         try:
             disk_name = sudo("lsblk | grep disk | awk '{print $1}' | sort | tail -n 1")
             sudo('''bash -c 'echo -e "o\nn\np\n1\n\n\nw" | fdisk /dev/{}' '''.format(disk_name))
             sudo('mkfs.ext4 -F /dev/{}1'.format(disk_name))
             sudo('mount /dev/{}1 /opt/'.format(disk_name))
             sudo(''' bash -c "echo '/dev/{}1 /opt/ ext4 errors=remount-ro 0 1' >> /etc/fstab" '''.format(disk_name))
-            sudo('touch /home/' + os_user + '/.ensure_dir/disk_ensured')
+            set_ensured(os_user, 'disk_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_local_spark(os_user, spark_link, spark_version, hadoop_version, local_spark_path):
-    if not exists('/home/' + os_user + '/.ensure_dir/local_spark_ensured'):
+    if not ensured(os_user, 'local_spark_ensured'):
         try:
             sudo('wget ' + spark_link + ' -O /tmp/spark-' + spark_version + '-bin-hadoop' + hadoop_version + '.tgz')
             sudo('tar -zxvf /tmp/spark-' + spark_version + '-bin-hadoop' + hadoop_version + '.tgz -C /opt/')
             sudo('mv /opt/spark-' + spark_version + '-bin-hadoop' + hadoop_version + ' ' + local_spark_path)
             sudo('chown -R ' + os_user + ':' + os_user + ' ' + local_spark_path)
-            sudo('touch /home/' + os_user + '/.ensure_dir/local_spark_ensured')
+            set_ensured(os_user, 'local_spark_ensured')
         except:
             sys.exit(1)
 
 
 def configure_local_spark(os_user, jars_dir, region, templates_dir, memory_type='driver'):
-    if not exists('/home/{}/.ensure_dir/local_spark_configured'.format(os_user)):
+    if not ensured(os_user, 'local_spark_configured'):
         try:
             put(templates_dir + 'notebook_spark-defaults_local.conf', '/tmp/notebook_spark-defaults_local.conf')
             if os.environ['application'] == 'zeppelin':
                 sudo('echo \"spark.jars $(ls -1 ' + jars_dir + '* | tr \'\\n\' \',\')\" >> /tmp/notebook_spark-defaults_local.conf')
             sudo('\cp /tmp/notebook_spark-defaults_local.conf /opt/spark/conf/spark-defaults.conf')
-            sudo('touch /home/{}/.ensure_dir/local_spark_configured'.format(os_user))
+            set_ensured(os_user, 'local_spark_configured')
         except:
             sys.exit(1)
     try:
@@ -1240,56 +1265,8 @@ def configure_local_spark(os_user, jars_dir, region, templates_dir, memory_type=
 def remove_dataengine_kernels(notebook_name, os_user, key_path, cluster_name):
     try:
         private = meta_lib.get_instance_private_ip_address(cluster_name, notebook_name)
-        env.hosts = "{}".format(private)
-        env.user = "{}".format(os_user)
-        env.key_filename = "{}".format(key_path)
-        env.host_string = env.user + "@" + env.hosts
-        sudo('rm -rf /home/{}/.local/share/jupyter/kernels/*_{}'.format(os_user, cluster_name))
-        if exists('/home/{}/.ensure_dir/dataengine_{}_interpreter_ensured'.format(os_user, cluster_name)):
-            if os.environ['notebook_multiple_clusters'] == 'true':
-                try:
-                    livy_port = sudo("cat /opt/" + cluster_name +
-                                     "/livy/conf/livy.conf | grep livy.server.port | tail -n 1 | awk '{printf $3}'")
-                    process_number = sudo("netstat -natp 2>/dev/null | grep ':" + livy_port +
-                                          "' | awk '{print $7}' | sed 's|/.*||g'")
-                    sudo('kill -9 ' + process_number)
-                    sudo('systemctl disable livy-server-' + livy_port)
-                except:
-                    print("Wasn't able to find Livy server for this EMR!")
-            sudo(
-                'sed -i \"s/^export SPARK_HOME.*/export SPARK_HOME=\/opt\/spark/\" /opt/zeppelin/conf/zeppelin-env.sh')
-            sudo("rm -rf /home/{}/.ensure_dir/dataengine_interpreter_ensure".format(os_user))
-            zeppelin_url = 'http://' + private + ':8080/api/interpreter/setting/'
-            opener = urllib2.build_opener(urllib2.ProxyHandler({}))
-            req = opener.open(urllib2.Request(zeppelin_url))
-            r_text = req.read()
-            interpreter_json = json.loads(r_text)
-            interpreter_prefix = cluster_name
-            for interpreter in interpreter_json['body']:
-                if interpreter_prefix in interpreter['name']:
-                    print("Interpreter with ID: {} and name: {} will be removed from zeppelin!".format(
-                        interpreter['id'], interpreter['name']))
-                    request = urllib2.Request(zeppelin_url + interpreter['id'], data='')
-                    request.get_method = lambda: 'DELETE'
-                    url = opener.open(request)
-                    print(url.read())
-            sudo('chown ' + os_user + ':' + os_user + ' -R /opt/zeppelin/')
-            sudo('systemctl daemon-reload')
-            sudo("service zeppelin-notebook stop")
-            sudo("service zeppelin-notebook start")
-            zeppelin_restarted = False
-            while not zeppelin_restarted:
-                sudo('sleep 5')
-                result = sudo('nmap -p 8080 localhost | grep "closed" > /dev/null; echo $?')
-                result = result[:1]
-                if result == '1':
-                    zeppelin_restarted = True
-            sudo('sleep 5')
-            sudo('rm -rf /home/{}/.ensure_dir/dataengine_{}_interpreter_ensured'.format(os_user, cluster_name))
-        if exists('/home/{}/.ensure_dir/rstudio_dataengine_ensured'.format(os_user)):
-            dlab.fab.remove_rstudio_dataengines_kernel(cluster_name, os_user)
-        sudo('rm -rf  /opt/' + cluster_name + '/')
-        print("Notebook's {} kernels were removed".format(env.hosts))
+        dlab.fab.remove_cluster_kernels([private], os_user, key_path, cluster_name, '/opt/{}/'.format(cluster_name),
+                                        'dataengine')
     except Exception as err:
         logging.info("Unable to remove kernels on Notebook: " + str(err) + "\n Traceback: " + traceback.print_exc(
             file=sys.stdout))
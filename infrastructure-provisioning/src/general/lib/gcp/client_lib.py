@@ -0,0 +1,123 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+import os
+import argparse
+import backoff
+import httplib2
+import google.auth
+import google_auth_httplib2
+from googleapiclient.discovery import build_from_document
+from google.cloud import storage
+
+# GCPMeta and GCPActions are constructed for almost every call, all of them share the clients of one context
+# per process: credentials are resolved once, every service is built once on its first use from a discovery
+# document of the cache baked into the image, and the requests go through one authorized HTTP transport,
+# which keeps its connections to the APIs open.
+discovery_url = 'https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest'
+discovery_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery')
+services = (('compute', 'v1'), ('iam', 'v1'), ('dataproc', 'v1'), ('storage', 'v1'), ('cloudresourcemanager', 'v1'))
+scopes = ['https://www.googleapis.com/auth/compute',
+          'https://www.googleapis.com/auth/iam',
+          'https://www.googleapis.com/auth/cloud-platform']
+http_timeout = 60
+
+context = None
+stats = {'contexts': 0, 'services_built': 0, 'discovery_fetched': 0}
+
+
+@backoff.on_exception(backoff.expo,
+                      google.auth.exceptions.DefaultCredentialsError,
+                      max_tries=15)
+def get_default_credentials():
+    credentials, project = google.auth.default()
+    return credentials, project
+
+
+def get_credentials():
+    if os.environ['conf_resource'] == 'ssn':
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "/root/service_account.json"
+        credentials, project = google.auth.default()
+    else:
+        credentials, project = get_default_credentials()
+    # build() scoped the credentials with the scopes of every discovery document, cloud-platform covers them
+    if credentials.requires_scopes:
+        credentials = credentials.with_scopes(scopes)
+    return credentials, project
+
+
+def get_discovery_document(api, version):
+    cache_file = os.path.join(discovery_cache_dir, '{}.{}.json'.format(api, version))
+    if os.path.exists(cache_file):
+        with open(cache_file) as document:
+            return document.read()
+    response, content = httplib2.Http(timeout=http_timeout).request(discovery_url.format(api=api, version=version))
+    if response.status >= 400:
+        raise Exception('Unable to get discovery document of {} {}: {} {}'.format(api, version, response.status,
+                                                                                 content))
+    stats['discovery_fetched'] += 1
+    try:
+        if not os.path.exists(discovery_cache_dir):
+            os.makedirs(discovery_cache_dir)
+        with open(cache_file + '.tmp', 'w') as document:
+            document.write(content)
+        os.rename(cache_file + '.tmp', cache_file)
+    except (IOError, OSError):
+        pass
+    return content
+
+
+class GCPContext:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.credentials, self.project = get_credentials()
+        # Refreshes the access token on expiry and on 401, like the transports build() created
+        self.http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=http_timeout))
+        self.services = dict()
+        self.storage = None
+        stats['contexts'] += 1
+
+    def get_service(self, api, version='v1'):
+        if (api, version) not in self.services:
+            self.services[(api, version)] = build_from_document(get_discovery_document(api, version), http=self.http)
+            stats['services_built'] += 1
+        return self.services[(api, version)]
+
+    def get_storage_client(self):
+        if self.storage is None:
+            self.storage = storage.Client(project=self.project, credentials=self.credentials)
+        return self.storage
+
+
+def get_context():
+    # httplib2 connections must not be shared with forked processes, a forked request gets a context of its own
+    global context
+    if context is None or context.pid != os.getpid():
+        context = GCPContext()
+    return context
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fills the discovery cache, run on the build of the image')
+    parser.add_argument('--cache_dir', type=str, default=discovery_cache_dir)
+    args = parser.parse_args()
+
+    discovery_cache_dir = args.cache_dir
+    for api, version in services:
+        get_discovery_document(api, version)
+    print('Discovery documents of {} APIs are cached in {}'.format(len(services), discovery_cache_dir))
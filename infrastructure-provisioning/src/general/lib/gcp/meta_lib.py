@@ -23,6 +23,7 @@ from google.cloud import exceptions
 import google.auth
 from dlab.fab import *
 import actions_lib
+import client_lib
 import os, re
 from googleapiclient import errors
 import logging
@@ -33,38 +34,33 @@ import backoff
 
 class GCPMeta:
     def __init__(self, auth_type='service_account'):
-        @backoff.on_exception(backoff.expo,
-                              google.auth.exceptions.DefaultCredentialsError,
-                              max_tries=15)
-        def get_gcp_cred():
-            credentials, project = google.auth.default()
-            return credentials, project
-
         self.auth_type = auth_type
         self.project = os.environ['gcp_project_id']
+        self.context = client_lib.get_context()
 
-        if os.environ['conf_resource'] == 'ssn':
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "/root/service_account.json"
-            credentials, project = google.auth.default()
-            if credentials.requires_scopes:
-                credentials = credentials.with_scopes(
-                    ['https://www.googleapis.com/auth/compute',
-                     'https://www.googleapis.com/auth/iam',
-                     'https://www.googleapis.com/auth/cloud-platform'])
-            self.service = build('compute', 'v1', credentials=credentials)
-            self.service_iam = build('iam', 'v1', credentials=credentials)
-            self.dataproc = build('dataproc', 'v1', credentials=credentials)
-            self.service_storage = build('storage', 'v1', credentials=credentials)
-            self.storage_client = storage.Client(project=project, credentials=credentials)
-            self.service_resource = build('cloudresourcemanager', 'v1', credentials=credentials)
-        else:
-            credentials, project = get_gcp_cred()
-            self.service = build('compute', 'v1', credentials=credentials)
-            self.service_iam = build('iam', 'v1', credentials=credentials)
-            self.dataproc = build('dataproc', 'v1', credentials=credentials)
-            self.service_storage = build('storage', 'v1', credentials=credentials)
-            self.storage_client = storage.Client(project=project, credentials=credentials)
-            self.service_resource = build('cloudresourcemanager', 'v1', credentials=credentials)
+    @property
+    def service(self):
+        return self.context.get_service('compute')
+
+    @property
+    def service_iam(self):
+        return self.context.get_service('iam')
+
+    @property
+    def dataproc(self):
+        return self.context.get_service('dataproc')
+
+    @property
+    def service_storage(self):
+        return self.context.get_service('storage')
+
+    @property
+    def storage_client(self):
+        return self.context.get_storage_client()
+
+    @property
+    def service_resource(self):
+        return self.context.get_service('cloudresourcemanager')
 
     def wait_for_operation(self, operation, region='', zone=''):
         print('Waiting for operation to finish...')
@@ -568,21 +564,18 @@ class GCPMeta:
             traceback.print_exc(file=sys.stdout)
             return ''
 
-    def get_dataproc_jobs(self):
+    def get_dataproc_jobs(self, cluster_name=''):
+        # Filtered by the API when a cluster is given, pages are followed until there is no nextPageToken
         jobs = []
         try:
-            res = self.dataproc.projects().regions().jobs().list(projectId=self.project,
-                                                                 region=os.environ['gcp_region']).execute()
-            jobs = [job for job in res['jobs']]
-            page_token = res.get('nextPageToken')
-            while page_token != 'None':
-                res2 = self.dataproc.projects().regions().jobs().list(projectId=self.project,
-                                                                      region=os.environ['gcp_region'],
-                                                                      pageToken=page_token).execute()
-                jobs.extend([job for job in res2['jobs']])
-                page_token = str(res2.get('nextPageToken'))
-            return jobs
-        except KeyError:
+            params = {'projectId': self.project, 'region': os.environ['gcp_region'], 'pageSize': 1000}
+            if cluster_name:
+                params['clusterName'] = cluster_name
+            request = self.dataproc.projects().regions().jobs().list(**params)
+            while request is not None:
+                res = request.execute()
+                jobs.extend(res.get('jobs', []))
+                request = self.dataproc.projects().regions().jobs().list_next(request, res)
             return jobs
         except Exception as err:
             logging.info(
@@ -621,6 +614,80 @@ class GCPMeta:
             traceback.print_exc(file=sys.stdout)
 
 
+class OperationTracker:
+    # Long-running compute operations of independent resources are submitted one after another and waited
+    # for together: every poll asks for all pending operations in one batch HTTP request
+    def __init__(self, poll_interval=1, max_poll_interval=5, timeout=1800):
+        self.meta = GCPMeta()
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.operations = list()
+
+    def submit(self, operation, description='', region='', zone=''):
+        # The description is printed once the operation is done
+        self.operations.append({'name': operation['name'], 'description': description or operation['name'],
+                                'region': region, 'zone': zone, 'operation': operation,
+                                'done': False, 'error': None})
+        return operation
+
+    def get_request(self, item):
+        if item['region'] != '':
+            return self.meta.service.regionOperations().get(project=self.meta.project, operation=item['name'],
+                                                            region=item['region'])
+        elif item['zone'] != '':
+            return self.meta.service.zoneOperations().get(project=self.meta.project, operation=item['name'],
+                                                          zone=item['zone'])
+        else:
+            return self.meta.service.globalOperations().get(project=self.meta.project, operation=item['name'])
+
+    def update(self, item, operation, exception):
+        if exception is not None:
+            item['done'] = True
+            item['error'] = str(exception)
+        else:
+            item['operation'] = operation
+            if operation['status'] == 'DONE':
+                item['done'] = True
+                if 'error' in operation:
+                    item['error'] = '; '.join([error.get('message', error.get('code', ''))
+                                               for error in operation['error'].get('errors', [])])
+                else:
+                    print(item['description'])
+
+    def wait(self, raise_on_error=True):
+        # Returns the operations with their final state and error, raises after all of them finished
+        # if any failed
+        start = time.time()
+        delay = self.poll_interval
+        pending = [item for item in self.operations if not item['done']]
+        if pending:
+            print('Waiting for {} operations to finish...'.format(len(pending)))
+        while pending:
+            batch = self.meta.service.new_batch_http_request()
+            for index, item in enumerate(pending):
+                batch.add(self.get_request(item), request_id=str(index),
+                          callback=lambda request_id, response, exception:
+                          self.update(pending[int(request_id)], response, exception))
+            batch.execute()
+            pending = [item for item in pending if not item['done']]
+            if pending:
+                if time.time() - start > self.timeout:
+                    raise Exception('Operations are not done after {} seconds: {}'.format(
+                        self.timeout, ', '.join([item['description'] for item in pending])))
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+        failed = [item for item in self.operations if item['error']]
+        print('{} operations done in {:.1f}s, {} failed'.format(len(self.operations), time.time() - start,
+                                                               len(failed)))
+        results = list(self.operations)
+        self.operations = list()
+        if failed and raise_on_error:
+            raise Exception('Operations failed: ' + '; '.join(
+                ['{}: {}'.format(item['description'], item['error']) for item in failed]))
+        return results
+
+
 def get_instance_private_ip_address(tag_name, instance_name):
     try:
         return GCPMeta().get_private_ip_address(instance_name)
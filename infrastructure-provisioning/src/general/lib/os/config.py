@@ -0,0 +1,141 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+import os
+import sys
+import time
+import marshal
+import argparse
+from ConfigParser import SafeConfigParser
+
+snapshot_version = 1
+typed_values = dict()
+
+
+def read_ini_config(conf_dir='/root/conf'):
+    # Returns (defaults, overwrites) parsed from *.ini and *overwrite.ini files
+    defaults = dict()
+    overwrites = dict()
+    for filename in sorted(os.listdir(conf_dir)):
+        if filename.endswith('.ini'):
+            config = SafeConfigParser()
+            config.read(os.path.join(conf_dir, filename))
+            for section in config.sections():
+                for option in config.options(section):
+                    varname = "{0}_{1}".format(section, option)
+                    value = config.get(section, option)
+                    defaults.setdefault(varname, value)
+                    if filename.endswith('overwrite.ini'):
+                        overwrites[varname] = value
+    return defaults, overwrites
+
+
+def get_sources(conf_dir):
+    sources = list()
+    for filename in sorted(os.listdir(conf_dir)):
+        if filename.endswith('.ini'):
+            stat = os.stat(os.path.join(conf_dir, filename))
+            sources.append((filename, stat.st_size, int(stat.st_mtime)))
+    return sources
+
+
+def to_typed(value):
+    # Only lossless conversions: '0600' or '1.14' stay strings
+    if value in ('true', 'false'):
+        return value == 'true'
+    try:
+        if str(int(value)) == value:
+            return int(value)
+    except ValueError:
+        pass
+    return value
+
+
+def compile_config(conf_dir, snapshot_path):
+    defaults, overwrites = read_ini_config(conf_dir)
+    merged = dict(defaults)
+    merged.update(overwrites)
+    snapshot = {
+        'version': snapshot_version,
+        'sources': get_sources(conf_dir),
+        'defaults': defaults,
+        'overwrites': overwrites,
+        'typed': dict((name, to_typed(value)) for name, value in merged.items())
+    }
+    with open(snapshot_path + '.tmp', 'wb') as snapshot_file:
+        marshal.dump(snapshot, snapshot_file)
+    os.rename(snapshot_path + '.tmp', snapshot_path)
+    return snapshot
+
+
+def load_snapshot(conf_dir, snapshot_path):
+    # Returns the snapshot only if it was compiled from the ini files currently in conf_dir
+    try:
+        with open(snapshot_path, 'rb') as snapshot_file:
+            snapshot = marshal.load(snapshot_file)
+        if snapshot.get('version') == snapshot_version and \
+                [tuple(i) for i in snapshot['sources']] == get_sources(conf_dir):
+            return snapshot
+    except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+    return None
+
+
+def load_config(conf_dir='/root/conf', snapshot_path='/root/conf_snapshot'):
+    snapshot = load_snapshot(conf_dir, snapshot_path)
+    if snapshot:
+        typed_values.update(snapshot['typed'])
+        return snapshot['defaults'], snapshot['overwrites']
+    return read_ini_config(conf_dir)
+
+
+def get(name, default=None):
+    # Typed accessor next to os.environ: values passed with the request override the compiled ones
+    if name in os.environ:
+        return to_typed(os.environ[name])
+    if not typed_values:
+        snapshot = load_snapshot('/root/conf', '/root/conf_snapshot')
+        if snapshot:
+            typed_values.update(snapshot['typed'])
+    return typed_values.get(name, default)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conf_dir', type=str, default='/root/conf')
+    parser.add_argument('--snapshot', type=str, default='/root/conf_snapshot')
+    parser.add_argument('--benchmark', type=int, default=0,
+                        help='Compare parsing of the ini files with loading of the snapshot over N iterations')
+    args = parser.parse_args()
+
+    snapshot = compile_config(args.conf_dir, args.snapshot)
+    print("Compiled {} options from {} files into {}".format(len(snapshot['typed']), len(snapshot['sources']),
+                                                             args.snapshot))
+    if args.benchmark:
+        start = time.time()
+        for i in range(args.benchmark):
+            read_ini_config(args.conf_dir)
+        parse_time = (time.time() - start) / args.benchmark
+        start = time.time()
+        for i in range(args.benchmark):
+            load_snapshot(args.conf_dir, args.snapshot)
+        snapshot_time = (time.time() - start) / args.benchmark
+        print("ini parsing: {:.3f}ms, snapshot loading: {:.3f}ms, saved per request: {:.3f}ms".format(
+            parse_time * 1000, snapshot_time * 1000, (parse_time - snapshot_time) * 1000))
+    sys.exit(0)
@@ -20,6 +20,7 @@
 
 from fabric.api import *
 from fabric.contrib.files import exists
+from dlab.state import ensured, set_ensured
 import sys
 
 
@@ -28,14 +29,14 @@ def ensure_pkg(user, requisites='linux-headers-generic python-pip python-dev '
                                 'libssl-dev unattended-upgrades nmap '
                                 'libffi-dev unzip libxml2-dev'):
     try:
-        if not exists('/home/{}/.ensure_dir/pkg_upgraded'.format(user)):
+        if not ensured(user, 'pkg_upgraded'):
             print("Updating repositories "
                   "and installing requested tools: {}".format(requisites))
             sudo('apt-get update')
             sudo('apt-get -y install ' + requisites)
             sudo('unattended-upgrades -v')
             sudo('export LC_ALL=C')
-            sudo('touch /home/{}/.ensure_dir/pkg_upgraded'.format(user))
+            set_ensured(user, 'pkg_upgraded')
         return True
     except:
         return False
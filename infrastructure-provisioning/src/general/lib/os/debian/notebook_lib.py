@@ -51,7 +51,7 @@ def enable_proxy(proxy_host, proxy_port):
 
 
 def ensure_r_local_kernel(spark_version, os_user, templates_dir, kernels_dir):
-    if not exists('/home/' + os_user + '/.ensure_dir/r_local_kernel_ensured'):
+    if not ensured(os_user, 'r_local_kernel_ensured'):
         try:
             sudo('R -e "IRkernel::installspec()"')
             r_version = sudo("R --version | awk '/version / {print $3}'")
@@ -62,7 +62,7 @@ def ensure_r_local_kernel(spark_version, os_user, templates_dir, kernels_dir):
             sudo('ln -s /opt/spark/ /usr/local/spark')
             sudo('cd /usr/local/spark/R/lib/SparkR; R -e "devtools::install(\'.\')"')
             sudo('chown -R ' + os_user + ':' + os_user + ' /home/' + os_user + '/.local')
-            sudo('touch /home/' + os_user + '/.ensure_dir/r_local_kernel_ensured')
+            set_ensured(os_user, 'r_local_kernel_ensured')
         except:
             sys.exit(1)
 
@@ -74,63 +74,64 @@ def add_marruter_key():
         sys.exit(1)
 
 def ensure_r(os_user, r_libs, region, r_mirror):
-    if not exists('/home/' + os_user + '/.ensure_dir/r_ensured'):
+    if not ensured(os_user, 'r_ensured'):
         try:
             if region == 'cn-north-1':
                 r_repository = r_mirror
             else:
                 r_repository = 'http://cran.us.r-project.org'
             add_marruter_key()
-            sudo('apt update')
-            sudo('apt-get install -y libcurl4-openssl-dev libssl-dev libreadline-dev')
-            sudo('apt-get install -y cmake')
-            sudo('apt-get install -y r-base r-base-dev')
-            sudo('R CMD javareconf')
-            sudo('cd /root; git clone https://github.com/zeromq/zeromq4-x.git; cd zeromq4-x/; mkdir build; cd build; cmake ..; make install; ldconfig')
+            batch = RemoteBatch('ensure_r', user=os_user)
+            batch.sudo('apt update')
+            batch.sudo('apt-get install -y libcurl4-openssl-dev libssl-dev libreadline-dev')
+            batch.sudo('apt-get install -y cmake')
+            batch.sudo('apt-get install -y r-base r-base-dev')
+            batch.sudo('R CMD javareconf')
+            batch.sudo('cd /root; git clone https://github.com/zeromq/zeromq4-x.git; cd zeromq4-x/; mkdir build; cd build; cmake ..; make install; ldconfig')
             for i in r_libs:
-                sudo('R -e "install.packages(\'{}\',repos=\'{}\')"'.format(i, r_repository))
-            sudo('R -e "library(\'devtools\');install.packages(repos=\'{}\',c(\'rzmq\',\'repr\',\'digest\',\'stringr\',\'RJSONIO\',\'functional\',\'plyr\'))"'.format(r_repository))
-            try:
-                sudo('R -e "library(\'devtools\');install_github(\'IRkernel/repr\');install_github(\'IRkernel/IRdisplay\');install_github(\'IRkernel/IRkernel\');"')
-            except:
-                sudo('R -e "options(download.file.method = "wget");library(\'devtools\');install_github(\'IRkernel/repr\');install_github(\'IRkernel/IRdisplay\');install_github(\'IRkernel/IRkernel\');"')
+                batch.sudo('R -e "install.packages(\'{}\',repos=\'{}\')"'.format(i, r_repository))
+            batch.sudo('R -e "library(\'devtools\');install.packages(repos=\'{}\',c(\'rzmq\',\'repr\',\'digest\',\'stringr\',\'RJSONIO\',\'functional\',\'plyr\'))"'.format(r_repository))
+            batch.sudo('R -e "library(\'devtools\');install_github(\'IRkernel/repr\');install_github(\'IRkernel/IRdisplay\');install_github(\'IRkernel/IRkernel\');" || '
+                       'R -e "options(download.file.method = "wget");library(\'devtools\');install_github(\'IRkernel/repr\');install_github(\'IRkernel/IRdisplay\');install_github(\'IRkernel/IRkernel\');"')
             if os.environ['application'] == 'tensor-rstudio':
-                sudo('R -e "library(\'devtools\');install_github(\'rstudio/keras\');"')
-            sudo('R -e "install.packages(\'RJDBC\',repos=\'{}\',dep=TRUE)"'.format(r_repository))
-            sudo('touch /home/' + os_user + '/.ensure_dir/r_ensured')
+                batch.sudo('R -e "library(\'devtools\');install_github(\'rstudio/keras\');"')
+            batch.sudo('R -e "install.packages(\'RJDBC\',repos=\'{}\',dep=TRUE)"'.format(r_repository))
+            set_ensured(os_user, 'r_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
 
 
 def install_rstudio(os_user, local_spark_path, rstudio_pass, rstudio_version):
-    if not exists('/home/' + os_user + '/.ensure_dir/rstudio_ensured'):
+    if not ensured(os_user, 'rstudio_ensured'):
         try:
-            sudo('apt-get install -y r-base')
-            sudo('apt-get install -y gdebi-core')
-            sudo('wget https://download2.rstudio.org/rstudio-server-{}-amd64.deb'.format(rstudio_version))
-            sudo('gdebi -n rstudio-server-{}-amd64.deb'.format(rstudio_version))
-            sudo('mkdir -p /mnt/var')
-            sudo('chown {0}:{0} /mnt/var'.format(os_user))
+            batch = RemoteBatch('install_rstudio', user=os_user)
+            batch.sudo('apt-get install -y r-base')
+            batch.sudo('apt-get install -y gdebi-core')
+            batch.sudo('wget https://download2.rstudio.org/rstudio-server-{}-amd64.deb'.format(rstudio_version))
+            batch.sudo('gdebi -n rstudio-server-{}-amd64.deb'.format(rstudio_version))
+            batch.sudo('mkdir -p /mnt/var')
+            batch.sudo('chown {0}:{0} /mnt/var'.format(os_user))
             if os.environ['application'] == 'tensor-rstudio':
-                sudo("sed -i '/ExecStart/s|=|=/bin/bash -c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64; |g' /etc/systemd/system/rstudio-server.service")
-                sudo("sed -i '/ExecStart/s|$|\"|g' /etc/systemd/system/rstudio-server.service")
-                sudo("systemctl daemon-reload")
-            sudo('touch /home/{}/.Renviron'.format(os_user))
-            sudo('chown {0}:{0} /home/{0}/.Renviron'.format(os_user))
-            sudo('''echo 'SPARK_HOME="{0}"' >> /home/{1}/.Renviron'''.format(local_spark_path, os_user))
-            sudo('touch /home/{}/.Rprofile'.format(os_user))
-            sudo('chown {0}:{0} /home/{0}/.Rprofile'.format(os_user))
-            sudo('''echo 'library(SparkR, lib.loc = c(file.path(Sys.getenv("SPARK_HOME"), "R", "lib")))' >> /home/{}/.Rprofile'''.format(os_user))
-            http_proxy = run('echo $http_proxy')
-            https_proxy = run('echo $https_proxy')
-            sudo('''echo 'Sys.setenv(http_proxy = \"{}\")' >> /home/{}/.Rprofile'''.format(http_proxy, os_user))
-            sudo('''echo 'Sys.setenv(https_proxy = \"{}\")' >> /home/{}/.Rprofile'''.format(https_proxy, os_user))
-            sudo('rstudio-server start')
-            sudo('echo "{0}:{1}" | chpasswd'.format(os_user, rstudio_pass))
-            sudo("sed -i '/exit 0/d' /etc/rc.local")
-            sudo('''bash -c "echo \'sed -i 's/^#SPARK_HOME/SPARK_HOME/' /home/{}/.Renviron\' >> /etc/rc.local"'''.format(os_user))
-            sudo("bash -c 'echo exit 0 >> /etc/rc.local'")
-            sudo('touch /home/{}/.ensure_dir/rstudio_ensured'.format(os_user))
+                batch.sudo("sed -i '/ExecStart/s|=|=/bin/bash -c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64; |g' /etc/systemd/system/rstudio-server.service")
+                batch.sudo("sed -i '/ExecStart/s|$|\"|g' /etc/systemd/system/rstudio-server.service")
+                batch.sudo("systemctl daemon-reload")
+            batch.sudo('touch /home/{}/.Renviron'.format(os_user))
+            batch.sudo('chown {0}:{0} /home/{0}/.Renviron'.format(os_user))
+            batch.sudo('''echo 'SPARK_HOME="{0}"' >> /home/{1}/.Renviron'''.format(local_spark_path, os_user))
+            batch.sudo('touch /home/{}/.Rprofile'.format(os_user))
+            batch.sudo('chown {0}:{0} /home/{0}/.Rprofile'.format(os_user))
+            batch.sudo('''echo 'library(SparkR, lib.loc = c(file.path(Sys.getenv("SPARK_HOME"), "R", "lib")))' >> /home/{}/.Rprofile'''.format(os_user))
+            # Proxy settings come from /etc/profile, which the batch shell has loaded as a login shell
+            batch.sudo('''echo "Sys.setenv(http_proxy = \\"$http_proxy\\")" >> /home/{}/.Rprofile'''.format(os_user))
+            batch.sudo('''echo "Sys.setenv(https_proxy = \\"$https_proxy\\")" >> /home/{}/.Rprofile'''.format(os_user))
+            batch.sudo('rstudio-server start')
+            batch.sudo('echo "{0}:{1}" | chpasswd'.format(os_user, rstudio_pass))
+            batch.sudo("sed -i '/exit 0/d' /etc/rc.local")
+            batch.sudo('''bash -c "echo \'sed -i 's/^#SPARK_HOME/SPARK_HOME/' /home/{}/.Renviron\' >> /etc/rc.local"'''.format(os_user))
+            batch.sudo("bash -c 'echo exit 0 >> /etc/rc.local'")
+            set_ensured(os_user, 'rstudio_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
     else:
@@ -141,7 +142,7 @@ def install_rstudio(os_user, local_spark_path, rstudio_pass, rstudio_version):
 
 
 def ensure_matplot(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/matplot_ensured'):
+    if not ensured(os_user, 'matplot_ensured'):
         try:
             sudo('apt-get build-dep -y python-matplotlib')
             sudo('pip2 install matplotlib==2.0.2 --no-cache-dir')
@@ -149,7 +150,7 @@ def ensure_matplot(os_user):
             if os.environ['application'] in ('tensor', 'deeplearning'):
                 sudo('python2.7 -m pip install -U numpy=={} --no-cache-dir'.format(os.environ['notebook_numpy_version']))
                 sudo('python3.5 -m pip install -U numpy=={} --no-cache-dir'.format(os.environ['notebook_numpy_version']))
-            sudo('touch /home/' + os_user + '/.ensure_dir/matplot_ensured')
+            set_ensured(os_user, 'matplot_ensured')
         except:
             sys.exit(1)
 
@@ -159,67 +160,69 @@ def add_sbt_key():
         'apt-key adv --keyserver hkp://keyserver.ubuntu.com:80 --recv 642AC823')
 
 def ensure_sbt(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/sbt_ensured'):
+    if not ensured(os_user, 'sbt_ensured'):
         try:
             sudo('apt-get install -y apt-transport-https')
             sudo('echo "deb https://dl.bintray.com/sbt/debian /" | sudo tee -a /etc/apt/sources.list.d/sbt.list')
             add_sbt_key()
             sudo('apt-get update')
             sudo('apt-get install -y sbt')
-            sudo('touch /home/' + os_user + '/.ensure_dir/sbt_ensured')
+            set_ensured(os_user, 'sbt_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_scala(scala_link, scala_version, os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/scala_ensured'):
+    if not ensured(os_user, 'scala_ensured', {"scala_version": scala_version}):
         try:
             sudo('wget {}scala-{}.deb -O /tmp/scala.deb'.format(scala_link, scala_version))
             sudo('dpkg -i /tmp/scala.deb')
-            sudo('touch /home/' + os_user + '/.ensure_dir/scala_ensured')
+            set_ensured(os_user, 'scala_ensured', {"scala_version": scala_version}, scala_version)
         except:
             sys.exit(1)
 
 
 def ensure_jre_jdk(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/jre_jdk_ensured'):
+    if not ensured(os_user, 'jre_jdk_ensured'):
         try:
             sudo('apt-get install -y default-jre')
             sudo('apt-get install -y default-jdk')
-            sudo('touch /home/' + os_user + '/.ensure_dir/jre_jdk_ensured')
+            set_ensured(os_user, 'jre_jdk_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_additional_python_libs(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/additional_python_libs_ensured'):
+    if not ensured(os_user, 'additional_python_libs_ensured'):
         try:
-            sudo('apt-get install -y libjpeg8-dev zlib1g-dev')
+            batch = RemoteBatch('ensure_additional_python_libs', user=os_user)
+            batch.sudo('apt-get install -y libjpeg8-dev zlib1g-dev')
             if os.environ['application'] in ('jupyter', 'zeppelin'):
-                sudo('pip2 install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
-                sudo('pip3 install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
+                batch.sudo('pip2 install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
+                batch.sudo('pip3 install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
             if os.environ['application'] in ('tensor', 'deeplearning'):
-                sudo('pip2 install opencv-python h5py --no-cache-dir')
-                sudo('pip3 install opencv-python h5py --no-cache-dir')
-            sudo('touch /home/' + os_user + '/.ensure_dir/additional_python_libs_ensured')
+                batch.sudo('pip2 install opencv-python h5py --no-cache-dir')
+                batch.sudo('pip3 install opencv-python h5py --no-cache-dir')
+            set_ensured(os_user, 'additional_python_libs_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
 
 
 def ensure_python3_specific_version(python3_version, os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/python3_specific_version_ensured'):
+    if not ensured(os_user, 'python3_specific_version_ensured'):
         try:
             if len(python3_version) < 4:
                 python3_version = python3_version + ".0"
             sudo('wget https://www.python.org/ftp/python/{0}/Python-{0}.tgz'.format(python3_version))
             sudo('tar xzf Python-{0}.tgz; cd Python-{0}; ./configure --prefix=/usr/local; make altinstall'.format(python3_version))
-            sudo('touch /home/' + os_user + '/.ensure_dir/python3_specific_version_ensured')
+            set_ensured(os_user, 'python3_specific_version_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_python2_libraries(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/python2_libraries_ensured'):
+    if not ensured(os_user, 'python2_libraries_ensured'):
         try:
             try:
                 sudo('apt-get install -y libssl-dev python-virtualenv')
@@ -235,13 +238,13 @@ def ensure_python2_libraries(os_user):
             sudo('pip2 install -U pip=={} --no-cache-dir'.format(os.environ['conf_pip_version']))
             sudo('pip2 install boto3 backoff --no-cache-dir')
             sudo('pip2 install fabvenv fabric-virtualenv future --no-cache-dir')
-            sudo('touch /home/' + os_user + '/.ensure_dir/python2_libraries_ensured')
+            set_ensured(os_user, 'python2_libraries_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_python3_libraries(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/python3_libraries_ensured'):
+    if not ensured(os_user, 'python3_libraries_ensured'):
         try:
             sudo('apt-get install python3-setuptools')
             sudo('apt install -y python3-pip')
@@ -254,7 +257,7 @@ def ensure_python3_libraries(os_user):
             sudo('pip3 install -U pip=={} --no-cache-dir'.format(os.environ['conf_pip_version']))
             sudo('pip3 install boto3 --no-cache-dir')
             sudo('pip3 install fabvenv fabric-virtualenv future --no-cache-dir')
-            sudo('touch /home/' + os_user + '/.ensure_dir/python3_libraries_ensured')
+            set_ensured(os_user, 'python3_libraries_ensured')
         except:
             sys.exit(1)
 
@@ -262,69 +265,70 @@ def ensure_python3_libraries(os_user):
 def install_tensor(os_user, cuda_version, cuda_file_name,
                    cudnn_version, cudnn_file_name, tensorflow_version,
                    templates_dir, nvidia_version):
-    if not exists('/home/{}/.ensure_dir/tensor_ensured'.format(os_user)):
+    if not ensured(os_user, 'tensor_ensured'):
         try:
             # install nvidia drivers
-            sudo('echo "blacklist nouveau" >> /etc/modprobe.d/blacklist-nouveau.conf')
-            sudo('echo "options nouveau modeset=0" >> /etc/modprobe.d/blacklist-nouveau.conf')
-            sudo('update-initramfs -u')
+            batch = RemoteBatch('install_tensor', user=os_user)
+            batch.sudo('echo "blacklist nouveau" >> /etc/modprobe.d/blacklist-nouveau.conf')
+            batch.sudo('echo "options nouveau modeset=0" >> /etc/modprobe.d/blacklist-nouveau.conf')
+            batch.sudo('update-initramfs -u')
+            batch.execute()
             with settings(warn_only=True):
                 reboot(wait=150)
-            sudo('apt-get -y install dkms')
-            kernel_version = run('uname -r | tr -d "[..0-9-]"')
-            if kernel_version == 'azure':
-                sudo('apt-get -y install linux-modules-extra-`uname -r`')
-            else:
-                #legacy support for old kernels
-                sudo('if [[ $(apt-cache search linux-image-extra-`uname -r`) ]]; then apt-get -y install linux-image-extra-`uname -r`; else apt-get -y install linux-modules-extra-`uname -r`; fi;')
-            sudo('wget http://us.download.nvidia.com/XFree86/Linux-x86_64/{0}/NVIDIA-Linux-x86_64-{0}.run -O /home/{1}/NVIDIA-Linux-x86_64-{0}.run'.format(nvidia_version, os_user))
-            sudo('/bin/bash /home/{0}/NVIDIA-Linux-x86_64-{1}.run -s --dkms'.format(os_user, nvidia_version))
-            sudo('rm -f /home/{0}/NVIDIA-Linux-x86_64-{1}.run'.format(os_user, nvidia_version))
+            batch = RemoteBatch('install_tensor', user=os_user)
+            batch.sudo('apt-get -y install dkms')
+            #legacy support for old kernels
+            batch.sudo('if [ "$(uname -r | tr -d "[..0-9-]")" == "azure" ]; then apt-get -y install linux-modules-extra-`uname -r`; '
+                       'elif [[ $(apt-cache search linux-image-extra-`uname -r`) ]]; then apt-get -y install linux-image-extra-`uname -r`; else apt-get -y install linux-modules-extra-`uname -r`; fi;')
+            batch.sudo('wget http://us.download.nvidia.com/XFree86/Linux-x86_64/{0}/NVIDIA-Linux-x86_64-{0}.run -O /home/{1}/NVIDIA-Linux-x86_64-{0}.run'.format(nvidia_version, os_user))
+            batch.sudo('/bin/bash /home/{0}/NVIDIA-Linux-x86_64-{1}.run -s --dkms'.format(os_user, nvidia_version))
+            batch.sudo('rm -f /home/{0}/NVIDIA-Linux-x86_64-{1}.run'.format(os_user, nvidia_version))
             # install cuda
-            sudo('python3.5 -m pip install --upgrade pip=={0} wheel numpy=={1} --no-cache-dir'. format(os.environ['conf_pip_version'], os.environ['notebook_numpy_version']))
-            sudo('wget -P /opt https://developer.nvidia.com/compute/cuda/{0}/prod/local_installers/{1}'.format(cuda_version, cuda_file_name))
-            sudo('sh /opt/{} --silent --toolkit'.format(cuda_file_name))
-            sudo('mv /usr/local/cuda-{} /opt/'.format(cuda_version))
-            sudo('ln -s /opt/cuda-{0} /usr/local/cuda-{0}'.format(cuda_version))
-            sudo('rm -f /opt/{}'.format(cuda_file_name))
+            batch.sudo('python3.5 -m pip install --upgrade pip=={0} wheel numpy=={1} --no-cache-dir'. format(os.environ['conf_pip_version'], os.environ['notebook_numpy_version']))
+            batch.sudo('wget -P /opt https://developer.nvidia.com/compute/cuda/{0}/prod/local_installers/{1}'.format(cuda_version, cuda_file_name))
+            batch.sudo('sh /opt/{} --silent --toolkit'.format(cuda_file_name))
+            batch.sudo('mv /usr/local/cuda-{} /opt/'.format(cuda_version))
+            batch.sudo('ln -s /opt/cuda-{0} /usr/local/cuda-{0}'.format(cuda_version))
+            batch.sudo('rm -f /opt/{}'.format(cuda_file_name))
             # install cuDNN
-            run('wget http://developer.download.nvidia.com/compute/redist/cudnn/v{0}/{1} -O /tmp/{1}'.format(cudnn_version, cudnn_file_name))
-            run('tar xvzf /tmp/{} -C /tmp'.format(cudnn_file_name))
-            sudo('mkdir -p /opt/cudnn/include')
-            sudo('mkdir -p /opt/cudnn/lib64')
-            sudo('mv /tmp/cuda/include/cudnn.h /opt/cudnn/include')
-            sudo('mv /tmp/cuda/lib64/libcudnn* /opt/cudnn/lib64')
-            sudo('chmod a+r /opt/cudnn/include/cudnn.h /opt/cudnn/lib64/libcudnn*')
-            run('echo "export LD_LIBRARY_PATH=\"$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64\"" >> ~/.bashrc')
+            batch.run('wget http://developer.download.nvidia.com/compute/redist/cudnn/v{0}/{1} -O /tmp/{1}'.format(cudnn_version, cudnn_file_name))
+            batch.run('tar xvzf /tmp/{} -C /tmp'.format(cudnn_file_name))
+            batch.sudo('mkdir -p /opt/cudnn/include')
+            batch.sudo('mkdir -p /opt/cudnn/lib64')
+            batch.sudo('mv /tmp/cuda/include/cudnn.h /opt/cudnn/include')
+            batch.sudo('mv /tmp/cuda/lib64/libcudnn* /opt/cudnn/lib64')
+            batch.sudo('chmod a+r /opt/cudnn/include/cudnn.h /opt/cudnn/lib64/libcudnn*')
+            batch.run('echo "export LD_LIBRARY_PATH=\"$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64\"" >> ~/.bashrc')
             # install TensorFlow and run TensorBoard
-            sudo('python2.7 -m pip install --upgrade https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp27-none-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
-            sudo('python3 -m pip install --upgrade https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp35-cp35m-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
-            sudo('mkdir /var/log/tensorboard; chown {0}:{0} -R /var/log/tensorboard'.format(os_user))
-            put('{}tensorboard.service'.format(templates_dir), '/tmp/tensorboard.service')
-            sudo("sed -i 's|OS_USR|{}|' /tmp/tensorboard.service".format(os_user))
-            sudo("chmod 644 /tmp/tensorboard.service")
-            sudo('\cp /tmp/tensorboard.service /etc/systemd/system/')
-            sudo("systemctl daemon-reload")
-            sudo("systemctl enable tensorboard")
-            sudo("systemctl start tensorboard")
-            sudo('touch /home/{}/.ensure_dir/tensor_ensured'.format(os_user))
+            batch.sudo('python2.7 -m pip install --upgrade https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp27-none-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
+            batch.sudo('python3 -m pip install --upgrade https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp35-cp35m-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
+            batch.sudo('mkdir /var/log/tensorboard; chown {0}:{0} -R /var/log/tensorboard'.format(os_user))
+            batch.put('{}tensorboard.service'.format(templates_dir), '/tmp/tensorboard.service')
+            batch.sudo("sed -i 's|OS_USR|{}|' /tmp/tensorboard.service".format(os_user))
+            batch.sudo("chmod 644 /tmp/tensorboard.service")
+            batch.sudo('\cp /tmp/tensorboard.service /etc/systemd/system/')
+            batch.sudo("systemctl daemon-reload")
+            batch.sudo("systemctl enable tensorboard")
+            batch.sudo("systemctl start tensorboard")
+            set_ensured(os_user, 'tensor_ensured', batch=batch)
+            batch.execute()
 
         except:
             sys.exit(1)
 
 
 def install_maven(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/maven_ensured'):
+    if not ensured(os_user, 'maven_ensured'):
         sudo('apt-get -y install maven')
-        sudo('touch /home/' + os_user + '/.ensure_dir/maven_ensured')
+        set_ensured(os_user, 'maven_ensured')
 
 
 def install_livy_dependencies(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/livy_dependencies_ensured'):
+    if not ensured(os_user, 'livy_dependencies_ensured'):
         sudo('apt-get -y install libkrb5-dev')
         sudo('pip2 install cloudpickle requests requests-kerberos flake8 flaky pytest --no-cache-dir')
         sudo('pip3 install cloudpickle requests requests-kerberos flake8 flaky pytest --no-cache-dir')
-        sudo('touch /home/' + os_user + '/.ensure_dir/livy_dependencies_ensured')
+        set_ensured(os_user, 'livy_dependencies_ensured')
 
 
 def install_maven_emr(os_user):
@@ -342,10 +346,10 @@ def install_livy_dependencies_emr(os_user):
 
 
 def install_nodejs(os_user):
-    if not exists('/home/{}/.ensure_dir/nodejs_ensured'.format(os_user)):
+    if not ensured(os_user, 'nodejs_ensured'):
         sudo('curl -sL https://deb.nodesource.com/setup_6.x | sudo -E bash -')
         sudo('apt-get install -y nodejs')
-        sudo('touch /home/{}/.ensure_dir/nodejs_ensured'.format(os_user))
+        set_ensured(os_user, 'nodejs_ensured')
 
 
 def install_os_pkg(requisites):
@@ -397,7 +401,7 @@ def get_available_os_pkgs():
 
 
 def install_caffe(os_user, region, caffe_version):
-    if not exists('/home/{}/.ensure_dir/caffe_ensured'.format(os_user)):
+    if not ensured(os_user, 'caffe_ensured'):
         env.shell = "/bin/bash -l -c -i"
         sudo('apt-get install -y python-dev')
         sudo('apt-get install -y python3-dev')
@@ -432,11 +436,11 @@ def install_caffe(os_user, region, caffe_version):
             sudo('make test -j$(nproc)')
             run('make runtest')
             sudo('make pycaffe')
-        sudo('touch /home/' + os_user + '/.ensure_dir/caffe_ensured')
+        set_ensured(os_user, 'caffe_ensured')
 
 
 def install_caffe2(os_user, caffe2_version, cmake_version):
-    if not exists('/home/{}/.ensure_dir/caffe2_ensured'.format(os_user)):
+    if not ensured(os_user, 'caffe2_ensured'):
         env.shell = "/bin/bash -l -c -i"
         sudo('apt-get update')
         sudo('apt-get install -y --no-install-recommends build-essential cmake git libgoogle-glog-dev libprotobuf-dev'
@@ -465,45 +469,45 @@ def install_caffe2(os_user, caffe2_version, cmake_version):
                 sudo('git checkout v{}'.format(caffe2_version))
                 sudo('git submodule update --recursive')
             sudo('mkdir build && cd build && cmake{} .. && make "-j$(nproc)" install'.format(cmake_version))
-        sudo('touch /home/' + os_user + '/.ensure_dir/caffe2_ensured')
+        set_ensured(os_user, 'caffe2_ensured')
 
 
 def install_cntk(os_user, cntk_version):
-    if not exists('/home/{}/.ensure_dir/cntk_ensured'.format(os_user)):
+    if not ensured(os_user, 'cntk_ensured'):
         sudo('pip2 install https://cntk.ai/PythonWheel/GPU/cntk-{}-cp27-cp27mu-linux_x86_64.whl --no-cache-dir'.format(cntk_version))
         sudo('pip3 install https://cntk.ai/PythonWheel/GPU/cntk-{}-cp35-cp35m-linux_x86_64.whl --no-cache-dir'.format(cntk_version))
-        sudo('touch /home/{}/.ensure_dir/cntk_ensured'.format(os_user))
+        set_ensured(os_user, 'cntk_ensured')
 
 
 def install_keras(os_user, keras_version):
-    if not exists('/home/{}/.ensure_dir/keras_ensured'.format(os_user)):
+    if not ensured(os_user, 'keras_ensured', {"keras_version": keras_version}):
         sudo('pip2 install keras=={} --no-cache-dir'.format(keras_version))
         sudo('pip3 install keras=={} --no-cache-dir'.format(keras_version))
-        sudo('touch /home/{}/.ensure_dir/keras_ensured'.format(os_user))
+        set_ensured(os_user, 'keras_ensured', {"keras_version": keras_version}, keras_version)
 
 
 def install_theano(os_user, theano_version):
-    if not exists('/home/{}/.ensure_dir/theano_ensured'.format(os_user)):
+    if not ensured(os_user, 'theano_ensured', {"theano_version": theano_version}):
         sudo('python2.7 -m pip install Theano=={} --no-cache-dir'.format(theano_version))
         sudo('python3 -m pip install Theano=={} --no-cache-dir'.format(theano_version))
-        sudo('touch /home/{}/.ensure_dir/theano_ensured'.format(os_user))
+        set_ensured(os_user, 'theano_ensured', {"theano_version": theano_version}, theano_version)
 
 
 def install_mxnet(os_user, mxnet_version):
-    if not exists('/home/{}/.ensure_dir/mxnet_ensured'.format(os_user)):
+    if not ensured(os_user, 'mxnet_ensured', {"mxnet_version": mxnet_version}):
         sudo('pip2 install mxnet-cu80=={} opencv-python --no-cache-dir'.format(mxnet_version))
         sudo('pip3 install mxnet-cu80=={} opencv-python --no-cache-dir'.format(mxnet_version))
-        sudo('touch /home/{}/.ensure_dir/mxnet_ensured'.format(os_user))
+        set_ensured(os_user, 'mxnet_ensured', {"mxnet_version": mxnet_version}, mxnet_version)
 
 
 def install_torch(os_user):
-    if not exists('/home/{}/.ensure_dir/torch_ensured'.format(os_user)):
+    if not ensured(os_user, 'torch_ensured'):
         run('git clone https://github.com/torch/distro.git ~/torch --recursive')
         with cd('/home/{}/torch/'.format(os_user)):
             run('bash install-deps;')
             run('./install.sh -b')
         run('source /home/{}/.bashrc'.format(os_user))
-        sudo('touch /home/{}/.ensure_dir/torch_ensured'.format(os_user))
+        set_ensured(os_user, 'torch_ensured')
 
 
 def install_gitlab_cert(os_user, certfile):
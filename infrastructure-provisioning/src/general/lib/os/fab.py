@@ -18,26 +18,58 @@
 
 from fabric.api import *
 from fabric.contrib.files import exists
+from fabric.network import disconnect_all
 import logging
+import imp
 import os
 import random
 import sys
 import string
 import json, uuid, time, datetime, csv
+import traceback
+import urllib2
+import base64
+import hashlib
+import tarfile
 from dlab.meta_lib import *
 from dlab.actions_lib import *
 import dlab.actions_lib
 import re
+from StringIO import StringIO
+from dlab.trace import span, traced, trace_process
+from dlab.state import ensured, set_ensured, unset_ensured
+
+trace_process()
+# Traced local(), put() and get(), exported to the scripts with from dlab.fab import *
+from fabric.api import local, put, get
+
+
+def run_fab_task(task, fabfile='/root/fabfile.py'):
+    # Runs a task of the fabfile in this process, as `cd /root; fab <task>` does in a new one. The provisioning
+    # worker has imported the libraries of the fabfile before forking, so a request neither starts fab nor
+    # imports them again. Steps the task runs with local() still start their own processes
+    fabfile_dir = os.path.dirname(fabfile)
+    cwd = os.getcwd()
+    os.chdir(fabfile_dir)
+    if fabfile_dir not in sys.path:
+        sys.path.insert(0, fabfile_dir)
+    try:
+        with span('fab ' + task):
+            tasks = imp.load_source('fabfile', fabfile)
+            execute(getattr(tasks, task))
+    finally:
+        disconnect_all()
+        os.chdir(cwd)
 
 
 def ensure_pip(requisites):
     try:
-        if not exists('/home/{}/.ensure_dir/pip_path_added'.format(os.environ['conf_os_user'])):
+        if not ensured(os.environ['conf_os_user'], 'pip_path_added'):
             sudo('echo PATH=$PATH:/usr/local/bin/:/opt/spark/bin/ >> /etc/profile')
             sudo('echo export PATH >> /etc/profile')
             sudo('pip install -UI pip=={} --no-cache-dir'.format(os.environ['conf_pip_version']))
             sudo('pip install -U {} --no-cache-dir'.format(requisites))
-            sudo('touch /home/{}/.ensure_dir/pip_path_added'.format(os.environ['conf_os_user']))
+            set_ensured(os.environ['conf_os_user'], 'pip_path_added')
         return True
     except:
         return False
@@ -132,53 +164,178 @@ def append_result(error, exception=''):
     print(data)
 
 
-def put_resource_status(resource, status, dlab_path, os_user, hostname):
+resource_status_queue = list()
+
+
+def put_resource_status(resource, status, dlab_path, os_user, hostname, flush=True):
+    # Updates are queued with the time they were made, which orders them on SSN side against updates sent
+    # by other provisioning containers and against retries. Scripts which change several statuses pass
+    # flush=False and send them together, in one SSH session, with flush_resource_statuses
+    resource_status_queue.append([resource, status, time.time()])
+    if flush:
+        flush_resource_statuses(dlab_path, os_user, hostname)
+
+
+def flush_resource_statuses(dlab_path, os_user, hostname, attempts=3):
+    if not resource_status_queue:
+        return
     env['connection_attempts'] = 100
     keyfile = os.environ['conf_key_dir'] + os.environ['conf_key_name'] + ".pem"
     env.key_filename = [keyfile]
     env.host_string = os_user + '@' + hostname
-    sudo('python ' + dlab_path + 'tmp/resource_status.py --resource {} --status {}'.format(resource, status))
+    updates = base64.b64encode(json.dumps(resource_status_queue))
+    for attempt in range(attempts):
+        with settings(warn_only=True):
+            result = sudo('python {0}tmp/resource_status.py --updates {1}'.format(dlab_path, updates))
+        if result.succeeded:
+            del resource_status_queue[:]
+            return
+        time.sleep(2 ** attempt)
+    raise Exception('Unable to update statuses of {}'.format(', '.join([i[0] for i in resource_status_queue])))
+
+
+class RemoteBatch:
+    # Collects remote commands into one shell script, which is uploaded and run with a single sudo() call
+    # instead of an SSH exec per command. Steps run in order as root, or as user for run(), each in its own
+    # subshell like separate sudo() calls would, and the script stops at the first failing step.
+    # A marker is touched only after every step has succeeded, as with the .ensure_dir markers.
+    step_marker = '##DLAB_STEP'
+
+    def __init__(self, name, marker='', user=''):
+        self.name = name
+        self.marker = marker
+        # The user of run() and of uploaded files. env.user is the local user unless a script sets it,
+        # so it is taken from the user@host of the connection when not given
+        if not user and '@' in (env.host_string or ''):
+            user = env.host_string.split('@')[0]
+        self.user = user or env.user
+        self.steps = list()
+        self.results = list()
+        self.callbacks = list()
+
+    def on_success(self, callback):
+        self.callbacks.append(callback)
+
+    def sudo(self, command, warn_only=False):
+        self.steps.append({"command": command, "script": '( {} )'.format(command), "warn_only": warn_only})
+
+    def run(self, command, warn_only=False):
+        self.steps.append({"command": command, "script": 'sudo -H -u {0} bash -l -c {1}'.format(
+            self.user, shell_quote(command)), "warn_only": warn_only})
+
+    def put(self, local_path, remote_path):
+        # File content is embedded into the script, so templates do not need their own transfers
+        with open(local_path, 'rb') as f:
+            content = base64.b64encode(f.read())
+        self.steps.append({"command": 'put {0} {1}'.format(local_path, remote_path), "warn_only": False,
+                           "script": "base64 -d > {0} <<'DLAB_EOF' && chown {1}: {0}\n{2}\nDLAB_EOF".format(
+                               remote_path, self.user, content)})
+
+    def get_script(self):
+        steps = list(self.steps)
+        if self.marker:
+            steps.append({"command": 'touch ' + self.marker, "script": 'touch ' + self.marker, "warn_only": False})
+        script = ['#!/bin/bash', 'trap \'rm -f "$0"\' EXIT']
+        for index, step in enumerate(steps):
+            script.append('echo "{0} {1} START"'.format(self.step_marker, index))
+            script.append(step['script'])
+            script.append('rc=$?; printf "\\n{0} {1} EXIT %s\\n" $rc'.format(self.step_marker, index))
+            if not step['warn_only']:
+                script.append('if [ $rc -ne 0 ]; then exit $rc; fi')
+        return steps, '\n'.join(script) + '\n'
+
+    def parse_results(self, steps, output):
+        results = list()
+        current = None
+        for line in output.splitlines():
+            match = re.match(r'^{} (\d+) (START|EXIT)(?: (\d+))?\s*$'.format(self.step_marker), line.strip())
+            if not match:
+                if current is not None:
+                    current['output'].append(line)
+                continue
+            if match.group(2) == 'START':
+                current = {"command": steps[int(match.group(1))]['command'], "output": []}
+            elif current is not None:
+                current['return_code'] = int(match.group(3))
+                current['output'] = '\n'.join(current['output']).strip()
+                results.append(current)
+                current = None
+        return results
+
+    def execute(self):
+        # Returns [{"command", "return_code", "output"}] of the executed steps, raises on the first failed one
+        steps, script = self.get_script()
+        remote_script = '/tmp/dlab_batch_{}.sh'.format(uuid.uuid4())
+        with span('batch ' + self.name, steps=len(steps)):
+            put(StringIO(script), remote_script)
+            with settings(warn_only=True):
+                output = sudo('bash -l {}'.format(remote_script))
+        self.results = self.parse_results(steps, output)
+        print("[{0}] {1} of {2} remote commands run in one batch".format(self.name, len(self.results),
+                                                                           len(steps)))
+        error = ''
+        for index, result in enumerate(self.results):
+            if result['return_code'] and not steps[index]['warn_only']:
+                error = '[{0}] "{1}" failed with exit code {2}: {3}'.format(
+                    self.name, result['command'], result['return_code'], result['output'][-1000:])
+                break
+        if output.failed and not error:
+            error = '[{0}] batch failed with exit code {1}'.format(self.name, output.return_code)
+        if error:
+            print(error)
+            raise Exception(error)
+        for callback in self.callbacks:
+            callback()
+        self.steps = list()
+        self.callbacks = list()
+        return self.results
+
+
+def shell_quote(command):
+    return "'" + command.replace("'", "'\\''") + "'"
 
 
 def configure_jupyter(os_user, jupyter_conf_file, templates_dir, jupyter_version, exploratory_name):
-    if not exists('/home/' + os_user + '/.ensure_dir/jupyter_ensured'):
+    if not ensured(os_user, 'jupyter_ensured', {"jupyter_version": jupyter_version}):
         try:
-            sudo('pip2 install notebook=={} --no-cache-dir'.format(jupyter_version))
-            sudo('pip2 install jupyter --no-cache-dir')
-            sudo('pip3.5 install notebook=={} --no-cache-dir'.format(jupyter_version))
-            sudo('pip3.5 install jupyter --no-cache-dir')
-            sudo('rm -rf ' + jupyter_conf_file)
-            run('jupyter notebook --generate-config --config ' + jupyter_conf_file)
-            with cd('/home/{}'.format(os_user)):
-                run('mkdir -p ~/.jupyter/custom/')
-                run('echo "#notebook-container { width: auto; }" > ~/.jupyter/custom/custom.css')
-            sudo('echo "c.NotebookApp.ip = \'*\'" >> ' + jupyter_conf_file)
-            sudo('echo "c.NotebookApp.base_url = \'/{0}/\'" >> {1}'.format(exploratory_name, jupyter_conf_file))
-            sudo('echo c.NotebookApp.open_browser = False >> ' + jupyter_conf_file)
-            sudo('echo \'c.NotebookApp.cookie_secret = b"' + id_generator() + '"\' >> ' + jupyter_conf_file)
-            sudo('''echo "c.NotebookApp.token = u''" >> ''' + jupyter_conf_file)
-            sudo('echo \'c.KernelSpecManager.ensure_native_kernel = False\' >> ' + jupyter_conf_file)
-            put(templates_dir + 'jupyter-notebook.service', '/tmp/jupyter-notebook.service')
-            sudo("chmod 644 /tmp/jupyter-notebook.service")
+            batch = RemoteBatch('configure_jupyter', user=os_user)
+            batch.sudo('pip2 install notebook=={} --no-cache-dir'.format(jupyter_version))
+            batch.sudo('pip2 install jupyter --no-cache-dir')
+            batch.sudo('pip3.5 install notebook=={} --no-cache-dir'.format(jupyter_version))
+            batch.sudo('pip3.5 install jupyter --no-cache-dir')
+            batch.sudo('rm -rf ' + jupyter_conf_file)
+            batch.run('jupyter notebook --generate-config --config ' + jupyter_conf_file)
+            batch.run('cd /home/{} && mkdir -p ~/.jupyter/custom/'.format(os_user))
+            batch.run('cd /home/{} && echo "#notebook-container {{ width: auto; }}" > ~/.jupyter/custom/custom.css'.format(
+                os_user))
+            batch.sudo('echo "c.NotebookApp.ip = \'*\'" >> ' + jupyter_conf_file)
+            batch.sudo('echo "c.NotebookApp.base_url = \'/{0}/\'" >> {1}'.format(exploratory_name, jupyter_conf_file))
+            batch.sudo('echo c.NotebookApp.open_browser = False >> ' + jupyter_conf_file)
+            batch.sudo('echo \'c.NotebookApp.cookie_secret = b"' + id_generator() + '"\' >> ' + jupyter_conf_file)
+            batch.sudo('''echo "c.NotebookApp.token = u''" >> ''' + jupyter_conf_file)
+            batch.sudo('echo \'c.KernelSpecManager.ensure_native_kernel = False\' >> ' + jupyter_conf_file)
+            batch.put(templates_dir + 'jupyter-notebook.service', '/tmp/jupyter-notebook.service')
+            batch.sudo("chmod 644 /tmp/jupyter-notebook.service")
             if os.environ['application'] == 'tensor':
-                sudo("sed -i '/ExecStart/s|-c \"|-c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64; |g' /tmp/jupyter-notebook.service")
+                batch.sudo("sed -i '/ExecStart/s|-c \"|-c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64; |g' /tmp/jupyter-notebook.service")
             elif os.environ['application'] == 'deeplearning':
-                sudo("sed -i '/ExecStart/s|-c \"|-c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:"
-                     "/usr/local/cuda/lib64:/usr/lib64/openmpi/lib: ; export PYTHONPATH=/home/" + os_user +
-                     "/caffe/python:/home/" + os_user + "/pytorch/build:$PYTHONPATH ; |g' /tmp/jupyter-notebook.service")
-            sudo("sed -i 's|CONF_PATH|{}|' /tmp/jupyter-notebook.service".format(jupyter_conf_file))
-            sudo("sed -i 's|OS_USR|{}|' /tmp/jupyter-notebook.service".format(os_user))
-            sudo('\cp /tmp/jupyter-notebook.service /etc/systemd/system/jupyter-notebook.service')
-            sudo('chown -R {0}:{0} /home/{0}/.local'.format(os_user))
-            sudo('mkdir -p /mnt/var')
-            sudo('chown {0}:{0} /mnt/var'.format(os_user))
+                batch.sudo("sed -i '/ExecStart/s|-c \"|-c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:"
+                           "/usr/local/cuda/lib64:/usr/lib64/openmpi/lib: ; export PYTHONPATH=/home/" + os_user +
+                           "/caffe/python:/home/" + os_user + "/pytorch/build:$PYTHONPATH ; |g' /tmp/jupyter-notebook.service")
+            batch.sudo("sed -i 's|CONF_PATH|{}|' /tmp/jupyter-notebook.service".format(jupyter_conf_file))
+            batch.sudo("sed -i 's|OS_USR|{}|' /tmp/jupyter-notebook.service".format(os_user))
+            batch.sudo('\cp /tmp/jupyter-notebook.service /etc/systemd/system/jupyter-notebook.service')
+            batch.sudo('chown -R {0}:{0} /home/{0}/.local'.format(os_user))
+            batch.sudo('mkdir -p /mnt/var')
+            batch.sudo('chown {0}:{0} /mnt/var'.format(os_user))
             if os.environ['application'] == 'jupyter':
-                sudo('jupyter-kernelspec remove -f python2 || echo "Such kernel doesnt exists"')
-                sudo('jupyter-kernelspec remove -f python3 || echo "Such kernel doesnt exists"')
-            sudo("systemctl daemon-reload")
-            sudo("systemctl enable jupyter-notebook")
-            sudo("systemctl start jupyter-notebook")
-            sudo('touch /home/{}/.ensure_dir/jupyter_ensured'.format(os_user))
+                batch.sudo('jupyter-kernelspec remove -f python2 || echo "Such kernel doesnt exists"')
+                batch.sudo('jupyter-kernelspec remove -f python3 || echo "Such kernel doesnt exists"')
+            batch.sudo("systemctl daemon-reload")
+            batch.sudo("systemctl enable jupyter-notebook")
+            batch.sudo("systemctl start jupyter-notebook")
+            set_ensured(os_user, 'jupyter_ensured', {"jupyter_version": jupyter_version}, jupyter_version, batch)
+            batch.execute()
         except:
             sys.exit(1)
     else:
@@ -192,7 +349,7 @@ def configure_jupyter(os_user, jupyter_conf_file, templates_dir, jupyter_version
 
 
 def ensure_pyspark_local_kernel(os_user, pyspark_local_path_dir, templates_dir, spark_version):
-    if not exists('/home/' + os_user + '/.ensure_dir/pyspark_local_kernel_ensured'):
+    if not ensured(os_user, 'pyspark_local_kernel_ensured'):
         try:
             sudo('mkdir -p ' + pyspark_local_path_dir)
             sudo('touch ' + pyspark_local_path_dir + 'kernel.json')
@@ -202,13 +359,13 @@ def ensure_pyspark_local_kernel(os_user, pyspark_local_path_dir, templates_dir,
             sudo('sed -i "s|SP_VER|' + spark_version + '|g" /tmp/pyspark_local_template.json')
             sudo('sed -i \'/PYTHONPATH\"\:/s|\(.*\)"|\\1/home/{0}/caffe/python:/home/{0}/pytorch/build:"|\' /tmp/pyspark_local_template.json'.format(os_user))
             sudo('\cp /tmp/pyspark_local_template.json ' + pyspark_local_path_dir + 'kernel.json')
-            sudo('touch /home/' + os_user + '/.ensure_dir/pyspark_local_kernel_ensured')
+            set_ensured(os_user, 'pyspark_local_kernel_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_py3spark_local_kernel(os_user, py3spark_local_path_dir, templates_dir, spark_version):
-    if not exists('/home/' + os_user + '/.ensure_dir/py3spark_local_kernel_ensured'):
+    if not ensured(os_user, 'py3spark_local_kernel_ensured'):
         try:
             sudo('mkdir -p ' + py3spark_local_path_dir)
             sudo('touch ' + py3spark_local_path_dir + 'kernel.json')
@@ -218,7 +375,7 @@ def ensure_py3spark_local_kernel(os_user, py3spark_local_path_dir, templates_dir
             sudo('sed -i "s|SP_VER|' + spark_version + '|g" /tmp/py3spark_local_template.json')
             sudo('sed -i \'/PYTHONPATH\"\:/s|\(.*\)"|\\1/home/{0}/caffe/python:/home/{0}/pytorch/build:"|\' /tmp/py3spark_local_template.json'.format(os_user))
             sudo('\cp /tmp/py3spark_local_template.json ' + py3spark_local_path_dir + 'kernel.json')
-            sudo('touch /home/' + os_user + '/.ensure_dir/py3spark_local_kernel_ensured')
+            set_ensured(os_user, 'py3spark_local_kernel_ensured')
         except:
             sys.exit(1)
 
@@ -343,7 +500,7 @@ def get_available_r_pkgs():
 
 
 def ensure_toree_local_kernel(os_user, toree_link, scala_kernel_path, files_dir, scala_version, spark_version):
-    if not exists('/home/' + os_user + '/.ensure_dir/toree_local_kernel_ensured'):
+    if not ensured(os_user, 'toree_local_kernel_ensured'):
         try:
             sudo('pip install ' + toree_link + ' --no-cache-dir')
             sudo('ln -s /opt/spark/ /usr/local/spark')
@@ -354,13 +511,13 @@ def ensure_toree_local_kernel(os_user, toree_link, scala_kernel_path, files_dir,
             sudo(
                 'sed -i "s|Apache Toree - Scala|Local Apache Toree - Scala (Scala-' + scala_version +
                 ', Spark-' + spark_version + ')|g" ' + scala_kernel_path + 'kernel.json')
-            sudo('touch /home/' + os_user + '/.ensure_dir/toree_local_kernel_ensured')
+            set_ensured(os_user, 'toree_local_kernel_ensured')
         except:
             sys.exit(1)
 
 
 def install_ungit(os_user, notebook_name):
-    if not exists('/home/{}/.ensure_dir/ungit_ensured'.format(os_user)):
+    if not ensured(os_user, 'ungit_ensured'):
         try:
             sudo('npm -g install ungit@{}'.format(os.environ['notebook_ungit_version']))
             put('/root/templates/ungit.service', '/tmp/ungit.service')
@@ -384,7 +541,7 @@ def install_ungit(os_user, notebook_name):
             sudo('systemctl daemon-reload')
             sudo('systemctl enable ungit.service')
             sudo('systemctl start ungit.service')
-            sudo('touch /home/{}/.ensure_dir/ungit_ensured'.format(os_user))
+            set_ensured(os_user, 'ungit_ensured')
         except:
             sys.exit(1)
     else:
@@ -402,6 +559,51 @@ def install_ungit(os_user, notebook_name):
     run('git config --global https.proxy $https_proxy')
 
 
+def set_pip_index(pip_conf, index_url, trusted_host):
+    # Sets index-url and trusted-host of [global] and keeps the other settings, like the timeout of the
+    # conf_pypi_mirror configuration. An index set before stays as an extra index, which pip falls back to
+    # for packages the new one cannot serve
+    options = {'index-url': [], 'extra-index-url': [], 'trusted-host': []}
+    lines = list()
+    section = ''
+    for line in pip_conf.splitlines():
+        match = re.match(r'\s*\[(.+)\]\s*$', line)
+        if match:
+            section = match.group(1).strip()
+        else:
+            match = re.match(r'\s*([\w-]+)\s*[=:]\s*(.*)$', line)
+            if section == 'global' and match and match.group(1) in options:
+                options[match.group(1)].extend(match.group(2).split())
+                continue
+        lines.append(line)
+    extra_index_urls = list()
+    for url in options['index-url'] + options['extra-index-url']:
+        if url != index_url and url not in extra_index_urls:
+            extra_index_urls.append(url)
+    trusted_hosts = [trusted_host] + [host for host in options['trusted-host'] if host != trusted_host]
+    global_options = ['index-url = {}'.format(index_url), 'trusted-host = {}'.format(' '.join(trusted_hosts))]
+    if extra_index_urls:
+        global_options.append('extra-index-url = {}'.format(' '.join(extra_index_urls)))
+    sections = [line.strip() for line in lines]
+    if '[global]' not in sections:
+        return '\n'.join(['[global]'] + global_options + lines) + '\n'
+    index = sections.index('[global]') + 1
+    return '\n'.join(lines[:index] + global_options + lines[index:]) + '\n'
+
+
+def enable_package_mirror(mirror_host, mirror_port):
+    # pip uses the PyPI mirror of the edge package cache profile when the edge runs one
+    mirror = 'http://{}:{}'.format(mirror_host, mirror_port)
+    with settings(warn_only=True):
+        status = sudo('curl --noproxy "*" -s -o /dev/null -w "%{{http_code}}" {}/+api'.format(mirror))
+        pip_conf = sudo('cat /etc/pip.conf') if exists('/etc/pip.conf') else ''
+    if status != '200':
+        return False
+    put(StringIO(set_pip_index(pip_conf, '{}/root/pypi/+simple/'.format(mirror), mirror_host)), '/tmp/pip.conf')
+    sudo('mv /tmp/pip.conf /etc/pip.conf && chown root:root /etc/pip.conf && chmod 644 /etc/pip.conf')
+    return True
+
+
 def set_git_proxy(os_user, hostname, keyfile, proxy_host):
     env['connection_attempts'] = 100
     env.key_filename = [keyfile]
@@ -416,17 +618,17 @@ def set_mongo_parameters(client, mongo_parameters):
 
 
 def install_r_packages(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/r_packages_ensured'):
+    if not ensured(os_user, 'r_packages_ensured'):
         sudo('R -e "install.packages(\'devtools\', repos = \'http://cran.us.r-project.org\')"')
         sudo('R -e "install.packages(\'knitr\', repos = \'http://cran.us.r-project.org\')"')
         sudo('R -e "install.packages(\'ggplot2\', repos = \'http://cran.us.r-project.org\')"')
         sudo('R -e "install.packages(c(\'devtools\',\'mplot\', \'googleVis\'), '
              'repos = \'http://cran.us.r-project.org\'); require(devtools); install_github(\'ramnathv/rCharts\')"')
-        sudo('touch /home/' + os_user + '/.ensure_dir/r_packages_ensured')
+        set_ensured(os_user, 'r_packages_ensured')
 
 
 def add_breeze_library_local(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/breeze_local_ensured'):
+    if not ensured(os_user, 'breeze_local_ensured'):
         try:
             breeze_tmp_dir = '/tmp/breeze_tmp_local/'
             jars_dir = '/opt/jars/'
@@ -448,7 +650,7 @@ def add_breeze_library_local(os_user):
             sudo('wget --no-check-certificate https://brunelvis.org/jar/spark-kernel-brunel-all-{0}.jar -O \
                     {1}spark-kernel-brunel-all-{0}.jar'.format('2.3', breeze_tmp_dir))
             sudo('mv {0}* {1}'.format(breeze_tmp_dir, jars_dir))
-            sudo('touch /home/' + os_user + '/.ensure_dir/breeze_local_ensured')
+            set_ensured(os_user, 'breeze_local_ensured')
         except:
             sys.exit(1)
 
@@ -469,9 +671,11 @@ def configure_data_engine_service_pip(hostname, os_user, keyfile):
 
 
 def remove_rstudio_dataengines_kernel(cluster_name, os_user):
+    # Local copies are unique per call, kernels of several notebooks are removed in parallel
+    local_prefix = '/tmp/{}_'.format(uuid.uuid4())
     try:
-        get('/home/{}/.Rprofile'.format(os_user), 'Rprofile')
-        data = open('Rprofile').read()
+        get('/home/{}/.Rprofile'.format(os_user), local_prefix + 'Rprofile')
+        data = open(local_prefix + 'Rprofile').read()
         conf = [i for i in data.split('\n') if i != '']
         conf = [i for i in conf if cluster_name not in i]
         comment_all = lambda x: x if x.startswith('#master') else '#{}'.format(x)
@@ -482,12 +686,12 @@ def remove_rstudio_dataengines_kernel(cluster_name, os_user):
         active_cluster = conf[last_spark].split('"')[-2] if last_spark != 0 else None
         conf = conf[:last_spark] + [conf[l][1:] for l in range(last_spark, len(conf)) if conf[l].startswith("#")] \
                                  + [conf[l] for l in range(last_spark, len(conf)) if not conf[l].startswith('#')]
-        with open('.Rprofile', 'w') as f:
+        with open(local_prefix + '.Rprofile', 'w') as f:
             for line in conf:
                 f.write('{}\n'.format(line))
-        put('.Rprofile', '/home/{}/.Rprofile'.format(os_user))
-        get('/home/{}/.Renviron'.format(os_user), 'Renviron')
-        data = open('Renviron').read()
+        put(local_prefix + '.Rprofile', '/home/{}/.Rprofile'.format(os_user))
+        get('/home/{}/.Renviron'.format(os_user), local_prefix + 'Renviron')
+        data = open(local_prefix + 'Renviron').read()
         conf = [i for i in data.split('\n') if i != '']
         comment_all = lambda x: x if x.startswith('#') else '#{}'.format(x)
         conf = [comment_all(i) for i in conf]
@@ -498,16 +702,105 @@ def remove_rstudio_dataengines_kernel(cluster_name, os_user):
         else:
             last_spark = max([conf.index(i) for i in conf if 'SPARK_HOME' in i])
             conf = conf[:last_spark] + [conf[l][1:] for l in range(last_spark, len(conf)) if conf[l].startswith("#")]
-        with open('.Renviron', 'w') as f:
+        with open(local_prefix + '.Renviron', 'w') as f:
             for line in conf:
                 f.write('{}\n'.format(line))
-        put('.Renviron', '/home/{}/.Renviron'.format(os_user))
+        put(local_prefix + '.Renviron', '/home/{}/.Renviron'.format(os_user))
         if len(conf) == 1:
-           sudo('rm -f /home/{}/.ensure_dir/rstudio_dataengine_ensured'.format(os_user))
-           sudo('rm -f /home/{}/.ensure_dir/rstudio_dataengine-service_ensured'.format(os_user))
+           unset_ensured(os_user, 'rstudio_dataengine_ensured')
+           unset_ensured(os_user, 'rstudio_dataengine-service_ensured')
         sudo('''R -e "source('/home/{}/.Rprofile')"'''.format(os_user))
     except:
         sys.exit(1)
+    finally:
+        local('rm -f {0}Rprofile {0}.Rprofile {0}Renviron {0}.Renviron'.format(local_prefix))
+
+
+def wait_for_zeppelin(hostname, timeout=300):
+    # Zeppelin answers its REST API once the server and interpreter settings are loaded,
+    # polled with exponential backoff instead of a fixed sleep between port scans
+    opener = urllib2.build_opener(urllib2.ProxyHandler({}))
+    delay = 1
+    deadline = time.time() + timeout
+    while True:
+        try:
+            opener.open('http://{}:8080/api/interpreter/setting'.format(hostname), timeout=10).read()
+            return
+        except Exception as err:
+            if time.time() + delay > deadline:
+                raise Exception('Zeppelin on {} is not ready after {} seconds: {}'.format(hostname, timeout, str(err)))
+            time.sleep(delay)
+            delay = min(delay * 2, 16)
+
+
+def remove_zeppelin_interpreters(hostname, interpreter_prefix):
+    zeppelin_url = 'http://' + hostname + ':8080/api/interpreter/setting/'
+    opener = urllib2.build_opener(urllib2.ProxyHandler({}))
+    interpreter_json = json.loads(opener.open(urllib2.Request(zeppelin_url)).read())
+    for interpreter in interpreter_json['body']:
+        if interpreter_prefix in interpreter['name']:
+            print("Interpreter with ID: {0} and name: {1} will be removed from zeppelin!".format(
+                interpreter['id'], interpreter['name']))
+            request = urllib2.Request(zeppelin_url + interpreter['id'], data='')
+            request.get_method = lambda: 'DELETE'
+            print(opener.open(request).read())
+
+
+def remove_notebook_cluster_kernels(os_user, cluster_name, cluster_dir, cluster_type):
+    # Runs for env.host_string, cluster_type is dataengine or dataengine-service
+    hostname = env.host_string.split('@')[-1]
+    sudo('rm -rf /home/{}/.local/share/jupyter/kernels/*_{}'.format(os_user, cluster_name))
+    if exists('/home/{0}/.ensure_dir/{1}_{2}_interpreter_ensured'.format(os_user, cluster_type, cluster_name)):
+        if os.environ['notebook_multiple_clusters'] == 'true':
+            with settings(warn_only=True):
+                result = sudo("livy_port=$(cat {0}livy/conf/livy.conf | grep livy.server.port | tail -n 1 | "
+                              "awk '{{printf $3}}') && [ -n \"$livy_port\" ] && "
+                              "kill -9 $(netstat -natp 2>/dev/null | grep \":$livy_port\" | awk '{{print $7}}' | "
+                              "sed 's|/.*||g') && systemctl disable livy-server-$livy_port".format(cluster_dir))
+            if result.failed:
+                print("Wasn't able to find Livy server for this cluster!")
+        # Zeppelin reads SPARK_HOME only on start, it is restarted only if SPARK_HOME was the removed cluster
+        spark_home_changed = sudo('if grep -q "^export SPARK_HOME={0}spark" /opt/zeppelin/conf/zeppelin-env.sh; '
+                                  'then sed -i \"s/^export SPARK_HOME.*/export SPARK_HOME=\/opt\/spark/\" '
+                                  '/opt/zeppelin/conf/zeppelin-env.sh; echo changed; fi; '
+                                  'rm -rf /home/{1}/.ensure_dir/{2}_interpreter_ensure'.format(
+                                      cluster_dir, os_user, cluster_type)).strip() == 'changed'
+        # Interpreter settings removed through the REST API are unloaded by the running server
+        remove_zeppelin_interpreters(hostname, cluster_name)
+        if spark_home_changed:
+            sudo('chown {0}:{0} -R /opt/zeppelin/ && systemctl daemon-reload && '
+                 'service zeppelin-notebook stop && service zeppelin-notebook start'.format(os_user))
+            wait_for_zeppelin(hostname)
+        sudo('rm -rf /home/{0}/.ensure_dir/{1}_{2}_interpreter_ensured'.format(os_user, cluster_type, cluster_name))
+    if ensured(os_user, 'rstudio_{}_ensured'.format(cluster_type)):
+        remove_rstudio_dataengines_kernel(cluster_name, os_user)
+    sudo('rm -rf  {}'.format(cluster_dir))
+    print("Notebook's {} kernels were removed".format(hostname))
+
+
+def remove_cluster_kernels(hostnames, os_user, key_path, cluster_name, cluster_dir, cluster_type):
+    # Every notebook is cleaned by its own worker process, as fabric runs parallel tasks
+    def worker():
+        try:
+            remove_notebook_cluster_kernels(os_user, cluster_name, cluster_dir, cluster_type)
+            return ''
+        except BaseException as err:
+            traceback.print_exc(file=sys.stdout)
+            return str(err) or type(err).__name__
+
+    if not hostnames:
+        print("There are no notebooks to clean kernels.")
+        return
+    env.user = os_user
+    env.key_filename = key_path
+    start = time.time()
+    with settings(parallel=True, pool_size=min(len(hostnames), 10)):
+        results = execute(worker, hosts=['{}@{}'.format(os_user, hostname) for hostname in hostnames])
+    print("Kernels of {0} were removed from {1} notebooks in {2:.1f}s".format(
+        cluster_name, len(hostnames), time.time() - start))
+    failed = ['{}: {}'.format(host, error) for host, error in results.items() if error]
+    if failed:
+        raise Exception('Unable to remove kernels on notebooks: ' + '; '.join(failed))
 
 
 def restart_zeppelin(creds=False, os_user='', hostname='', keyfile=''):
@@ -538,6 +831,11 @@ def get_spark_memory(creds=False, os_user='', hostname='', keyfile=''):
         return err
 
 
+def spark_ui_reverse_proxy_supported(spark_version):
+    # spark.ui.reverseProxy is available since Spark 2.1.0
+    return tuple(int(i) for i in spark_version.split('.')[:2]) >= (2, 1)
+
+
 def replace_multi_symbols(string, symbol, symbol_cut=False):
     try:
         symbol_amount = 0
@@ -559,12 +857,12 @@ def replace_multi_symbols(string, symbol, symbol_cut=False):
 
 
 def update_pyopenssl_lib(os_user):
-    if not exists('/home/{}/.ensure_dir/pyopenssl_updated'.format(os_user)):
+    if not ensured(os_user, 'pyopenssl_updated'):
         try:
             if exists('/usr/bin/pip3'):
                 sudo('pip3 install -U pyopenssl')
             sudo('pip2 install -U pyopenssl')
-            sudo('touch /home/{}/.ensure_dir/pyopenssl_updated'.format(os_user))
+            set_ensured(os_user, 'pyopenssl_updated')
         except:
             sys.exit(1)
 
@@ -628,3 +926,156 @@ def update_zeppelin_interpreters(multiple_clusters, r_enabled, interpreter_mode=
     except Exception as err:
         print('Failed to update Zeppelin interpreters', str(err))
         sys.exit(1)
+
+
+def get_rules_diff(desired_rules, current_rules, rule_key=None):
+    # Cloud-neutral diff of firewall/security group rules. rule_key maps a rule to a hashable
+    # canonical form, so rules that differ only in field order or defaults compare equal.
+    if rule_key is None:
+        rule_key = lambda rule: json.dumps(rule, sort_keys=True)
+    desired_keys = set(rule_key(rule) for rule in desired_rules)
+    current_keys = set(rule_key(rule) for rule in current_rules)
+    to_add = list()
+    for rule in desired_rules:
+        key = rule_key(rule)
+        if key not in current_keys:
+            to_add.append(rule)
+            current_keys.add(key)
+    to_remove = list()
+    for rule in current_rules:
+        key = rule_key(rule)
+        if key not in desired_keys:
+            to_remove.append(rule)
+            desired_keys.add(key)
+    return to_add, to_remove
+
+
+def get_files_manifest(directory):
+    # Symlinks, to files and to directories, are recorded with their targets instead of a checksum
+    manifest = dict()
+    for root, dirs, files in os.walk(directory):
+        for filename in files + dirs:
+            path = os.path.join(root, filename)
+            if os.path.islink(path):
+                manifest[os.path.relpath(path, directory)] = 'link:' + os.readlink(path)
+            elif os.path.isfile(path):
+                sha1 = hashlib.sha1()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b''):
+                        sha1.update(chunk)
+                manifest[os.path.relpath(path, directory)] = sha1.hexdigest()
+    return manifest
+
+
+def get_remote_files_manifest(directory, keyfile, host_string):
+    manifest = dict()
+    output = local("ssh -i {0} {1} 'cd {2} 2>/dev/null && find . -type f -print0 | xargs -0 -r sha1sum && "
+                   "find . -type l -printf \"link:%l\\t%p\\n\"'".format(keyfile, host_string, directory), capture=True)
+    for line in output.splitlines():
+        if line.startswith('link:'):
+            target, path = line.split('\t', 1)
+            manifest[os.path.normpath(path)] = target
+        elif line.strip():
+            checksum, path = line.split(None, 1)
+            manifest[os.path.normpath(path)] = checksum
+    return manifest
+
+
+def sync_files(local_dir, remote_dir, keyfile, host_string, direction='push', delete=False):
+    # Compares content hashes of both trees and transfers only the changed files in one compressed
+    # tar stream, from local_dir to remote_dir (push) or back (pull). Returns (transferred, full copy) bytes.
+    local_dir = local_dir.rstrip('/') + '/'
+    remote_dir = remote_dir.rstrip('/') + '/'
+    local('mkdir -p {}'.format(local_dir))
+    local("ssh -i {0} {1} 'mkdir -p {2}'".format(keyfile, host_string, remote_dir))
+    local_manifest = get_files_manifest(local_dir)
+    remote_manifest = get_remote_files_manifest(remote_dir, keyfile, host_string)
+    if direction == 'push':
+        source_manifest, target_manifest = local_manifest, remote_manifest
+    else:
+        source_manifest, target_manifest = remote_manifest, local_manifest
+    changed = sorted(path for path in source_manifest if target_manifest.get(path) != source_manifest[path])
+    removed = sorted(path for path in target_manifest if path not in source_manifest)
+    archive = '/tmp/sync_{}.tar.gz'.format(uuid.uuid4())
+    list_file = archive + '.list'
+    transferred = 0
+    try:
+        if changed:
+            with open(list_file, 'w') as f:
+                f.write('\n'.join(changed) + '\n')
+            if direction == 'push':
+                with tarfile.open(archive, 'w:gz') as tar:
+                    for path in changed:
+                        tar.add(os.path.join(local_dir, path), arcname=path)
+                local("ssh -i {0} {1} 'tar -xzf - -C {2}' < {3}".format(keyfile, host_string, remote_dir, archive))
+            else:
+                local("ssh -i {0} {1} 'tar -czf - -C {2} -T -' < {3} > {4}".format(
+                    keyfile, host_string, remote_dir, list_file, archive))
+                local('tar -xzf {0} -C {1}'.format(archive, local_dir))
+            transferred = os.path.getsize(archive)
+        if delete and removed:
+            with open(list_file, 'w') as f:
+                f.write('\n'.join(removed) + '\n')
+            if direction == 'push':
+                local("ssh -i {0} {1} 'cd {2} && xargs -d \"\\n\" rm -f' < {3}".format(
+                    keyfile, host_string, remote_dir, list_file))
+            else:
+                for path in removed:
+                    os.remove(os.path.join(local_dir, path))
+    finally:
+        local('rm -f {0} {1}'.format(archive, list_file))
+    full_copy = sum(os.path.getsize(os.path.join(local_dir, path)) for path in source_manifest
+                    if not source_manifest[path].startswith('link:'))
+    print("Synced {0} -> {1}: {2} of {3} files changed, {4} removed, {5} bytes transferred instead of {6}".format(
+        local_dir if direction == 'push' else remote_dir, remote_dir if direction == 'push' else local_dir,
+        len(changed), len(source_manifest), len(removed) if delete else 0, transferred, full_copy))
+    return transferred, full_copy
+
+
+def get_notebook_image_inputs(application):
+    # Everything configure_<template>_node.py installs from: versions of the [notebook] section, the base OS
+    # image, and the libraries, scripts, templates and files of the template container
+    inputs = {"application": application,
+              "os_family": os.environ['conf_os_family'],
+              "base_image": os.environ.get('{}_{}_image_name'.format(os.environ['conf_cloud_provider'],
+                                                                     os.environ['conf_os_family']), '')}
+    for key in os.environ:
+        if key.startswith('notebook_') and (key.endswith('_version') or key.endswith('_file_name') or
+                                            key in ['notebook_r_mirror', 'notebook_r_enabled']):
+            inputs[key] = os.environ[key]
+    dlab_manifest = get_files_manifest(os.path.dirname(os.path.abspath(__file__)))
+    for name in ['fab.py', 'common_lib.py', 'notebook_lib.py', 'actions_lib.py']:
+        if name in dlab_manifest:
+            inputs['dlab/' + name] = dlab_manifest[name]
+    for path, checksum in get_files_manifest('/root/scripts').items():
+        if path.startswith('configure_') and path.endswith('_node.py'):
+            inputs['/root/scripts/' + path] = checksum
+    for directory in ['/root/templates', '/root/files']:
+        for path, checksum in get_files_manifest(directory).items():
+            inputs[os.path.join(directory, path)] = checksum
+    return inputs
+
+
+def get_notebook_image_hash(application):
+    sha1 = hashlib.sha1()
+    for key, value in sorted(get_notebook_image_inputs(application).items()):
+        sha1.update('{}={}\n'.format(key, value))
+    return sha1.hexdigest()[:12]
+
+
+def get_notebook_image_name(service_base_name, application):
+    # Versioned shared image of the template: a change of any input gives a new image instead of reusing a stale one
+    return '{}-{}-notebook-image-{}'.format(service_base_name, application,
+                                             get_notebook_image_hash(application)).lower()
+
+
+def put_notebook_image_inputs(os_user, application, creds=False, hostname='', keyfile=''):
+    # Stored in the image, so the inputs of a baked image can be compared with the current ones
+    if creds:
+        env['connection_attempts'] = 100
+        env.key_filename = [keyfile]
+        env.host_string = os_user + '@' + hostname
+    inputs = get_notebook_image_inputs(application)
+    inputs['hash'] = get_notebook_image_hash(application)
+    put(StringIO(json.dumps(inputs, indent=2, sort_keys=True)), '/tmp/image_inputs.json')
+    sudo('mv -f /tmp/image_inputs.json /home/{}/.ensure_dir/image_inputs.json'.format(os_user))
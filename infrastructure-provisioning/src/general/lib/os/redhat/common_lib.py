@@ -20,11 +20,12 @@
 
 from fabric.api import *
 from fabric.contrib.files import exists
+from dlab.state import ensured, set_ensured
 
 
 def ensure_pkg(user, requisites='git vim gcc python-devel openssl-devel nmap libffi libffi-devel unzip'):
     try:
-        if not exists('/home/{}/.ensure_dir/pkg_upgraded'.format(user)):
+        if not ensured(user, 'pkg_upgraded'):
             print("Updating repositories and installing requested tools: {}".format(requisites))
             if sudo("systemctl list-units  --all | grep firewalld | awk '{print $1}'") != '':
                 sudo('systemctl disable firewalld.service')
@@ -49,7 +50,7 @@ def ensure_pkg(user, requisites='git vim gcc python-devel openssl-devel nmap lib
             sudo('rm -f epel-release-latest-7.noarch.rpm')
             sudo('export LC_ALL=C')
             sudo('yum -y install ' + requisites)
-            sudo('touch /home/{}/.ensure_dir/pkg_upgraded'.format(user))
+            set_ensured(user, 'pkg_upgraded')
         return True
     except:
         return False
@@ -29,12 +29,23 @@ def configure_http_proxy_server(config):
             sudo('yum -y install squid')
             template_file = config['template_file']
             proxy_subnet = config['exploratory_subnet']
+            package_cache = ''
+            if config.get('package_cache'):
+                with open(config['package_cache_template_file']) as tpl:
+                    package_cache = tpl.read().replace('CACHE_SIZE', str(config['package_cache_size'])) \
+                        .replace('MAX_OBJECT_SIZE', str(config['package_cache_max_object_size']))
             with open("/tmp/tmpsquid.conf", 'w') as out:
                 with open(template_file) as tpl:
                     for line in tpl:
-                        out.write(line.replace('PROXY_SUBNET', proxy_subnet))
+                        if line.strip() == 'PACKAGE_CACHE_PROFILE':
+                            out.write(package_cache)
+                        else:
+                            out.write(line.replace('PROXY_SUBNET', proxy_subnet))
             put('/tmp/tmpsquid.conf', '/tmp/squid.conf')
             sudo('\cp /tmp/squid.conf /etc/squid/squid.conf')
+            if config.get('package_cache'):
+                sudo('systemctl stop squid')
+                sudo('squid -N -z')
             sudo('systemctl restart squid')
             sudo('chkconfig squid on')
             sudo('touch /tmp/http_proxy_ensured')
@@ -42,7 +53,31 @@ def configure_http_proxy_server(config):
     except:
         return False
 
-def install_nginx_ldap(edge_ip, nginx_version, ldap_ip, ldap_dn, ldap_ou, ldap_service_pass, ldap_service_username, ldap_user):
+def configure_package_mirror(config):
+    # PyPI is served over HTTPS only, which squid tunnels without caching, so the package cache profile
+    # adds a caching PyPI mirror (devpi-server) for pip on notebooks
+    try:
+        if not exists('/tmp/package_mirror_ensured'):
+            sudo('yum -y install python34 python34-pip')
+            sudo('pip3 install devpi-server=={}'.format(config['package_mirror_version']))
+            sudo('mkdir -p /var/cache/devpi')
+            sudo('/usr/local/bin/devpi-server --serverdir /var/cache/devpi --init')
+            with open(config['package_mirror_template_file']) as tpl:
+                text = tpl.read().replace('MIRROR_PORT', str(config['package_mirror_port']))
+            with open('/tmp/package_mirror.service', 'w') as out:
+                out.write(text)
+            put('/tmp/package_mirror.service', '/tmp/package_mirror.service')
+            sudo('\cp /tmp/package_mirror.service /etc/systemd/system/package_mirror.service')
+            sudo('systemctl daemon-reload')
+            sudo('systemctl enable package_mirror')
+            sudo('systemctl start package_mirror')
+            sudo('touch /tmp/package_mirror_ensured')
+        return True
+    except:
+        return False
+
+def install_nginx_ldap(edge_ip, nginx_version, ldap_ip, ldap_dn, ldap_ou, ldap_service_pass, ldap_service_username, ldap_user,
+                       ldap_cache_size=1000, ldap_cache_ttl=300):
     try:
         if not os.path.exists('/tmp/nginx_installed'):
             sudo('yum install -y wget')
@@ -81,6 +116,9 @@ def install_nginx_ldap(edge_ip, nginx_version, ldap_ip, ldap_dn, ldap_ou, ldap_s
             sudo('sed -i \'s/LDAP_SERVICE_PASSWORD/{}/g\' /opt/dlab/templates/nginx.conf'.format(ldap_service_pass))
             sudo('sed -i \'s/LDAP_SERVICE_USERNAME/{}/g\' /opt/dlab/templates/nginx.conf'.format(ldap_service_username))
             sudo('sed -i \'s/LDAP_USERNAME/{}/g\' /opt/dlab/templates/nginx.conf'.format(ldap_user))
+            sudo('sed -i \'s/LDAP_CACHE_SIZE/{}/g\' /opt/dlab/templates/nginx.conf'.format(ldap_cache_size))
+            sudo('sed -i \'s/LDAP_CACHE_EXPIRATION_TIME/{}/g\' /opt/dlab/templates/nginx.conf'.format(
+                int(ldap_cache_ttl) * 1000))
             sudo('sed -i \'s/EDGE_IP/{}/g\' /opt/dlab/templates/conf.d/proxy.conf'.format(edge_ip))
             sudo('cp /opt/dlab/templates/nginx.conf /etc/nginx/')
             sudo('mkdir /etc/nginx/conf.d')
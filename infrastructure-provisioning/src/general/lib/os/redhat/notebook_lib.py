@@ -56,7 +56,7 @@ def downgrade_python_version():
 
 
 def ensure_r_local_kernel(spark_version, os_user, templates_dir, kernels_dir):
-    if not exists('/home/{}/.ensure_dir/r_kernel_ensured'.format(os_user)):
+    if not ensured(os_user, 'r_kernel_ensured'):
         try:
             sudo('chown -R ' + os_user + ':' + os_user + ' /home/' + os_user + '/.local')
             run('R -e "IRkernel::installspec()"')
@@ -69,61 +69,64 @@ def ensure_r_local_kernel(spark_version, os_user, templates_dir, kernels_dir):
             sudo('\cp -f /tmp/r_template.json {}/ir/kernel.json'.format(kernels_dir))
             sudo('ln -s /usr/lib64/R/ /usr/lib/R')
             sudo('chown -R ' + os_user + ':' + os_user + ' /home/' + os_user + '/.local')
-            sudo('touch /home/{}/.ensure_dir/r_kernel_ensured'.format(os_user))
+            set_ensured(os_user, 'r_kernel_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_r(os_user, r_libs, region, r_mirror):
-    if not exists('/home/{}/.ensure_dir/r_ensured'.format(os_user)):
+    if not ensured(os_user, 'r_ensured'):
         try:
             if region == 'cn-north-1':
                 r_repository = r_mirror
             else:
                 r_repository = 'http://cran.us.r-project.org'
-            sudo('yum install -y cmake')
-            sudo('yum -y install libcur*')
-            sudo('echo -e "[base]\nname=CentOS-7-Base\nbaseurl=http://buildlogs.centos.org/centos/7/os/x86_64-20140704-1/\ngpgcheck=1\ngpgkey=file:///etc/pki/rpm-gpg/RPM-GPG-KEY-CentOS-7\npriority=1\nexclude=php mysql" >> /etc/yum.repos.d/CentOS-base.repo')
-            sudo('yum install -y R R-core R-core-devel R-devel --nogpgcheck')
-            sudo('R CMD javareconf')
-            sudo('cd /root; git clone https://github.com/zeromq/zeromq4-x.git; cd zeromq4-x/; mkdir build; cd build; cmake ..; make install; ldconfig')
+            batch = RemoteBatch('ensure_r', user=os_user)
+            batch.sudo('yum install -y cmake')
+            batch.sudo('yum -y install libcur*')
+            batch.sudo('echo -e "[base]\nname=CentOS-7-Base\nbaseurl=http://buildlogs.centos.org/centos/7/os/x86_64-20140704-1/\ngpgcheck=1\ngpgkey=file:///etc/pki/rpm-gpg/RPM-GPG-KEY-CentOS-7\npriority=1\nexclude=php mysql" >> /etc/yum.repos.d/CentOS-base.repo')
+            batch.sudo('yum install -y R R-core R-core-devel R-devel --nogpgcheck')
+            batch.sudo('R CMD javareconf')
+            batch.sudo('cd /root; git clone https://github.com/zeromq/zeromq4-x.git; cd zeromq4-x/; mkdir build; cd build; cmake ..; make install; ldconfig')
             for i in r_libs:
-                sudo('R -e "install.packages(\'{}\',repos=\'{}\')"'.format(i, r_repository))
-            sudo('R -e "library(\'devtools\');install.packages(repos=\'{}\',c(\'rzmq\',\'repr\',\'digest\',\'stringr\',\'RJSONIO\',\'functional\',\'plyr\'))"'.format(r_repository))
-            sudo('R -e "library(\'devtools\');install_github(\'IRkernel/repr\');install_github(\'IRkernel/IRdisplay\');install_github(\'IRkernel/IRkernel\');"')
-            sudo('R -e "library(\'devtools\');install_github(\'rstudio/keras\');"')
-            sudo('R -e "install.packages(\'RJDBC\',repos=\'{}\',dep=TRUE)"'.format(r_repository))
-            sudo('touch /home/{}/.ensure_dir/r_ensured'.format(os_user))
+                batch.sudo('R -e "install.packages(\'{}\',repos=\'{}\')"'.format(i, r_repository))
+            batch.sudo('R -e "library(\'devtools\');install.packages(repos=\'{}\',c(\'rzmq\',\'repr\',\'digest\',\'stringr\',\'RJSONIO\',\'functional\',\'plyr\'))"'.format(r_repository))
+            batch.sudo('R -e "library(\'devtools\');install_github(\'IRkernel/repr\');install_github(\'IRkernel/IRdisplay\');install_github(\'IRkernel/IRkernel\');"')
+            batch.sudo('R -e "library(\'devtools\');install_github(\'rstudio/keras\');"')
+            batch.sudo('R -e "install.packages(\'RJDBC\',repos=\'{}\',dep=TRUE)"'.format(r_repository))
+            set_ensured(os_user, 'r_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
 
 
 def install_rstudio(os_user, local_spark_path, rstudio_pass, rstudio_version):
-    if not exists('/home/' + os_user + '/.ensure_dir/rstudio_ensured'):
+    if not ensured(os_user, 'rstudio_ensured'):
         try:
-            sudo('yum install -y --nogpgcheck https://download2.rstudio.org/rstudio-server-rhel-{}-x86_64.rpm'.format(rstudio_version))
-            sudo('mkdir -p /mnt/var')
-            sudo('chown {0}:{0} /mnt/var'.format(os_user))
+            batch = RemoteBatch('install_rstudio', user=os_user)
+            batch.sudo('yum install -y --nogpgcheck https://download2.rstudio.org/rstudio-server-rhel-{}-x86_64.rpm'.format(rstudio_version))
+            batch.sudo('mkdir -p /mnt/var')
+            batch.sudo('chown {0}:{0} /mnt/var'.format(os_user))
             if os.environ['application'] == 'tensor-rstudio':
-                sudo("sed -i '/ExecStart/s|=|=/bin/bash -c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64; |g' /etc/systemd/system/rstudio-server.service")
-                sudo("sed -i '/ExecStart/s|$|\"|g' /etc/systemd/system/rstudio-server.service")
-                sudo("systemctl daemon-reload")
-            sudo('touch /home/{}/.Renviron'.format(os_user))
-            sudo('chown {0}:{0} /home/{0}/.Renviron'.format(os_user))
-            sudo('''echo 'SPARK_HOME="{0}"' >> /home/{1}/.Renviron'''.format(local_spark_path, os_user))
-            sudo('touch /home/{}/.Rprofile'.format(os_user))
-            sudo('chown {0}:{0} /home/{0}/.Rprofile'.format(os_user))
-            sudo('''echo 'library(SparkR, lib.loc = c(file.path(Sys.getenv("SPARK_HOME"), "R", "lib")))' >> /home/{}/.Rprofile'''.format(os_user))
-            http_proxy = run('echo $http_proxy')
-            https_proxy = run('echo $https_proxy')
-            sudo('''echo 'Sys.setenv(http_proxy = \"{}\")' >> /home/{}/.Rprofile'''.format(http_proxy, os_user))
-            sudo('''echo 'Sys.setenv(https_proxy = \"{}\")' >> /home/{}/.Rprofile'''.format(https_proxy, os_user))
-            sudo('rstudio-server start')
-            sudo('echo "{0}:{1}" | chpasswd'.format(os_user, rstudio_pass))
-            sudo("sed -i '/exit 0/d' /etc/rc.local")
-            sudo('''bash -c "echo \'sed -i 's/^#SPARK_HOME/SPARK_HOME/' /home/{}/.Renviron\' >> /etc/rc.local"'''.format(os_user))
-            sudo("bash -c 'echo exit 0 >> /etc/rc.local'")
-            sudo('touch /home/{}/.ensure_dir/rstudio_ensured'.format(os_user))
+                batch.sudo("sed -i '/ExecStart/s|=|=/bin/bash -c \"export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64; |g' /etc/systemd/system/rstudio-server.service")
+                batch.sudo("sed -i '/ExecStart/s|$|\"|g' /etc/systemd/system/rstudio-server.service")
+                batch.sudo("systemctl daemon-reload")
+            batch.sudo('touch /home/{}/.Renviron'.format(os_user))
+            batch.sudo('chown {0}:{0} /home/{0}/.Renviron'.format(os_user))
+            batch.sudo('''echo 'SPARK_HOME="{0}"' >> /home/{1}/.Renviron'''.format(local_spark_path, os_user))
+            batch.sudo('touch /home/{}/.Rprofile'.format(os_user))
+            batch.sudo('chown {0}:{0} /home/{0}/.Rprofile'.format(os_user))
+            batch.sudo('''echo 'library(SparkR, lib.loc = c(file.path(Sys.getenv("SPARK_HOME"), "R", "lib")))' >> /home/{}/.Rprofile'''.format(os_user))
+            # Proxy settings come from /etc/profile, which the batch shell has loaded as a login shell
+            batch.sudo('''echo "Sys.setenv(http_proxy = \\"$http_proxy\\")" >> /home/{}/.Rprofile'''.format(os_user))
+            batch.sudo('''echo "Sys.setenv(https_proxy = \\"$https_proxy\\")" >> /home/{}/.Rprofile'''.format(os_user))
+            batch.sudo('rstudio-server start')
+            batch.sudo('echo "{0}:{1}" | chpasswd'.format(os_user, rstudio_pass))
+            batch.sudo("sed -i '/exit 0/d' /etc/rc.local")
+            batch.sudo('''bash -c "echo \'sed -i 's/^#SPARK_HOME/SPARK_HOME/' /home/{}/.Renviron\' >> /etc/rc.local"'''.format(os_user))
+            batch.sudo("bash -c 'echo exit 0 >> /etc/rc.local'")
+            set_ensured(os_user, 'rstudio_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
     else:
@@ -134,66 +137,68 @@ def install_rstudio(os_user, local_spark_path, rstudio_pass, rstudio_version):
 
 
 def ensure_matplot(os_user):
-    if not exists('/home/{}/.ensure_dir/matplot_ensured'.format(os_user)):
+    if not ensured(os_user, 'matplot_ensured'):
         try:
             sudo('pip2 install matplotlib==2.0.2 --no-cache-dir')
             sudo('python3.5 -m pip install matplotlib==2.0.2 --no-cache-dir')
             if os.environ['application'] in ('tensor', 'deeplearning'):
                 sudo('python2.7 -m pip install -U numpy=={} --no-cache-dir'.format(os.environ['notebook_numpy_version']))
                 sudo('python3.5 -m pip install -U numpy=={} --no-cache-dir'.format(os.environ['notebook_numpy_version']))
-            sudo('touch /home/{}/.ensure_dir/matplot_ensured'.format(os_user))
+            set_ensured(os_user, 'matplot_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_sbt(os_user):
-    if not exists('/home/{}/.ensure_dir/sbt_ensured'.format(os_user)):
+    if not ensured(os_user, 'sbt_ensured'):
         try:
             sudo('curl https://bintray.com/sbt/rpm/rpm | sudo tee /etc/yum.repos.d/bintray-sbt-rpm.repo')
             sudo('yum install -y sbt')
-            sudo('touch /home/{}/.ensure_dir/sbt_ensured'.format(os_user))
+            set_ensured(os_user, 'sbt_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_jre_jdk(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/jre_jdk_ensured'):
+    if not ensured(os_user, 'jre_jdk_ensured'):
         try:
             sudo('yum install -y java-1.8.0-openjdk')
             sudo('yum install -y java-1.8.0-openjdk-devel')
-            sudo('touch /home/' + os_user + '/.ensure_dir/jre_jdk_ensured')
+            set_ensured(os_user, 'jre_jdk_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_scala(scala_link, scala_version, os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/scala_ensured'):
+    if not ensured(os_user, 'scala_ensured', {"scala_version": scala_version}):
         try:
             sudo('wget {}scala-{}.rpm -O /tmp/scala.rpm'.format(scala_link, scala_version))
-            sudo('rpm -i /tmp/scala.rpm')
-            sudo('touch /home/' + os_user + '/.ensure_dir/scala_ensured')
+            sudo('rpm -U /tmp/scala.rpm')
+            set_ensured(os_user, 'scala_ensured', {"scala_version": scala_version}, scala_version)
         except:
             sys.exit(1)
 
 
 def ensure_additional_python_libs(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/additional_python_libs_ensured'):
+    if not ensured(os_user, 'additional_python_libs_ensured'):
         try:
-            sudo('yum clean all')
-            sudo('yum install -y zlib-devel libjpeg-turbo-devel --nogpgcheck')
+            batch = RemoteBatch('ensure_additional_python_libs', user=os_user)
+            batch.sudo('yum clean all')
+            batch.sudo('yum install -y zlib-devel libjpeg-turbo-devel --nogpgcheck')
             if os.environ['application'] in ('jupyter', 'zeppelin'):
-                sudo('pip2 install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
-                sudo('python3.5 -m pip install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
+                batch.sudo('pip2 install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
+                batch.sudo('python3.5 -m pip install NumPy=={} SciPy pandas Sympy Pillow sklearn --no-cache-dir'.format(os.environ['notebook_numpy_version']))
             if os.environ['application'] in ('tensor', 'deeplearning'):
-                sudo('python2.7 -m pip install opencv-python h5py --no-cache-dir')
-                sudo('python3.5 -m pip install opencv-python h5py --no-cache-dir')
-            sudo('touch /home/' + os_user + '/.ensure_dir/additional_python_libs_ensured')
+                batch.sudo('python2.7 -m pip install opencv-python h5py --no-cache-dir')
+                batch.sudo('python3.5 -m pip install opencv-python h5py --no-cache-dir')
+            set_ensured(os_user, 'additional_python_libs_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
 
 
 def ensure_python3_specific_version(python3_version, os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/python3_specific_version_ensured'):
+    if not ensured(os_user, 'python3_specific_version_ensured'):
         try:
             sudo('yum install -y yum-utils python34 openssl-devel')
             sudo('yum -y groupinstall development --nogpgcheck')
@@ -201,13 +206,13 @@ def ensure_python3_specific_version(python3_version, os_user):
                 python3_version = python3_version + ".0"
             sudo('wget https://www.python.org/ftp/python/{0}/Python-{0}.tgz'.format(python3_version))
             sudo('tar xzf Python-{0}.tgz; cd Python-{0}; ./configure --prefix=/usr/local; make altinstall'.format(python3_version))
-            sudo('touch /home/' + os_user + '/.ensure_dir/python3_specific_version_ensured')
+            set_ensured(os_user, 'python3_specific_version_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_python2_libraries(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/python2_libraries_ensured'):
+    if not ensured(os_user, 'python2_libraries_ensured'):
         try:
             sudo('pip2 install pyparsing==2.0.3')
             sudo('yum install -y python-setuptools python-wheel')
@@ -224,13 +229,13 @@ def ensure_python2_libraries(os_user):
             sudo('pip2 install boto3 backoff --no-cache-dir')
             sudo('pip2 install fabvenv fabric-virtualenv future --no-cache-dir')
             downgrade_python_version()
-            sudo('touch /home/' + os_user + '/.ensure_dir/python2_libraries_ensured')
+            set_ensured(os_user, 'python2_libraries_ensured')
         except:
             sys.exit(1)
 
 
 def ensure_python3_libraries(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/python3_libraries_ensured'):
+    if not ensured(os_user, 'python3_libraries_ensured'):
         try:
             sudo('yum -y install https://centos7.iuscommunity.org/ius-release.rpm')
             sudo('yum install -y python35u python35u-pip python35u-devel')
@@ -243,7 +248,7 @@ def ensure_python3_libraries(os_user):
             except:
                 sudo('python3.5 -m pip install tornado=={0} ipython==5.0.0 ipykernel=={1} --no-cache-dir' \
                      .format(os.environ['notebook_tornado_version'], os.environ['notebook_ipykernel_version']))
-            sudo('touch /home/' + os_user + '/.ensure_dir/python3_libraries_ensured')
+            set_ensured(os_user, 'python3_libraries_ensured')
         except:
             sys.exit(1)
 
@@ -251,66 +256,70 @@ def ensure_python3_libraries(os_user):
 def install_tensor(os_user, cuda_version, cuda_file_name,
                    cudnn_version, cudnn_file_name, tensorflow_version,
                    templates_dir, nvidia_version):
-    if not exists('/home/{}/.ensure_dir/tensor_ensured'.format(os_user)):
+    if not ensured(os_user, 'tensor_ensured'):
         try:
             # install nvidia drivers
-            sudo('echo "blacklist nouveau" >> /etc/modprobe.d/blacklist-nouveau.conf')
-            sudo('echo "options nouveau modeset=0" >> /etc/modprobe.d/blacklist-nouveau.conf')
-            sudo('dracut --force')
+            batch = RemoteBatch('install_tensor', user=os_user)
+            batch.sudo('echo "blacklist nouveau" >> /etc/modprobe.d/blacklist-nouveau.conf')
+            batch.sudo('echo "options nouveau modeset=0" >> /etc/modprobe.d/blacklist-nouveau.conf')
+            batch.sudo('dracut --force')
+            batch.execute()
             with settings(warn_only=True):
                 reboot(wait=150)
-            sudo('yum -y install dkms gcc kernel-devel-$(uname -r) kernel-headers-$(uname -r)')
-            sudo('wget http://us.download.nvidia.com/XFree86/Linux-x86_64/{0}/NVIDIA-Linux-x86_64-{0}.run -O /home/{1}/NVIDIA-Linux-x86_64-{0}.run'.format(nvidia_version, os_user))
-            sudo('/bin/bash /home/{0}/NVIDIA-Linux-x86_64-{1}.run -s --dkms'.format(os_user, nvidia_version))
-            sudo('rm -f /home/{0}/NVIDIA-Linux-x86_64-{1}.run'.format(os_user, nvidia_version))
+            batch = RemoteBatch('install_tensor', user=os_user)
+            batch.sudo('yum -y install dkms gcc kernel-devel-$(uname -r) kernel-headers-$(uname -r)')
+            batch.sudo('wget http://us.download.nvidia.com/XFree86/Linux-x86_64/{0}/NVIDIA-Linux-x86_64-{0}.run -O /home/{1}/NVIDIA-Linux-x86_64-{0}.run'.format(nvidia_version, os_user))
+            batch.sudo('/bin/bash /home/{0}/NVIDIA-Linux-x86_64-{1}.run -s --dkms'.format(os_user, nvidia_version))
+            batch.sudo('rm -f /home/{0}/NVIDIA-Linux-x86_64-{1}.run'.format(os_user, nvidia_version))
             # install cuda
-            sudo('python3.5 -m pip install --upgrade pip=={0} wheel numpy=={1} --no-cache-dir'. format(os.environ['conf_pip_version'], os.environ['notebook_numpy_version']))
-            sudo('wget -P /opt https://developer.nvidia.com/compute/cuda/{0}/prod/local_installers/{1}'.format(cuda_version, cuda_file_name))
-            sudo('sh /opt/{} --silent --toolkit'.format(cuda_file_name))
-            sudo('mv /usr/local/cuda-{} /opt/'.format(cuda_version))
-            sudo('ln -s /opt/cuda-{0} /usr/local/cuda-{0}'.format(cuda_version))
-            sudo('rm -f /opt/{}'.format(cuda_file_name))
+            batch.sudo('python3.5 -m pip install --upgrade pip=={0} wheel numpy=={1} --no-cache-dir'. format(os.environ['conf_pip_version'], os.environ['notebook_numpy_version']))
+            batch.sudo('wget -P /opt https://developer.nvidia.com/compute/cuda/{0}/prod/local_installers/{1}'.format(cuda_version, cuda_file_name))
+            batch.sudo('sh /opt/{} --silent --toolkit'.format(cuda_file_name))
+            batch.sudo('mv /usr/local/cuda-{} /opt/'.format(cuda_version))
+            batch.sudo('ln -s /opt/cuda-{0} /usr/local/cuda-{0}'.format(cuda_version))
+            batch.sudo('rm -f /opt/{}'.format(cuda_file_name))
             # install cuDNN
-            run('wget http://developer.download.nvidia.com/compute/redist/cudnn/v{0}/{1} -O /tmp/{1}'.format(cudnn_version, cudnn_file_name))
-            run('tar xvzf /tmp/{} -C /tmp'.format(cudnn_file_name))
-            sudo('mkdir -p /opt/cudnn/include')
-            sudo('mkdir -p /opt/cudnn/lib64')
-            sudo('mv /tmp/cuda/include/cudnn.h /opt/cudnn/include')
-            sudo('mv /tmp/cuda/lib64/libcudnn* /opt/cudnn/lib64')
-            sudo('chmod a+r /opt/cudnn/include/cudnn.h /opt/cudnn/lib64/libcudnn*')
-            run('echo "export LD_LIBRARY_PATH=\"$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64\"" >> ~/.bashrc')
+            batch.run('wget http://developer.download.nvidia.com/compute/redist/cudnn/v{0}/{1} -O /tmp/{1}'.format(cudnn_version, cudnn_file_name))
+            batch.run('tar xvzf /tmp/{} -C /tmp'.format(cudnn_file_name))
+            batch.sudo('mkdir -p /opt/cudnn/include')
+            batch.sudo('mkdir -p /opt/cudnn/lib64')
+            batch.sudo('mv /tmp/cuda/include/cudnn.h /opt/cudnn/include')
+            batch.sudo('mv /tmp/cuda/lib64/libcudnn* /opt/cudnn/lib64')
+            batch.sudo('chmod a+r /opt/cudnn/include/cudnn.h /opt/cudnn/lib64/libcudnn*')
+            batch.run('echo "export LD_LIBRARY_PATH=\"$LD_LIBRARY_PATH:/opt/cudnn/lib64:/usr/local/cuda/lib64\"" >> ~/.bashrc')
             # install TensorFlow and run TensorBoard
-            sudo('wget https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp27-none-linux_x86_64.whl'.format(tensorflow_version))
-            sudo('wget https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp35-cp35m-linux_x86_64.whl'.format(tensorflow_version))
-            sudo('python2.7 -m pip install --upgrade tensorflow_gpu-{}-cp27-none-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
-            sudo('python3.5 -m pip install --upgrade tensorflow_gpu-{}-cp35-cp35m-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
-            sudo('rm -rf /home/{}/tensorflow_gpu-*'.format(os_user))
-            sudo('mkdir /var/log/tensorboard; chown {0}:{0} -R /var/log/tensorboard'.format(os_user))
-            put('{}tensorboard.service'.format(templates_dir), '/tmp/tensorboard.service')
-            sudo("sed -i 's|OS_USR|{}|' /tmp/tensorboard.service".format(os_user))
-            sudo("chmod 644 /tmp/tensorboard.service")
-            sudo('\cp /tmp/tensorboard.service /etc/systemd/system/')
-            sudo("systemctl daemon-reload")
-            sudo("systemctl enable tensorboard")
-            sudo("systemctl start tensorboard")
-            sudo('touch /home/{}/.ensure_dir/tensor_ensured'.format(os_user))
+            batch.sudo('wget https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp27-none-linux_x86_64.whl'.format(tensorflow_version))
+            batch.sudo('wget https://storage.googleapis.com/tensorflow/linux/gpu/tensorflow_gpu-{}-cp35-cp35m-linux_x86_64.whl'.format(tensorflow_version))
+            batch.sudo('python2.7 -m pip install --upgrade tensorflow_gpu-{}-cp27-none-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
+            batch.sudo('python3.5 -m pip install --upgrade tensorflow_gpu-{}-cp35-cp35m-linux_x86_64.whl --no-cache-dir'.format(tensorflow_version))
+            batch.sudo('rm -rf /home/{}/tensorflow_gpu-*'.format(os_user))
+            batch.sudo('mkdir /var/log/tensorboard; chown {0}:{0} -R /var/log/tensorboard'.format(os_user))
+            batch.put('{}tensorboard.service'.format(templates_dir), '/tmp/tensorboard.service')
+            batch.sudo("sed -i 's|OS_USR|{}|' /tmp/tensorboard.service".format(os_user))
+            batch.sudo("chmod 644 /tmp/tensorboard.service")
+            batch.sudo('\cp /tmp/tensorboard.service /etc/systemd/system/')
+            batch.sudo("systemctl daemon-reload")
+            batch.sudo("systemctl enable tensorboard")
+            batch.sudo("systemctl start tensorboard")
+            set_ensured(os_user, 'tensor_ensured', batch=batch)
+            batch.execute()
         except:
             sys.exit(1)
 
 
 def install_maven(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/maven_ensured'):
+    if not ensured(os_user, 'maven_ensured'):
         sudo('wget http://apache.volia.net/maven/maven-3/3.3.9/binaries/apache-maven-3.3.9-bin.tar.gz -O /tmp/maven.tar.gz')
         sudo('tar -zxvf /tmp/maven.tar.gz -C /opt/')
         sudo('ln -fs /opt/apache-maven-3.3.9/bin/mvn /usr/bin/mvn')
-        sudo('touch /home/' + os_user + '/.ensure_dir/maven_ensured')
+        set_ensured(os_user, 'maven_ensured')
 
 
 def install_livy_dependencies(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/livy_dependencies_ensured'):
+    if not ensured(os_user, 'livy_dependencies_ensured'):
         sudo('pip2 install cloudpickle requests requests-kerberos flake8 flaky pytest --no-cache-dir')
         sudo('pip3.5 install cloudpickle requests requests-kerberos flake8 flaky pytest --no-cache-dir')
-        sudo('touch /home/' + os_user + '/.ensure_dir/livy_dependencies_ensured')
+        set_ensured(os_user, 'livy_dependencies_ensured')
 
 
 def install_maven_emr(os_user):
@@ -329,9 +338,9 @@ def install_livy_dependencies_emr(os_user):
 
 
 def install_nodejs(os_user):
-    if not exists('/home/{}/.ensure_dir/nodejs_ensured'.format(os_user)):
+    if not ensured(os_user, 'nodejs_ensured'):
         sudo('yum install -y npm nodejs')
-        sudo('touch /home/{}/.ensure_dir/nodejs_ensured'.format(os_user))
+        set_ensured(os_user, 'nodejs_ensured')
 
 
 def install_os_pkg(requisites):
@@ -378,7 +387,7 @@ def get_available_os_pkgs():
 
 
 def install_opencv(os_user):
-    if not exists('/home/{}/.ensure_dir/opencv_ensured'.format(os_user)):
+    if not ensured(os_user, 'opencv_ensured'):
         sudo('yum install -y cmake python34 python34-devel python34-pip gcc gcc-c++')
         sudo('pip2 install numpy=={} --no-cache-dir'.format(os.environ['notebook_numpy_version']))
         sudo('pip3.4 install numpy=={} --no-cache-dir'.format(os.environ['notebook_numpy_version']))
@@ -391,11 +400,11 @@ def install_opencv(os_user):
             run('cmake -DINSTALL_TESTS=OFF -D CUDA_GENERATION=Auto -D CMAKE_BUILD_TYPE=RELEASE -D CMAKE_INSTALL_PREFIX=$(python2 -c "import sys; print(sys.prefix)") -D PYTHON_EXECUTABLE=$(which python2) ..')
             run('make -j$(nproc)')
             sudo('make install')
-        sudo('touch /home/' + os_user + '/.ensure_dir/opencv_ensured')
+        set_ensured(os_user, 'opencv_ensured')
 
 
 def install_caffe(os_user, region, caffe_version):
-    if not exists('/home/{}/.ensure_dir/caffe_ensured'.format(os_user)):
+    if not ensured(os_user, 'caffe_ensured'):
         env.shell = "/bin/bash -l -c -i"
         install_opencv(os_user)
         with cd('/etc/yum.repos.d/'):
@@ -437,11 +446,11 @@ def install_caffe(os_user, region, caffe_version):
             sudo('make test -j$(nproc)')
             run('make runtest')
             sudo('make pycaffe')
-        sudo('touch /home/' + os_user + '/.ensure_dir/caffe_ensured')
+        set_ensured(os_user, 'caffe_ensured')
 
 
 def install_caffe2(os_user, caffe2_version, cmake_version):
-    if not exists('/home/{}/.ensure_dir/caffe2_ensured'.format(os_user)):
+    if not ensured(os_user, 'caffe2_ensured'):
         env.shell = "/bin/bash -l -c -i"
         sudo('yum update-minimal --security -y')
         sudo('yum install -y --nogpgcheck automake cmake3 gcc gcc-c++ kernel-devel leveldb-devel lmdb-devel libtool protobuf-devel graphviz')
@@ -464,42 +473,42 @@ def install_caffe2(os_user, caffe2_version, cmake_version):
                 sudo('git checkout v{}'.format(caffe2_version))
                 sudo('git submodule update --recursive')
             sudo('mkdir build && cd build && cmake{} .. && make "-j$(nproc)" install'.format(cmake_version))
-        sudo('touch /home/' + os_user + '/.ensure_dir/caffe2_ensured')
+        set_ensured(os_user, 'caffe2_ensured')
 
 
 def install_cntk(os_user, cntk_version):
-    if not exists('/home/{}/.ensure_dir/cntk_ensured'.format(os_user)):
+    if not ensured(os_user, 'cntk_ensured'):
         sudo('echo "exclude=*.i386 *.i686" >> /etc/yum.conf')
         sudo('yum clean all && yum update-minimal --security -y')
         sudo('yum install -y openmpi openmpi-devel --nogpgcheck')
         sudo('pip2 install https://cntk.ai/PythonWheel/GPU/cntk-{}-cp27-cp27mu-linux_x86_64.whl --no-cache-dir'.format(cntk_version))
         sudo('pip3.5 install https://cntk.ai/PythonWheel/GPU/cntk-{}-cp35-cp35m-linux_x86_64.whl --no-cache-dir'.format(cntk_version))
-        sudo('touch /home/{}/.ensure_dir/cntk_ensured'.format(os_user))
+        set_ensured(os_user, 'cntk_ensured')
 
 
 def install_keras(os_user, keras_version):
-    if not exists('/home/{}/.ensure_dir/keras_ensured'.format(os_user)):
+    if not ensured(os_user, 'keras_ensured', {"keras_version": keras_version}):
         sudo('pip2 install keras=={} --no-cache-dir'.format(keras_version))
         sudo('pip3.5 install keras=={} --no-cache-dir'.format(keras_version))
-        sudo('touch /home/{}/.ensure_dir/keras_ensured'.format(os_user))
+        set_ensured(os_user, 'keras_ensured', {"keras_version": keras_version}, keras_version)
 
 
 def install_theano(os_user, theano_version):
-    if not exists('/home/{}/.ensure_dir/theano_ensured'.format(os_user)):
+    if not ensured(os_user, 'theano_ensured', {"theano_version": theano_version}):
         sudo('python2.7 -m pip install Theano=={} --no-cache-dir'.format(theano_version))
         sudo('python3.5 -m pip install Theano=={} --no-cache-dir'.format(theano_version))
-        sudo('touch /home/{}/.ensure_dir/theano_ensured'.format(os_user))
+        set_ensured(os_user, 'theano_ensured', {"theano_version": theano_version}, theano_version)
 
 
 def install_mxnet(os_user, mxnet_version):
-    if not exists('/home/{}/.ensure_dir/mxnet_ensured'.format(os_user)):
+    if not ensured(os_user, 'mxnet_ensured', {"mxnet_version": mxnet_version}):
         sudo('pip2 install mxnet-cu80=={} opencv-python --no-cache-dir'.format(mxnet_version))
         sudo('pip3.5 install mxnet-cu80=={} opencv-python --no-cache-dir'.format(mxnet_version))
-        sudo('touch /home/{}/.ensure_dir/mxnet_ensured'.format(os_user))
+        set_ensured(os_user, 'mxnet_ensured', {"mxnet_version": mxnet_version}, mxnet_version)
 
 
 def install_torch(os_user):
-    if not exists('/home/{}/.ensure_dir/torch_ensured'.format(os_user)):
+    if not ensured(os_user, 'torch_ensured'):
         run('git clone https://github.com/torch/distro.git ~/torch --recursive')
         with cd('/home/{}/torch/'.format(os_user)):
             sudo('yum install -y --nogpgcheck cmake curl readline-devel ncurses-devel gcc-c++ gcc-gfortran git '
@@ -507,7 +516,7 @@ def install_torch(os_user):
                  'sox-devel sox zeromq3-devel qt-devel qtwebkit-devel sox-plugins-freeworld qt-devel')
             run('./install.sh -b')
         run('source /home/{}/.bashrc'.format(os_user))
-        sudo('touch /home/{}/.ensure_dir/torch_ensured'.format(os_user))
+        set_ensured(os_user, 'torch_ensured')
 
 
 def install_gitlab_cert(os_user, certfile):
@@ -0,0 +1,168 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from fabric.api import *
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+locations_dir = '/root/locations'
+bytecode_cache_dir = '/root/locations_cache'
+remote_locations_dir = '/etc/nginx/locations'
+proxy_conf_template = '/root/conf.d/proxy.conf'
+remote_proxy_conf = '/etc/nginx/conf.d/proxy.conf'
+# Parts of a resource config: server locations, entries of the $dlab_upstream map and upstream blocks
+location_parts = ('conf', 'map', 'upstream')
+template_environment = None
+
+
+def get_environment():
+    # One environment per process, templates are compiled once at image build and loaded from bytecode cache
+    global template_environment
+    if template_environment is None:
+        if not os.path.isdir(bytecode_cache_dir):
+            os.makedirs(bytecode_cache_dir)
+        template_environment = Environment(loader=FileSystemLoader(locations_dir), trim_blocks=True,
+                                           lstrip_blocks=True,
+                                           bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir))
+    return template_environment
+
+
+def precompile():
+    environment = get_environment()
+    templates = environment.list_templates()
+    for name in templates:
+        environment.get_template(name)
+    return templates
+
+
+def get_node_names(resource):
+    info = resource['additional_info']
+    if resource['type'] != 'spark':
+        return []
+    return [info['master_node_name']] + ['{0}{1}'.format(info['slave_node_name'], i + 1)
+                                         for i in range(info['instance_count'] - 1)]
+
+
+def get_location_config(resource, private_ips):
+    info = resource['additional_info']
+    config = {}
+    if resource['type'] not in ('emr', 'spark'):
+        config['NAME'] = resource['exploratory_name']
+        config['IP'] = info['instance_hostname']
+        return resource['exploratory_name'], config
+    config['CLUSTER_NAME'] = '{}_{}'.format(resource['exploratory_name'], info['computational_name'])
+    if resource['type'] == 'spark':
+        config['MASTER_IP'] = private_ips[info['master_node_name']]
+        config['MASTER_DNS'] = info['master_node_hostname']
+        config['NOTEBOOK_IP'] = info['notebook_instance_ip']
+        # Spark master proxies workers and links with the edge prefix itself, see configure_dataengine.py
+        config['REVERSE_PROXY'] = info.get('spark_reverse_proxy', False)
+        config['slaves'] = [{'name': 'datanode{}'.format(i + 1),
+                             'ip': private_ips['{0}{1}'.format(info['slave_node_name'], i + 1)]}
+                            for i in range(info['instance_count'] - 1)]
+    else:
+        config['MASTER_IP'] = info['master_ip']
+        config['MASTER_DNS'] = info['master_dns']
+        config['slaves'] = info['slaves']
+    return config['CLUSTER_NAME'], config
+
+
+def render_locations(resources, get_private_ips):
+    # Renders locations of all resources, private IPs of all cluster nodes are found with one inventory lookup.
+    # Returns {file name: content}, where None marks a part the resource no longer has
+    environment = get_environment()
+    available = set(environment.list_templates())
+    node_names = [name for resource in resources for name in get_node_names(resource)]
+    private_ips = get_private_ips('Name', node_names) if node_names else {}
+    configs = dict()
+    for resource in resources:
+        conf_name, config = get_location_config(resource, private_ips)
+        templates = [resource['type']]
+        if resource['type'] not in ('emr', 'spark'):
+            templates.append('ungit')
+        if resource['additional_info'].get('tensor'):
+            templates.append('tensor')
+        for part in location_parts:
+            names = ['{0}.{1}'.format(name, part) for name in templates if '{0}.{1}'.format(name, part) in available]
+            content = '\n'.join([environment.get_template(name).render(config) for name in names])
+            configs['{0}.{1}'.format(conf_name, part)] = content + '\n' if content else None
+    return configs
+
+
+def render_proxy_conf():
+    # Edges created before the map routing have a proxy.conf without the $dlab_upstream map and the includes of
+    # *.map and *.upstream files, which the locations rely on. It is installed with the locations, keeping the
+    # server_name of the edge
+    server_name = sudo("sed -n 's/^[[:space:]]*server_name[[:space:]]*\\(.*\\);/\\1/p' {}".format(
+        remote_proxy_conf)).strip()
+    if not server_name:
+        raise Exception('No server_name found in {}'.format(remote_proxy_conf))
+    with open(proxy_conf_template) as template:
+        return template.read().replace('EDGE_IP', server_name)
+
+
+def update_locations(configs, os_user, edge_hostname, keyfile):
+    # Files are uploaded next to the live ones and renamed into place at once. Nginx reloads only if the
+    # new configuration passes nginx -t, otherwise the previous files are put back
+    env['connection_attempts'] = 100
+    env.key_filename = [keyfile]
+    env.host_string = os_user + '@' + edge_hostname
+    staging_dir = '{0}/.staging_{1}'.format(remote_locations_dir, int(time.time()))
+    local_dir = '/tmp/locations_{}'.format(os.getpid())
+    try:
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        for name, content in configs.items():
+            if content is not None:
+                with open(os.path.join(local_dir, name), 'w') as conf_file:
+                    conf_file.write(content)
+        with open(os.path.join(local_dir, 'proxy.conf'), 'w') as conf_file:
+            conf_file.write(render_proxy_conf())
+        names = ' '.join(sorted(configs))
+        sudo('mkdir -p {}'.format(staging_dir))
+        put('{}/*'.format(local_dir), staging_dir, use_sudo=True)
+        sudo('if ! cmp -s {0}/proxy.conf {1}; then cp -p {1} {0}/proxy.conf.previous && mv -f {0}/proxy.conf {1}; '
+             'fi'.format(staging_dir, remote_proxy_conf))
+        sudo('cd {0} && for name in {1}; do if [ -e $name ]; then cp -p $name {2}/$name.previous; fi; '
+             'if [ -e {2}/$name ]; then mv -f {2}/$name $name; else rm -f $name; fi; done'.format(
+                 remote_locations_dir, names, staging_dir))
+        with settings(warn_only=True):
+            result = sudo('nginx -t')
+        if result.failed:
+            sudo('cd {0} && for name in {1}; do if [ -e {2}/$name.previous ]; then mv -f {2}/$name.previous $name; '
+                 'else rm -f $name; fi; done; if [ -e {2}/proxy.conf.previous ]; then mv -f {2}/proxy.conf.previous {3}; '
+                 'fi; rm -rf {2}'.format(remote_locations_dir, names, staging_dir, remote_proxy_conf))
+            raise Exception('Nginx configuration test failed, locations {} were rolled back'.format(names))
+        sudo('rm -rf {}'.format(staging_dir))
+        sudo('service nginx reload')
+    finally:
+        shutil.rmtree(local_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--precompile', action='store_true', help='Compile location templates into bytecode cache')
+    args = parser.parse_args()
+    if args.precompile:
+        print("Compiled {} location templates into {}".format(len(precompile()), bytecode_cache_dir))
+    sys.exit(0)
@@ -0,0 +1,118 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+import json
+import base64
+import hashlib
+import datetime
+from fabric.api import env, run, sudo, settings, hide
+
+# Components installed on an instance are recorded next to the .ensure_dir markers, one JSON entry per
+# component in .ensure_dir/.state/<marker>.json: {"component": ..., "version": ..., "inputs": <sha1>, "updated": ...}
+# The entries are read once per host and script and checks are answered locally. Every change writes only
+# the entry of its own component, atomically, so scripts running at the same time on the same instance do
+# not overwrite each other's components. Markers are still touched, so scripts and tools that look for them
+# keep working, and removing a marker still makes its component run again.
+# Only components whose install is safe to run again declare inputs, the others run once as before.
+entries_dir = '.state'
+
+manifests = dict()
+
+
+def get_dir(os_user):
+    return '/home/{}/.ensure_dir'.format(os_user)
+
+
+def get_inputs_hash(inputs):
+    if inputs is None:
+        return None
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str)).hexdigest()
+
+
+def load(os_user):
+    # The entries and the markers in one round trip, markers without an entry are imported
+    key = (env.host_string, os_user)
+    if key not in manifests:
+        with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+            output = run('cat {0}/{1}/*.json 2>/dev/null; echo; echo "##DLAB_MARKERS"; ls -1 {0} 2>/dev/null'.format(
+                get_dir(os_user), entries_dir))
+        content, markers = output.split('##DLAB_MARKERS')
+        components = dict()
+        for line in content.splitlines():
+            try:
+                item = json.loads(line)
+                components[item.pop('component')] = item
+            except (ValueError, KeyError, AttributeError):
+                continue
+        markers = set([marker.strip() for marker in markers.splitlines()
+                       if marker.strip()]) - set(['image_inputs.json'])
+        for marker in markers - set(components.keys()):
+            components[marker] = {"version": "", "inputs": None, "updated": "", "imported": True}
+        for component in set(components.keys()) - markers:
+            del components[component]
+        manifests[key] = {"components": components}
+    return manifests[key]
+
+
+def get_save_command(os_user, component, item, command=''):
+    content = base64.b64encode(json.dumps(dict(item, component=component), sort_keys=True) + '\n')
+    entry_file = '{}/{}/{}.json'.format(get_dir(os_user), entries_dir, component)
+    # Written to a temporary file and renamed, so an interrupted write leaves the previous entry
+    return 'mkdir -p {0}/{1} && {2}echo {3} | base64 -d > {4}.$$ && mv -f {4}.$$ {4}'.format(
+        get_dir(os_user), entries_dir, command + ' && ' if command else '', content, entry_file)
+
+
+def save(os_user, component, item, command=''):
+    with hide('running'):
+        sudo(get_save_command(os_user, component, item, command))
+    load(os_user)['components'][component] = item
+
+
+def ensured(os_user, component, inputs=None):
+    # A component ran before and with the same inputs. Imported markers carry no inputs and adopt the inputs
+    # of their first check, the next change of the inputs runs the component again
+    item = load(os_user)['components'].get(component)
+    if item is None:
+        return False
+    if inputs is not None and item['inputs'] is None:
+        save(os_user, component, dict(item, inputs=get_inputs_hash(inputs), imported=False))
+        return True
+    if inputs is None or item['inputs'] is None:
+        return True
+    return item['inputs'] == get_inputs_hash(inputs)
+
+
+def set_ensured(os_user, component, inputs=None, version='', batch=None):
+    # With a RemoteBatch the entry is written by its last step, once every other step has succeeded
+    item = {"version": version,
+            "inputs": get_inputs_hash(inputs),
+            "updated": datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+    command = 'touch {}/{}'.format(get_dir(os_user), component)
+    if batch is None:
+        save(os_user, component, item, command)
+    else:
+        components = load(os_user)['components']
+        batch.sudo(get_save_command(os_user, component, item, command))
+        batch.on_success(lambda: components.update({component: item}))
+
+
+def unset_ensured(os_user, component):
+    load(os_user)['components'].pop(component, None)
+    with hide('running'):
+        sudo('rm -f {0}/{1} {0}/{2}/{1}.json'.format(get_dir(os_user), component, entries_dir))
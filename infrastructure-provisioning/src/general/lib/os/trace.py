@@ -0,0 +1,400 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ******************************************************************************
+
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import uuid
+import hashlib
+import atexit
+import logging
+import argparse
+import threading
+import functools
+import urllib2
+
+# A request runs as a tree of processes: /bin/<action>.py, fab, ~/scripts/*.py and their subscripts.
+# Every process records its spans and appends them to the trace file of the request, the parent span
+# is passed to child processes through the environment. /bin/<action>.py collects the trace next to
+# the response file with export_trace.
+trace_id_variable = 'dlab_trace_id'
+trace_parent_variable = 'dlab_trace_parent'
+trace_file_variable = 'dlab_trace_file'
+stage_pattern = re.compile(r'^\[[A-Z0-9][A-Z0-9 _/().,:-]*\]$')
+max_attribute_length = 200
+
+state = {"pid": None, "spans": [], "root": None, "stage": None, "flushed": False}
+local_stack = threading.local()
+lock = threading.Lock()
+fabric_traced = [False]
+sdk_traced = [False]
+
+
+def enabled():
+    # Only requests of the provisioning container are traced, not scripts run on the instances
+    return 'request_id' in os.environ and os.environ.get('conf_trace_enabled', 'false') == 'true'
+
+
+def new_id(length=16):
+    return uuid.uuid4().hex[:length]
+
+
+def get_stack():
+    if not hasattr(local_stack, 'spans'):
+        local_stack.spans = list()
+    return local_stack.spans
+
+
+def get_root():
+    # Started lazily and again after fork, so a daemon that preloaded this module does not share its spans
+    if state['pid'] != os.getpid():
+        state.update({"pid": os.getpid(), "spans": [], "root": None, "stage": None, "flushed": False})
+        local_stack.spans = list()
+        if trace_id_variable not in os.environ:
+            os.environ[trace_id_variable] = new_id(32)
+            os.environ[trace_file_variable] = '/tmp/dlab_trace_{}.jsonl'.format(os.environ[trace_id_variable])
+        root = Span(os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python', 'process',
+                    os.environ.get(trace_parent_variable), {"pid": os.getpid(), "args": ' '.join(sys.argv[1:])})
+        state['root'] = root
+        os.environ[trace_parent_variable] = root.span_id
+        atexit.register(flush)
+    return state['root']
+
+
+class Span:
+    def __init__(self, name, kind, parent_id, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start = time.time()
+        self.end = None
+
+    def finish(self, status=None):
+        if self.end is None:
+            self.end = time.time()
+            if status:
+                self.status = status
+            with lock:
+                state['spans'].append(self)
+
+    def to_dict(self):
+        return {"trace_id": os.environ.get(trace_id_variable), "span_id": self.span_id,
+                "parent_id": self.parent_id, "name": self.name, "kind": self.kind, "start": self.start,
+                "end": self.end, "duration": round(self.end - self.start, 6), "status": self.status,
+                "attributes": self.attributes}
+
+
+class span:
+    # with span('name', kind, key=value): nested under the innermost open span of the thread
+    def __init__(self, name, kind='internal', **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        if not enabled():
+            return None
+        root = get_root()
+        stack = get_stack()
+        parent = stack[-1] if stack else (state['stage'] or root)
+        self.span = Span(self.name, self.kind, parent.span_id, self.attributes)
+        stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.span is None:
+            return False
+        stack = get_stack()
+        if stack and stack[-1] is self.span:
+            stack.pop()
+        if exc_type is not None:
+            self.span.attributes['error'] = str(exc_value)[:max_attribute_length] or exc_type.__name__
+            self.span.finish('error')
+        else:
+            self.span.finish()
+        return False
+
+
+def start_trace():
+    # Makes the calling process the root of the request trace, before it starts any child process
+    if enabled():
+        get_root()
+
+
+def traced(name=None, kind='internal'):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__, kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StageFilter(logging.Filter):
+    # Scripts log every stage as logging.info('[CREATE SSH USER]'). A stage lasts until the next one of the
+    # same process. A filter instead of a handler keeps logging.basicConfig of the scripts working
+    def filter(self, record):
+        try:
+            message = record.getMessage()
+        except:
+            return True
+        if enabled() and stage_pattern.match(message):
+            root = get_root()
+            if state['stage'] is not None:
+                state['stage'].finish()
+            state['stage'] = Span(message, 'stage', root.span_id)
+            os.environ[trace_parent_variable] = state['stage'].span_id
+        return True
+
+
+def shorten(value):
+    value = str(value)
+    return value if len(value) <= max_attribute_length else value[:max_attribute_length] + '...'
+
+
+def describe_command(command):
+    # Commands carry passwords and keys (chpasswd, LDAP binds, keys echoed into files), so only the program
+    # and a hash which tells the same commands apart are recorded
+    if not isinstance(command, str):
+        command = command.encode('utf-8')
+    words = [word for word in command.split() if '=' not in word]
+    return '{} #{}'.format(shorten(words[0] if words else ''), hashlib.sha1(command).hexdigest()[:12])
+
+
+def trace_fabric():
+    # run() and sudo() of Fabric 1 go through operations._run_command, which is looked up at call time,
+    # so scripts that imported the raw functions are traced too. local(), put() and get() are replaced
+    # in fabric.api before dlab.fab exports them.
+    if fabric_traced[0]:
+        return
+    fabric_traced[0] = True
+    import fabric.api
+    import fabric.operations
+    from fabric.state import env
+
+    run_command = fabric.operations._run_command
+
+    def traced_run_command(command, *args, **kwargs):
+        with span('sudo' if kwargs.get('sudo') else 'run', 'command', command=describe_command(command),
+                  host=env.host_string) as current:
+            result = run_command(command, *args, **kwargs)
+            if current is not None and getattr(result, 'failed', False):
+                current.status = 'error'
+                current.attributes['return_code'] = getattr(result, 'return_code', None)
+            return result
+
+    def traced_operation(name, operation, describe):
+        @functools.wraps(operation)
+        def wrapper(*args, **kwargs):
+            with span(name, 'command', host=env.host_string, **describe(*args, **kwargs)) as current:
+                previous_parent = os.environ.get(trace_parent_variable)
+                if current is not None:
+                    os.environ[trace_parent_variable] = current.span_id
+                try:
+                    result = operation(*args, **kwargs)
+                finally:
+                    if previous_parent is not None:
+                        os.environ[trace_parent_variable] = previous_parent
+                if current is not None and getattr(result, 'failed', False):
+                    current.status = 'error'
+                return result
+        return wrapper
+
+    fabric.operations._run_command = traced_run_command
+    for name, describe in (
+            ('local', lambda command='', *args, **kwargs: {"command": describe_command(command)}),
+            ('put', lambda local_path=None, remote_path=None, *args, **kwargs: {
+                "local_path": shorten(local_path), "remote_path": shorten(remote_path)}),
+            ('get', lambda remote_path=None, local_path=None, *args, **kwargs: {
+                "local_path": shorten(local_path), "remote_path": shorten(remote_path)})):
+        wrapper = traced_operation(name, getattr(fabric.operations, name), describe)
+        setattr(fabric.operations, name, wrapper)
+        setattr(fabric.api, name, wrapper)
+
+
+def trace_method(cls, method_name, describe):
+    method = getattr(cls, method_name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        name, attributes = describe(self, *args, **kwargs)
+        with span(name, 'sdk', **attributes):
+            return method(self, *args, **kwargs)
+    setattr(cls, method_name, wrapper)
+
+
+def trace_sdk_calls():
+    # Wraps the request methods of boto3, googleapiclient and the Azure SDK, whichever is installed
+    if sdk_traced[0]:
+        return
+    sdk_traced[0] = True
+    try:
+        from botocore.client import BaseClient
+        trace_method(BaseClient, '_make_api_call', lambda client, operation, params: (
+            'aws {0}.{1}'.format(client.meta.service_model.service_name, operation),
+            {"region": client.meta.region_name}))
+    except ImportError:
+        pass
+    try:
+        from googleapiclient.http import HttpRequest
+        trace_method(HttpRequest, 'execute', lambda request, *args, **kwargs: (
+            'gcp {}'.format(request.methodId or request.method),
+            {"method": request.method, "uri": shorten(request.uri.split('?')[0])}))
+    except ImportError:
+        pass
+    try:
+        from msrest.service_client import ServiceClient
+        trace_method(ServiceClient, 'send', lambda client, request, *args, **kwargs: (
+            'azure {0} {1}'.format(request.method, re.sub(
+                r'/(subscriptions|resourceGroups|providers)/[^/]+', r'/\1/*', request.url.split('?')[0].split(
+                    '.com', 1)[-1])[:120]),
+            {"uri": shorten(request.url.split('?')[0])}))
+    except ImportError:
+        pass
+
+
+def trace_process():
+    trace_fabric()
+    trace_sdk_calls()
+    if not [item for item in logging.root.filters if isinstance(item, StageFilter)]:
+        logging.root.addFilter(StageFilter())
+
+
+def flush():
+    # Finishes the spans of this process and appends them to the trace file of the request
+    if state['pid'] != os.getpid() or state['flushed']:
+        return
+    state['flushed'] = True
+    if state['stage'] is not None:
+        state['stage'].finish()
+    for open_span in reversed(get_stack()):
+        open_span.finish('unfinished')
+    state['root'].finish()
+    lines = ''.join([json.dumps(finished.to_dict()) + '\n' for finished in state['spans']])
+    try:
+        trace_file = os.open(os.environ[trace_file_variable], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(trace_file, lines)
+        finally:
+            os.close(trace_file)
+    except Exception as err:
+        print("Failed to write trace: {}".format(str(err)))
+
+
+def read_spans(trace_path):
+    spans = list()
+    with open(trace_path) as trace_file:
+        for line in trace_file:
+            if line.strip():
+                spans.append(json.loads(line))
+    return sorted(spans, key=lambda item: item['start'])
+
+
+def export_otlp(spans, endpoint):
+    # OTLP/HTTP with JSON encoding, as accepted by the OpenTelemetry collector on /v1/traces
+    otlp_spans = list()
+    for item in spans:
+        otlp_span = {
+            "traceId": item['trace_id'], "spanId": item['span_id'], "name": item['name'],
+            "kind": 3 if item['kind'] in ('command', 'sdk') else 1,
+            "startTimeUnixNano": str(int(item['start'] * 1e9)), "endTimeUnixNano": str(int(item['end'] * 1e9)),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}}
+                           for key, value in sorted(item['attributes'].items()) + [('dlab.kind', item['kind'])]],
+            "status": {"code": 2 if item['status'] == 'error' else 1}
+        }
+        if item['parent_id']:
+            otlp_span['parentSpanId'] = item['parent_id']
+        otlp_spans.append(otlp_span)
+    body = {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": "dlab-provisioning"}},
+            {"key": "dlab.resource", "value": {"stringValue": os.environ.get('conf_resource', '')}}]},
+        "scopeSpans": [{"scope": {"name": "dlab.trace"}, "spans": otlp_spans}]}]}
+    request = urllib2.Request(endpoint.rstrip('/') + '/v1/traces', json.dumps(body),
+                              {'Content-Type': 'application/json'})
+    urllib2.urlopen(request, timeout=10).read()
+
+
+def export_trace(response_path):
+    # Writes <response name>_trace.json next to the response file, and sends it to an OTLP collector
+    # when conf_trace_otlp_endpoint is set. Called by /bin/<action>.py before the response is written
+    if not enabled():
+        return
+    try:
+        get_root()
+        flush()
+        spans = read_spans(os.environ[trace_file_variable])
+        trace = {"trace_id": os.environ[trace_id_variable], "request_id": os.environ.get('request_id'),
+                 "resource": os.environ.get('conf_resource'), "spans": spans}
+        trace_path = re.sub(r'\.json$', '', response_path) + '_trace.json'
+        with open(trace_path, 'w') as trace_file:
+            json.dump(trace, trace_file)
+        os.remove(os.environ[trace_file_variable])
+        if os.environ.get('conf_trace_otlp_endpoint'):
+            export_otlp(spans, os.environ['conf_trace_otlp_endpoint'])
+    except Exception as err:
+        print("Failed to export trace: {}".format(str(err)))
+
+
+def step_name(item):
+    # Commands are grouped by their first words, SDK calls by operation, scripts and stages by name
+    if item['kind'] == 'command':
+        command = re.sub(r'\d+', 'N', item['attributes'].get('command') or item['attributes'].get('remote_path') or '')
+        return '{0} {1}'.format(item['name'], ' '.join(command.split()[:4]))[:80]
+    return item['name']
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def report(paths, kinds, limit):
+    durations = dict()
+    for path in paths:
+        files = glob.glob(os.path.join(path, '*_trace.json')) if os.path.isdir(path) else [path]
+        for trace_path in files:
+            with open(trace_path) as trace_file:
+                for item in json.load(trace_file)['spans']:
+                    if item['kind'] in kinds:
+                        durations.setdefault((item['kind'], step_name(item)), list()).append(item['duration'])
+    rows = sorted(durations.items(), key=lambda row: -sum(row[1]))[:limit]
+    print('{:<8} {:<80} {:>6} {:>9} {:>9} {:>9} {:>10}'.format('kind', 'step', 'count', 'p50', 'p95', 'max',
+                                                                'total'))
+    for (kind, name), values in rows:
+        values.sort()
+        print('{:<8} {:<80} {:>6} {:>8.2f}s {:>8.2f}s {:>8.2f}s {:>9.1f}s'.format(
+            kind, name, len(values), percentile(values, 0.5), percentile(values, 0.95), values[-1], sum(values)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Aggregates provisioning traces into p50/p95 durations per step')
+    parser.add_argument('paths', nargs='+', help='Trace files or directories with *_trace.json, e.g. /response')
+    parser.add_argument('--kinds', type=str, default='process,stage,command,sdk',
+                        help='Comma separated span kinds to report')
+    parser.add_argument('--limit', type=int, default=50, help='Number of steps with the largest total time')
+    args = parser.parse_args()
+    report(args.paths, args.kinds.split(','), args.limit)
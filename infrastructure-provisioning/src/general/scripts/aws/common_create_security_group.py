@@ -56,20 +56,14 @@ if __name__ == "__main__":
                 print("Creating security group {0} for vpc {1} with tag {2}.".format(args.name, args.vpc_id,
                                                                                      json.dumps(tag)))
                 security_group_id = create_security_group(args.name, args.vpc_id, rules, egress, tag)
-                if nb_sg_id != '' and args.resource == 'edge':
-                    print("Updating Notebook security group {}".format(nb_sg_id))
-                    rule = {'IpProtocol': '-1', 'FromPort': -1, 'ToPort': -1,
-                            'UserIdGroupPairs': [{'GroupId': security_group_id}]}
-                    add_inbound_sg_rule(nb_sg_id, rule)
-                    add_outbound_sg_rule(nb_sg_id, rule)
             else:
-                if nb_sg_id != '' and args.resource == 'edge':
-                    print("Updating Notebook security group {}".format(nb_sg_id))
-                    rule = {'IpProtocol': '-1', 'FromPort': -1, 'ToPort': -1,
-                            'UserIdGroupPairs': [{'GroupId': security_group_id}]}
-                    add_inbound_sg_rule(nb_sg_id, rule)
-                    add_outbound_sg_rule(nb_sg_id, rule)
                 print("REQUESTED SECURITY GROUP WITH NAME {} ALREADY EXISTS".format(args.name))
+                reconcile_sg_rules(security_group_id, rules, egress, revoke=False)
+            if nb_sg_id != '' and args.resource == 'edge':
+                print("Updating Notebook security group {}".format(nb_sg_id))
+                rule = {'IpProtocol': '-1', 'FromPort': -1, 'ToPort': -1,
+                        'UserIdGroupPairs': [{'GroupId': security_group_id}]}
+                reconcile_sg_rules(nb_sg_id, [rule], [rule], revoke=False)
             print("SECURITY_GROUP_ID: {}".format(security_group_id))
             if args.ssn:
                 with open('/tmp/ssn_sg_id', 'w') as f:
@@ -72,11 +72,23 @@ if __name__ == "__main__":
 
     notebook_config['expected_image_name'] = '{}-{}-notebook-image'.format(notebook_config['service_base_name'],
                                                                            os.environ['application'])
+    notebook_config['versioned_image_name'] = get_notebook_image_name(notebook_config['service_base_name'],
+                                                                      os.environ['application'])
     notebook_config['notebook_image_name'] = (lambda x: os.environ['notebook_image_name'] if x != 'None'
         else notebook_config['expected_image_name'])(str(os.environ.get('notebook_image_name')))
     print('Searching pre-configured images')
     notebook_config['ami_id'] = get_ami_id(os.environ['aws_{}_image_name'.format(os.environ['conf_os_family'])])
-    image_id = get_ami_id_by_name(notebook_config['notebook_image_name'], 'available')
+    image_id = ''
+    if str(os.environ.get('notebook_image_name')) == 'None':
+        # Image baked from the same versions, libraries and scripts: configure steps only find their markers
+        image_id = get_ami_id_by_name(notebook_config['versioned_image_name'], 'available')
+        if image_id != '':
+            print('Versioned image found: {}'.format(notebook_config['versioned_image_name']))
+    # With shared images a notebook without a versioned image starts from the stock image and bakes the versioned
+    # one, the unversioned image was built from other inputs
+    if image_id == '' and (os.environ['conf_shared_image_enabled'] != 'true' or
+                           str(os.environ.get('notebook_image_name')) != 'None'):
+        image_id = get_ami_id_by_name(notebook_config['notebook_image_name'], 'available')
     if image_id != '':
         notebook_config['ami_id'] = image_id
         print('Pre-configured image found. Using: {}'.format(notebook_config['ami_id']))
@@ -237,8 +237,6 @@ if __name__ == "__main__":
         append_result("Failed to create sg.", str(err))
         sys.exit(1)
 
-    local("echo Waiting for changes to propagate; sleep 10")
-
     try:
         logging.info('[Creating EMR Cluster]')
         print('[Creating EMR Cluster]')
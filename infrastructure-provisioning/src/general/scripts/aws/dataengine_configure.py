@@ -114,11 +114,11 @@ def configure_slave(slave_number, data_engine):
     try:
         logging.info('[CONFIGURE SLAVE NODE {}]'.format(slave + 1))
         print('[CONFIGURE SLAVE NODE {}]'.format(slave + 1))
-        params = "--hostname {} --keyfile {} --region {} --spark_version {} --hadoop_version {} --os_user {} --scala_version {} --r_mirror {} --master_ip {} --node_type {}". \
+        params = "--hostname {} --keyfile {} --region {} --spark_version {} --hadoop_version {} --os_user {} --scala_version {} --r_mirror {} --master_ip {} --node_type {} --proxy_base {}". \
             format(slave_hostname, keyfile_name, data_engine['region'], os.environ['notebook_spark_version'],
                    os.environ['notebook_hadoop_version'], data_engine['dlab_ssh_user'],
                    os.environ['notebook_scala_version'], os.environ['notebook_r_mirror'], master_node_hostname,
-                   'slave')
+                   'slave', data_engine['spark_ui_proxy_base'])
         try:
             local("~/scripts/{}.py {}".format('configure_dataengine', params))
         except:
@@ -161,6 +161,9 @@ if __name__ == "__main__":
                                       data_engine['computational_name']
         data_engine['master_node_name'] = data_engine['cluster_name'] + '-m'
         data_engine['slave_node_name'] = data_engine['cluster_name'] + '-s'
+        # Location of the cluster UI on the edge, see edge/templates/locations/spark.conf
+        data_engine['spark_ui_proxy_base'] = '/{}_{}'.format(data_engine['exploratory_name'],
+                                                             data_engine['computational_name'])
         data_engine['master_size'] = os.environ['aws_dataengine_master_shape']
         data_engine['slave_size'] = os.environ['aws_dataengine_slave_shape']
         data_engine['dataengine_master_security_group_name'] = data_engine['service_base_name'] + '-' + \
@@ -282,11 +285,11 @@ if __name__ == "__main__":
     try:
         logging.info('[CONFIGURE MASTER NODE]')
         print('[CONFIGURE MASTER NODE]')
-        params = "--hostname {} --keyfile {} --region {} --spark_version {} --hadoop_version {} --os_user {} --scala_version {} --r_mirror {} --master_ip {} --node_type {}".\
+        params = "--hostname {} --keyfile {} --region {} --spark_version {} --hadoop_version {} --os_user {} --scala_version {} --r_mirror {} --master_ip {} --node_type {} --proxy_base {}".\
             format(master_node_hostname, keyfile_name, data_engine['region'], os.environ['notebook_spark_version'],
                    os.environ['notebook_hadoop_version'], data_engine['dlab_ssh_user'],
                    os.environ['notebook_scala_version'], os.environ['notebook_r_mirror'], master_node_hostname,
-                   'master')
+                   'master', data_engine['spark_ui_proxy_base'])
         try:
             local("~/scripts/{}.py {}".format('configure_dataengine', params))
         except:
@@ -329,6 +332,7 @@ if __name__ == "__main__":
             "instance_count": data_engine['instance_count'],
             "master_node_name": data_engine['master_node_name'],
             "slave_node_name": data_engine['slave_node_name'],
+            "spark_reverse_proxy": spark_ui_reverse_proxy_supported(os.environ['notebook_spark_version']),
             "tensor": False
         }
         params = "--edge_hostname {} " \
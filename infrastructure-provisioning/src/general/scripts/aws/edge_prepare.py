@@ -283,10 +283,6 @@ if __name__ == "__main__":
             traceback.print_exc()
             append_result("Failed creating security group for edge node.", str(err))
             raise Exception
-
-        with hide('stderr', 'running', 'warnings'):
-            print('Waiting for changes to propagate')
-            time.sleep(10)
     except:
         remove_all_iam_resources('notebook', os.environ['edge_user_name'])
         remove_all_iam_resources('edge', os.environ['edge_user_name'])
@@ -358,10 +354,6 @@ if __name__ == "__main__":
         except:
             traceback.print_exc()
             raise Exception
-
-        with hide('stderr', 'running', 'warnings'):
-            print('Waiting for changes to propagate')
-            time.sleep(10)
     except Exception as err:
         append_result("Failed creating security group for private subnet.", str(err))
         remove_all_iam_resources('notebook', os.environ['edge_user_name'])
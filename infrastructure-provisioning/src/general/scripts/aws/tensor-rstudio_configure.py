@@ -56,6 +56,8 @@ if __name__ == "__main__":
                                                                notebook_config['exploratory_name'], args.uuid)
     notebook_config['expected_image_name'] = '{}-{}-notebook-image'.format(notebook_config['service_base_name'],
                                                                            os.environ['application'])
+    notebook_config['versioned_image_name'] = get_notebook_image_name(notebook_config['service_base_name'],
+                                                                      os.environ['application'])
     notebook_config['notebook_image_name'] = str(os.environ.get('notebook_image_name'))
     notebook_config['role_profile_name'] = '{}-{}-nb-de-Profile' \
         .format(notebook_config['service_base_name'].lower().replace('-', '_'), os.environ['edge_user_name'])
@@ -224,15 +226,21 @@ if __name__ == "__main__":
         remove_ec2(notebook_config['tag_name'], notebook_config['instance_name'])
         sys.exit(1)
 
-    if notebook_config['shared_image_enabled'] == 'true':
+    # Only an instance created from the stock or from the versioned image is baked, an image given in the request
+    # contains more than the inputs of this version
+    if notebook_config['shared_image_enabled'] == 'true' and notebook_config['notebook_image_name'] == 'None':
         try:
             print('[CREATING AMI]')
-            ami_id = get_ami_id_by_name(notebook_config['expected_image_name'])
+            ami_id = get_ami_id_by_name(notebook_config['versioned_image_name'])
             if ami_id == '':
-                print("Looks like it's first time we configure notebook server. Creating image.")
+                print("Looks like it's first time we configure notebook server of this version. Creating image {}."
+                      .format(notebook_config['versioned_image_name']))
+                put_notebook_image_inputs(notebook_config['dlab_ssh_user'], os.environ['application'], True,
+                                          instance_hostname, keyfile_name)
                 image_id = create_image_from_instance(tag_name=notebook_config['tag_name'],
                                                       instance_name=notebook_config['instance_name'],
-                                                      image_name=notebook_config['expected_image_name'])
+                                                      image_name=notebook_config['versioned_image_name'],
+                                                      tags=json.dumps({"Template": os.environ['application']}))
                 if image_id != '':
                     print("Image was successfully created. It's ID is {}".format(image_id))
         except Exception as err:
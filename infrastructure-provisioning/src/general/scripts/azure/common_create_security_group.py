@@ -37,6 +37,8 @@ if __name__ == "__main__":
     try:
         if AzureMeta().get_security_group(args.resource_group_name, args.security_group_name):
             print("REQUESTED SECURITY GROUP {} ALREADY EXISTS".format(args.security_group_name))
+            AzureActions().reconcile_security_rules(args.resource_group_name, args.security_group_name,
+                                                    json.loads(args.list_rules))
         else:
             print("Creating security group {}.".format(args.security_group_name))
             security_group = AzureActions().create_security_group(args.resource_group_name, args.security_group_name,
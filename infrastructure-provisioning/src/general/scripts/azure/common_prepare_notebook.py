@@ -93,10 +93,20 @@ if __name__ == "__main__":
 
         notebook_config['expected_image_name'] = '{}-{}-notebook-image'.format(notebook_config['service_base_name'],
                                                                                os.environ['application'])
+        notebook_config['versioned_image_name'] = get_notebook_image_name(notebook_config['service_base_name'],
+                                                                          os.environ['application'])
         notebook_config['notebook_image_name'] = (lambda x: os.environ['notebook_image_name'] if x != 'None'
             else notebook_config['expected_image_name'])(str(os.environ.get('notebook_image_name')))
         print('Searching pre-configured images')
         notebook_config['image_name'] = os.environ['azure_{}_image_name'.format(os.environ['conf_os_family'])]
+        # Image baked from the same versions, libraries and scripts: configure steps only find their markers.
+        # With shared images a notebook without a versioned image starts from the stock image and bakes the
+        # versioned one, the unversioned image was built from other inputs
+        if str(os.environ.get('notebook_image_name')) == 'None' and \
+                (AzureMeta().get_image(notebook_config['resource_group_name'],
+                                       notebook_config['versioned_image_name']) or
+                 os.environ['conf_shared_image_enabled'] == 'true'):
+            notebook_config['notebook_image_name'] = notebook_config['versioned_image_name']
         if AzureMeta().get_image(notebook_config['resource_group_name'], notebook_config['notebook_image_name']):
             notebook_config['image_name'] = notebook_config['notebook_image_name']
             notebook_config['image_type'] = 'pre-configured'
@@ -167,6 +167,26 @@ if __name__ == "__main__":
         append_result("Failed to creating service account and role.", str(err))
         sys.exit(1)
 
+    # The static IP does not depend on the firewalls and the buckets, its operation runs while they are
+    # created and is waited for before the edge instance
+    static_address = OperationTracker()
+    try:
+        logging.info('[CREATING STATIC IP ADDRESS]')
+        print('[CREATING STATIC IP ADDRESS]')
+        if GCPMeta().get_static_address(edge_conf['region'], edge_conf['static_address_name']):
+            print("REQUESTED STATIC ADDRESS {} ALREADY EXISTS".format(edge_conf['static_address_name']))
+        elif not GCPActions().create_static_address(edge_conf['static_address_name'], edge_conf['region'],
+                                                    tracker=static_address):
+            raise Exception('Unable to create static address {}'.format(edge_conf['static_address_name']))
+    except Exception as err:
+        append_result("Failed to create static ip.", str(err))
+        GCPActions().remove_service_account(edge_conf['ps_service_account_name'])
+        GCPActions().remove_role(edge_conf['ps_role_name'])
+        GCPActions().remove_service_account(edge_conf['edge_service_account_name'])
+        GCPActions().remove_role(edge_conf['edge_role_name'])
+        GCPActions().remove_subnet(edge_conf['private_subnet_name'], edge_conf['region'])
+        sys.exit(1)
+
     try:
         pre_defined_firewall = True
         logging.info('[CREATE FIREWALL FOR EDGE NODE]')
@@ -238,28 +258,20 @@ if __name__ == "__main__":
         egress_rule['network'] = edge_conf['vpc_selflink']
         egress_rule['direction'] = 'EGRESS'
         firewall_rules['egress'].append(egress_rule)
-
-        params = "--firewall '{}'".format(json.dumps(firewall_rules))
-        try:
-            local("~/scripts/{}.py {}".format('common_create_firewall', params))
-        except:
-            traceback.print_exc()
-            raise Exception
     except Exception as err:
         GCPActions().remove_service_account(edge_conf['ps_service_account_name'])
         GCPActions().remove_role(edge_conf['ps_role_name'])
         GCPActions().remove_service_account(edge_conf['edge_service_account_name'])
         GCPActions().remove_role(edge_conf['edge_role_name'])
         append_result("Failed to create firewall for Edge node.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(edge_conf['static_address_name'], edge_conf['region'])
         GCPActions().remove_subnet(edge_conf['private_subnet_name'], edge_conf['region'])
         sys.exit(1)
 
     try:
         logging.info('[CREATE FIREWALL FOR PRIVATE SUBNET]')
         print('[CREATE FIREWALL FOR PRIVATE SUBNET]')
-        firewall_rules = dict()
-        firewall_rules['ingress'] = []
-        firewall_rules['egress'] = []
 
         ingress_rule = dict()
         ingress_rule['name'] = edge_conf['fw_ps_ingress']
@@ -316,6 +328,8 @@ if __name__ == "__main__":
         egress_rule['direction'] = 'EGRESS'
         firewall_rules['egress'].append(egress_rule)
 
+        # Firewalls of the edge node and of the private subnet are independent, they are created by one run
+        # and their operations are waited for together
         params = "--firewall '{}'".format(json.dumps(firewall_rules))
         try:
             local("~/scripts/{}.py {}".format('common_create_firewall', params))
@@ -324,10 +338,15 @@ if __name__ == "__main__":
             raise Exception
     except Exception as err:
         append_result("Failed to create firewall for private subnet.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(edge_conf['static_address_name'], edge_conf['region'])
         GCPActions().remove_firewall(edge_conf['fw_edge_ingress_public'])
         GCPActions().remove_firewall(edge_conf['fw_edge_ingress_internal'])
         GCPActions().remove_firewall(edge_conf['fw_edge_egress_public'])
         GCPActions().remove_firewall(edge_conf['fw_edge_egress_internal'])
+        GCPActions().remove_firewall(edge_conf['fw_ps_ingress'])
+        GCPActions().remove_firewall(edge_conf['fw_ps_egress_private'])
+        GCPActions().remove_firewall(edge_conf['fw_ps_egress_public'])
         GCPActions().remove_service_account(edge_conf['ps_service_account_name'])
         GCPActions().remove_role(edge_conf['ps_role_name'])
         GCPActions().remove_service_account(edge_conf['edge_service_account_name'])
@@ -347,6 +366,8 @@ if __name__ == "__main__":
             raise Exception
     except Exception as err:
         append_result("Unable to create bucket.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(edge_conf['static_address_name'], edge_conf['region'])
         GCPActions().remove_firewall(edge_conf['fw_edge_ingress_public'])
         GCPActions().remove_firewall(edge_conf['fw_edge_ingress_internal'])
         GCPActions().remove_firewall(edge_conf['fw_edge_egress_public'])
@@ -368,6 +389,8 @@ if __name__ == "__main__":
         GCPActions().set_bucket_owner(edge_conf['shared_bucket_name'], edge_conf['ps_service_account_name'])
     except Exception as err:
         append_result("Failed to set bucket permissions.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(edge_conf['static_address_name'], edge_conf['region'])
         GCPActions().remove_bucket(edge_conf['bucket_name'])
         GCPActions().remove_firewall(edge_conf['fw_edge_ingress_public'])
         GCPActions().remove_firewall(edge_conf['fw_edge_ingress_internal'])
@@ -384,14 +407,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        logging.info('[CREATING STATIC IP ADDRESS]')
-        print('[CREATING STATIC IP ADDRESS]')
-        params = "--address_name {} --region {}".format(edge_conf['static_address_name'], edge_conf['region'])
-        try:
-            local("~/scripts/{}.py {}".format('edge_create_static_ip', params))
-        except:
-            traceback.print_exc()
-            raise Exception
+        static_address.wait()
     except Exception as err:
         append_result("Failed to create static ip.", str(err))
         try:
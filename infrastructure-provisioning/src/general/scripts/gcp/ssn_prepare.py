@@ -121,6 +121,24 @@ if __name__ == "__main__":
                 GCPActions().remove_vpc(ssn_conf['vpc_name'])
             sys.exit(1)
 
+    # The static IP does not depend on the firewall, the service account and the buckets, its operation runs
+    # while they are created and is waited for before the SSN instance
+    static_address = OperationTracker()
+    try:
+        logging.info('[CREATING STATIC IP ADDRESS]')
+        print('[CREATING STATIC IP ADDRESS]')
+        if GCPMeta().get_static_address(ssn_conf['region'], ssn_conf['static_address_name']):
+            print("REQUESTED STATIC ADDRESS {} ALREADY EXISTS".format(ssn_conf['static_address_name']))
+        elif not GCPActions().create_static_address(ssn_conf['static_address_name'], ssn_conf['region'],
+                                                    tracker=static_address):
+            raise Exception('Unable to create static address {}'.format(ssn_conf['static_address_name']))
+    except Exception as err:
+        append_result("Failed to create static ip.", str(err))
+        if pre_defined_subnet:
+            GCPActions().remove_subnet(ssn_conf['subnet_name'], ssn_conf['region'])
+        if pre_defined_vpc:
+            GCPActions().remove_vpc(ssn_conf['vpc_name'])
+        sys.exit(1)
 
     try:
         if os.environ['gcp_firewall_name'] == '':
@@ -174,6 +192,8 @@ if __name__ == "__main__":
                 raise Exception
         except Exception as err:
             append_result("Failed to create Firewall.", str(err))
+            static_address.wait(raise_on_error=False)
+            GCPActions().remove_static_address(ssn_conf['static_address_name'], ssn_conf['region'])
             if pre_defined_vpc:
                 GCPActions().remove_subnet(ssn_conf['subnet_name'], ssn_conf['region'])
                 GCPActions().remove_vpc(ssn_conf['vpc_name'])
@@ -192,6 +212,8 @@ if __name__ == "__main__":
             raise Exception
     except Exception as err:
         append_result("Unable to create Service account and role.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(ssn_conf['static_address_name'], ssn_conf['region'])
         try:
             GCPActions().remove_service_account(ssn_conf['service_account_name'])
             GCPActions().remove_role(ssn_conf['role_name'])
@@ -224,6 +246,8 @@ if __name__ == "__main__":
             raise Exception
     except Exception as err:
         append_result("Unable to create bucket.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(ssn_conf['static_address_name'], ssn_conf['region'])
         GCPActions().remove_service_account(ssn_conf['service_account_name'])
         GCPActions().remove_role(ssn_conf['role_name'])
         if pre_defined_firewall:
@@ -241,6 +265,8 @@ if __name__ == "__main__":
         GCPActions().set_bucket_owner(ssn_conf['ssn_bucket_name'], ssn_conf['service_account_name'])
     except Exception as err:
         append_result("Unable to set bucket permissions.", str(err))
+        static_address.wait(raise_on_error=False)
+        GCPActions().remove_static_address(ssn_conf['static_address_name'], ssn_conf['region'])
         GCPActions().remove_service_account(ssn_conf['service_account_name'])
         GCPActions().remove_role(ssn_conf['role_name'])
         GCPActions().remove_bucket(ssn_conf['ssn_bucket_name'])
@@ -255,14 +281,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        logging.info('[CREATING STATIC IP ADDRESS]')
-        print('[CREATING STATIC IP ADDRESS]')
-        params = "--address_name {} --region {}".format(ssn_conf['static_address_name'], ssn_conf['region'])
-        try:
-            local("~/scripts/{}.py {}".format('ssn_create_static_ip', params))
-        except:
-            traceback.print_exc()
-            raise Exception
+        static_address.wait()
     except Exception as err:
         append_result("Failed to create static ip.", str(err))
         try:
@@ -24,6 +24,8 @@ import argparse
 import json
 import sys
 from dlab.notebook_lib import *
+from dlab.fab import *
+import os
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--hostname', type=str, default='')
@@ -46,5 +48,8 @@ if __name__ == "__main__":
 
     print("Enabling proxy for notebook server for repositories access.")
     enable_proxy(deeper_config['proxy_host'], deeper_config['proxy_port'])
+    if os.environ.get('edge_package_cache_enabled') == 'true' and \
+            enable_package_mirror(deeper_config['proxy_host'], os.environ.get('edge_package_mirror_port', '3141')):
+        print("Package mirror of the edge is used for pip.")
 
 
@@ -21,9 +21,8 @@
 import argparse
 import json
 import sys
-from fabric.api import *
-from jinja2 import Environment, FileSystemLoader
-from dlab.meta_lib import get_instance_private_ip_address, get_instance_hostname
+from dlab.meta_lib import get_instances_private_ip_addresses
+from dlab.reverse_proxy import render_locations, update_locations
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--edge_hostname', type=str, default='')
@@ -32,58 +31,10 @@ parser.add_argument('--os_user', type=str, default='')
 parser.add_argument('--type', type=str, default='')
 parser.add_argument('--exploratory_name', type=str, default='')
 parser.add_argument('--additional_info', type=str, default='')
+parser.add_argument('--resources', type=str, default='',
+                    help='JSON list of {"type", "exploratory_name", "additional_info"} to configure at once')
 args = parser.parse_args()
 
-def make_template():
-    conf_file_name = args.exploratory_name
-    additional_info = json.loads(args.additional_info)
-    environment = Environment(loader=FileSystemLoader('/root/locations'), trim_blocks=True,
-                              lstrip_blocks=True)
-    template = environment.get_template('{}.conf'.format(args.type))
-    ungit_template = environment.get_template('{}.conf'.format('ungit'))
-    tf_template = environment.get_template('{}.conf'.format('tensor'))
-    config = {}
-    if args.type != 'emr' and args.type != 'spark':
-        config['NAME'] = args.exploratory_name
-        config['IP'] = additional_info['instance_hostname']
-    elif args.type == 'spark':
-        config['CLUSTER_NAME'] = '{}_{}'.format(
-            args.exploratory_name, additional_info['computational_name'])
-        config['MASTER_IP'] = get_instance_private_ip_address('Name', additional_info['master_node_name'])
-        config['MASTER_DNS'] = additional_info['master_node_hostname']
-        config['NOTEBOOK_IP'] = additional_info['notebook_instance_ip']
-        slaves = []
-        for i in range(additional_info['instance_count'] - 1):
-            slave_name = additional_info['slave_node_name'] + '{}'.format(i + 1)
-            slave_hostname = get_instance_private_ip_address('Name', slave_name)
-            slave = {
-                'name': 'datanode{}'.format(i + 1),
-                'ip': slave_hostname
-            }
-            slaves.append(slave)
-        config['slaves'] = slaves
-        conf_file_name = config['CLUSTER_NAME']
-    elif args.type == 'emr':
-        config['CLUSTER_NAME'] = '{}_{}'.format(
-            args.exploratory_name, additional_info['computational_name'])
-        config['MASTER_IP'] = additional_info['master_ip']
-        config['MASTER_DNS'] = additional_info['master_dns']
-        config['slaves'] = additional_info['slaves']
-        conf_file_name = config['CLUSTER_NAME']
-
-    # Render the template with data and print the output
-    f = open('/tmp/{}.conf'.format(conf_file_name), 'w')
-    f.write(template.render(config))
-    f.close()
-    if args.type != 'emr' and args.type != 'spark':
-        f = open('/tmp/{}.conf'.format(conf_file_name), 'a')
-        f.write(ungit_template.render(config))
-        f.close()
-    if additional_info['tensor']:
-        f = open('/tmp/{}.conf'.format(conf_file_name), 'a')
-        f.write(tf_template.render(config))
-        f.close()
-    return conf_file_name
 
 ##############
 # Run script #
@@ -92,17 +43,15 @@ if __name__ == "__main__":
     print("Make template")
 
     try:
-        conf_file_name = make_template()
+        if args.resources:
+            resources = json.loads(args.resources)
+        else:
+            resources = [{'type': args.type, 'exploratory_name': args.exploratory_name,
+                          'additional_info': json.loads(args.additional_info)}]
+        configs = render_locations(resources, get_instances_private_ip_addresses)
     except Exception as err:
         print('Error:', str(err))
         sys.exit(1)
 
     print("Configure connections")
-    env['connection_attempts'] = 100
-    env.key_filename = [args.keyfile]
-    env.host_string = args.os_user + '@' + args.edge_hostname
-    put('/tmp/{}.conf'.format(conf_file_name), '/etc/nginx/locations', use_sudo=True)
-    sudo('service nginx restart')
-
-
-
+    update_locations(configs, args.os_user, args.edge_hostname, args.keyfile)
@@ -18,72 +18,272 @@
 #
 # ******************************************************************************
 
+import os
+import re
 import sys
 import json
+import mmap
+import time
+import io
+import subprocess
+import base64
+import argparse
 
-if sys.version[0] == '2':
-    reload(sys)
-    sys.setdefaultencoding('utf8')
+parser = argparse.ArgumentParser(description="Clears execution counts and volatile metadata of notebooks. "
+                                             "Filters stdin to stdout without arguments (git clean filter), "
+                                             "rewrites the given notebooks in place otherwise. As a pre-commit "
+                                             "hook only the staged versions are filtered, the working tree keeps "
+                                             "the outputs: git diff --cached --name-only -z --diff-filter=AM -- "
+                                             "'*.ipynb' | xargs -0 ipynb_output_filter.py --staged")
+parser.add_argument('notebooks', nargs='*', help='Notebooks to filter in place')
+parser.add_argument('--staged', action='store_true',
+                    help='Filter the versions of the notebooks staged in the git index instead of the files')
+parser.add_argument('--benchmark', type=int, default=0,
+                    help='Compare the filter with nbformat on a generated notebook of N megabytes')
 
+# Values of the rules: DELETE removes the field, bytes replace its value, a dict is applied to an object,
+# each()/first() are applied to items of an array
+DELETE = object()
 
-if __name__ == "__main__":
-    version = None
-    try:
-        from jupyter_nbformat import reads, write
-    except ImportError:
+
+def each(rule):
+    return 'each', rule
+
+
+def first(rule):
+    return 'first', rule
+
+
+cell_rule = {
+    b'execution_count': b'null',
+    b'prompt_number': DELETE,
+    b'execution_number': DELETE,
+    b'metadata': {b'collapsed': DELETE, b'scrolled': DELETE, b'ExecuteTime': DELETE},
+    b'outputs': first({b'execution_count': b'null', b'metadata': b'{}'}),
+    # Uncomment next line to clear all output in notebook
+    # b'outputs': b'[]',
+}
+sheet_metadata_rule = {b'widgets': DELETE, b'language_info': {b'version': DELETE}}
+# nbformat drops the blanked signature on write, so it is removed as well
+notebook_metadata_rule = dict(sheet_metadata_rule)
+notebook_metadata_rule[b'signature'] = DELETE
+notebook_rule = {
+    b'cells': each(cell_rule),
+    b'worksheets': each({b'cells': each(cell_rule), b'metadata': sheet_metadata_rule}),
+    b'metadata': notebook_metadata_rule
+}
+
+whitespace = re.compile(br'[ \t\n\r]*')
+literal = re.compile(br'[^,\]}\s]+')
+
+
+class NotebookFilter:
+    # Single pass over the raw notebook: fields are located without decoding strings (embedded images
+    # are skipped with one find), untouched bytes are copied to the output as they are
+    def __init__(self, data, output):
+        self.data = data
+        self.output = output
+        self.copied = 0
+        self.changed = False
+
+    def char(self, pos):
+        return self.data[pos:pos + 1]
+
+    def space(self, pos):
+        return whitespace.match(self.data, pos).end()
+
+    def string_end(self, pos):
+        end = pos
+        while True:
+            end = self.data.find(b'"', end + 1)
+            if end < 0:
+                raise ValueError('Unterminated string at {}'.format(pos))
+            escapes = 0
+            while self.data[end - escapes - 1:end - escapes] == b'\\':
+                escapes += 1
+            if escapes % 2 == 0:
+                return end + 1
+
+    def replace(self, start, end, text):
+        if self.data[start:end] != text:
+            self.changed = True
+        self.output.write(self.data[self.copied:start])
+        self.output.write(text)
+        self.copied = end
+
+    def value(self, pos, rule=None):
+        char = self.char(pos)
+        if char == b'{':
+            return self.object(pos, rule if isinstance(rule, dict) else None)
+        elif char == b'[':
+            return self.array(pos, rule if isinstance(rule, tuple) else None)
+        elif char == b'"':
+            return self.string_end(pos)
+        match = literal.match(self.data, pos)
+        if not match:
+            raise ValueError('Unexpected {0!r} at {1}'.format(char, pos))
+        return match.end()
+
+    def object(self, pos, rule):
+        pos = self.space(pos + 1)
+        if self.char(pos) == b'}':
+            return pos + 1
+        kept_end = None
+        while True:
+            key_end = self.string_end(pos)
+            action = rule.get(self.data[pos + 1:key_end - 1]) if rule else None
+            value_start = self.space(self.space(key_end) + 1)
+            if action is DELETE or isinstance(action, bytes):
+                value_end = self.value(value_start)
+            else:
+                value_end = self.value(value_start, action)
+            after = self.space(value_end)
+            if action is DELETE:
+                if kept_end is not None:
+                    self.replace(kept_end, value_end, b'')
+                elif self.char(after) == b',':
+                    self.replace(pos, self.space(after + 1), b'')
+                else:
+                    self.replace(pos, value_end, b'')
+            else:
+                if isinstance(action, bytes):
+                    self.replace(value_start, value_end, action)
+                kept_end = value_end
+            if self.char(after) != b',':
+                return after + 1
+            pos = self.space(after + 1)
+
+    def array(self, pos, rule):
+        pos = self.space(pos + 1)
+        if self.char(pos) == b']':
+            return pos + 1
+        index = 0
+        while True:
+            item_rule = rule[1] if rule and (rule[0] == 'each' or index == 0) else None
+            after = self.space(self.value(pos, item_rule))
+            if self.char(after) != b',':
+                return after + 1
+            pos = self.space(after + 1)
+            index += 1
+
+    def run(self):
+        self.value(self.space(0), notebook_rule)
+        self.output.write(self.data[self.copied:])
+        return self.changed
+
+
+def filter_stream(source, output):
+    return NotebookFilter(source.read(), output).run()
+
+
+def filter_file(path):
+    # The notebook is memory mapped and written to a temporary file, which replaces it only when changed
+    with open(path, 'rb') as source:
+        if not os.fstat(source.fileno()).st_size:
+            return False
+        data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        temp_path = '{}.filtered'.format(path)
         try:
-            # New IPython
-            from nbformat import reads, write
-        except ImportError:
-            # Deprecated since IPython 4.0
-            from IPython.nbformat.current import reads, write
-            version = 'json'
-
-    input_file = sys.stdin.read()
-    if not version:
-        data = json.loads(input_file)
-        version = data['nbformat']
-    data = reads(input_file, version)
+            with open(temp_path, 'wb') as output:
+                changed = NotebookFilter(data, output).run()
+        finally:
+            data.close()
+    if changed:
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        os.rename(temp_path, path)
+    else:
+        os.remove(temp_path)
+    return changed
+
+
+def filter_staged(paths):
+    # Staged blobs are read with one git cat-file --batch, filtered in memory, written back as new blobs
+    # and staged with one git update-index, so the files in the working tree are left as they are
+    if not paths:
+        return list()
+    entries = list()
+    for line in subprocess.check_output(['git', 'ls-files', '--stage', '-z', '--'] + paths).split(b'\0'):
+        if line:
+            info, path = line.split(b'\t', 1)
+            mode, sha, stage = info.split()
+            if stage == b'0':
+                entries.append((mode, sha, path))
+    if not entries:
+        return list()
+    cat_file = subprocess.Popen(['git', 'cat-file', '--batch'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    index_info = list()
+    try:
+        for mode, sha, path in entries:
+            cat_file.stdin.write(sha + b'\n')
+            cat_file.stdin.flush()
+            size = int(cat_file.stdout.readline().split()[2])
+            data = cat_file.stdout.read(size)
+            cat_file.stdout.read(1)
+            output = io.BytesIO()
+            if not data or not NotebookFilter(data, output).run():
+                continue
+            hash_object = subprocess.Popen(['git', 'hash-object', '-w', '--stdin', '--no-filters'],
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            filtered_sha = hash_object.communicate(output.getvalue())[0].strip()
+            if hash_object.returncode:
+                raise Exception('git hash-object failed for {}'.format(path))
+            index_info.append((mode, filtered_sha, path))
+    finally:
+        cat_file.stdin.close()
+        cat_file.wait()
+    if index_info:
+        update_index = subprocess.Popen(['git', 'update-index', '-z', '--index-info'], stdin=subprocess.PIPE)
+        update_index.communicate(b''.join([mode + b' ' + sha + b'\t' + path + b'\0'
+                                           for mode, sha, path in index_info]))
+        if update_index.returncode:
+            raise Exception('git update-index failed')
+    return [path for mode, sha, path in index_info]
+
+
+def generate_notebook(size_mb):
+    image = base64.b64encode(os.urandom(384 * 1024)).decode('ascii')
+    cells = list()
+    while len(cells) * len(image) < size_mb * 1024 * 1024:
+        cells.append({"cell_type": "code", "execution_count": len(cells) + 1, "source": ["plot()"],
+                      "metadata": {"collapsed": False, "scrolled": True, "ExecuteTime": {"start_time": "now"}},
+                      "outputs": [{"output_type": "display_data", "metadata": {"needs_background": "light"},
+                                   "data": {"image/png": image, "text/plain": ["<Figure>"]}}]})
+    return json.dumps({"cells": cells, "metadata": {"language_info": {"name": "python", "version": "2.7"}},
+                       "nbformat": 4, "nbformat_minor": 2}, indent=1, sort_keys=True).encode('utf-8')
+
 
+def benchmark(size_mb):
+    import io
+    data = generate_notebook(size_mb)
+    start = time.time()
+    NotebookFilter(data, io.BytesIO()).run()
+    stream_time = time.time() - start
+    print("Streaming filter: {0:.1f} MB in {1:.2f}s".format(len(data) / 1048576.0, stream_time))
     try:
-        # IPython
-        sheets = data.worksheets
-    except AttributeError:
-        # Jupyter
-        sheets = [data]
-
-    for sheet in sheets:
-        for cell in sheet.cells:
-            # Uncomment next 2 lines and comment next section to clear all output in notebook
-            # if "outputs" in cell:
-            #     cell.outputs = []
-
-            if hasattr(cell, "outputs") and len(cell.outputs) >= 1:
-                for field in cell.outputs[0]:
-                    if field == "execution_count":
-                        cell.outputs[0].execution_count = None
-                    elif field == "metadata":
-                        cell.outputs[0].metadata = dict()
-
-            for field in ("execution_count",):
-                if field in cell:
-                    cell[field] = None
-            for field in ("prompt_number", "execution_number"):
-                if field in cell:
-                    del cell[field]
-
-            if "metadata" in cell:
-                for field in ("collapsed", "scrolled", "ExecuteTime"):
-                    if field in cell.metadata:
-                        del cell.metadata[field]
-
-        if hasattr(sheet.metadata, "widgets"):
-            del sheet.metadata["widgets"]
-
-        if hasattr(sheet.metadata.language_info, "version"):
-            del sheet.metadata.language_info["version"]
-
-    if 'signature' in data.metadata:
-        data.metadata['signature'] = ""
-
-    write(data, sys.stdout, version)
\ No newline at end of file
+        from nbformat import reads, write
+    except ImportError:
+        print("nbformat is not installed, skipping comparison")
+        return
+    start = time.time()
+    text = data.decode('utf-8')
+    notebook = reads(text, json.loads(text)['nbformat'])
+    write(notebook, io.StringIO(), notebook.nbformat)
+    nbformat_time = time.time() - start
+    print("nbformat: {0:.2f}s, {1:.1f}x slower".format(nbformat_time, nbformat_time / stream_time))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+    elif args.staged:
+        for notebook in filter_staged(args.notebooks):
+            print("Filtered staged {}".format(notebook.decode('utf-8')))
+    elif args.notebooks:
+        for notebook in args.notebooks:
+            if filter_file(notebook):
+                print("Filtered {}".format(notebook))
+    else:
+        stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        filter_stream(stdin, stdout)
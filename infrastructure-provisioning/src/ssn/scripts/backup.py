@@ -20,9 +20,15 @@
 
 from time import gmtime, strftime
 from fabric.api import *
+from backup_store import ChunkStore, save_manifest, manifest_suffix
 import argparse
+import subprocess
+import io
+import tarfile
+import time
 import yaml
 import json
+import glob
 import sys
 import os
 
@@ -37,25 +43,146 @@ parser.add_argument('--db', action='store_true', default=False, help='Mongo DB.
 parser.add_argument('--logs', action='store_true', default=False, help='All logs (include docker). Key without arguments. Default: disable')
 parser.add_argument('--request_id', type=str, default='', help='Uniq request ID for response and backup')
 parser.add_argument('--result_path', type=str, default='/opt/dlab/tmp/result', help='Path to store backup and response files')
+parser.add_argument('--format', type=str, default='tar', choices=['tar', 'incremental'], help='tar: single tar.gz archive. incremental: manifest of deduplicated chunks in a store shared by all backups. Default: tar')
+parser.add_argument('--store_path', type=str, default='', help='Chunk store of incremental backups. Default: <result_path>/store')
+parser.add_argument('--workers', type=int, default=0, help='Number of parallel compression workers. Default: number of CPUs')
+parser.add_argument('--db_parallel_collections', type=int, default=4, help='Number of collections mongodump dumps in parallel. Default: 4')
+parser.add_argument('--db_since_last', action='store_true', default=False, help='Dump only documents created since the last database backup for --db_since_collections. Key without arguments. Default: disable')
+parser.add_argument('--db_since_collections', type=str, default='billing,loginAttempts,dockerAttempts', help='Comma separated names of growing collections (with ObjectId _id) dumped incrementally with --db_since_last')
 args = parser.parse_args()
 
 
+def open_source(path, privileged=False):
+    if privileged:
+        return subprocess.Popen(['sudo', 'cat', path], stdout=subprocess.PIPE).stdout
+    return open(path, 'rb')
+
+
+class SizedSource:
+    # Tar headers carry the size taken before the file is read, a log written or rotated in the meantime
+    # is cut to that size, or padded with zero bytes when it was truncated, so the archive stays readable
+    def __init__(self, source, size, path):
+        self.source = source
+        self.remaining = size
+        self.path = path
+        self.truncated = False
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size) if size and not self.truncated else b''
+        if len(data) < size:
+            if not self.truncated:
+                print('{} was truncated while being archived, padded to its recorded size'.format(self.path))
+                self.truncated = True
+            data += b'\0' * (size - len(data))
+        self.remaining -= size
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+class TarBackupWriter:
+    # Streams sources straight into the archive, compressed with pigz when it is installed
+    def __init__(self, dest_file):
+        self.compressor = None
+        if subprocess.call('which pigz > /dev/null 2>&1', shell=True) == 0:
+            self.compressor = subprocess.Popen(['pigz', '-c'], stdin=subprocess.PIPE, stdout=open(dest_file, 'wb'))
+            self.tar = tarfile.open(fileobj=self.compressor.stdin, mode='w|')
+        else:
+            self.tar = tarfile.open(dest_file, 'w|gz')
+
+    def add_file(self, path, arcname, privileged=False):
+        info = tarfile.TarInfo('./' + arcname)
+        if os.path.islink(path):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(path)
+            self.tar.addfile(info)
+            return
+        if privileged:
+            size, mode, mtime = subprocess.check_output(['sudo', 'stat', '-c', '%s %f %Y', path]).split()
+            info.size, info.mode, info.mtime = int(size), int(mode, 16) & 0o7777, int(mtime)
+        else:
+            stat = os.stat(path)
+            info.size, info.mode, info.mtime = stat.st_size, stat.st_mode & 0o7777, int(stat.st_mtime)
+        source = SizedSource(open_source(path, privileged), info.size, path)
+        self.tar.addfile(info, source)
+        source.close()
+
+    def add_stream(self, stream, arcname):
+        # Tar headers need the size up front, so long streams are written as parts held in memory:
+        # <arcname>.part000, <arcname>.part001, ... which are concatenated back on restore
+        part = stream.read(stream_part_size)
+        next_part = stream.read(stream_part_size) if len(part) == stream_part_size else b''
+        size = len(part) + len(next_part)
+        if not next_part:
+            self.add_data(part, arcname)
+            return size
+        index = 0
+        while part:
+            self.add_data(part, '{0}.part{1:03d}'.format(arcname, index))
+            part, next_part = next_part, stream.read(stream_part_size) if next_part else b''
+            size += len(next_part)
+            index += 1
+        return size
+
+    def add_data(self, data, arcname):
+        info = tarfile.TarInfo('./' + arcname)
+        info.size, info.mode, info.mtime = len(data), 0o644, int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar.close()
+        if self.compressor:
+            self.compressor.stdin.close()
+            if self.compressor.wait() != 0:
+                raise Exception('pigz failed')
+
+
+class IncrementalBackupWriter:
+    def __init__(self, manifest_file, store_path):
+        self.manifest_file = manifest_file
+        self.store = ChunkStore(store_path, args.workers)
+        self.manifest = {'version': 1, 'request_id': args.request_id, 'created': backup_time,
+                         'store': os.path.relpath(store_path, os.path.dirname(os.path.abspath(manifest_file))),
+                         'entries': list()}
+
+    def add_file(self, path, arcname, privileged=False):
+        entry = {'name': arcname, 'source': path}
+        if os.path.islink(path):
+            entry['link'] = os.readlink(path)
+        else:
+            if privileged:
+                entry['mode'] = int(subprocess.check_output(['sudo', 'stat', '-c', '%f', path]), 16) & 0o7777
+            else:
+                entry['mode'] = os.stat(path).st_mode & 0o7777
+            source = open_source(path, privileged)
+            entry['chunks'], entry['size'] = self.store.put_stream(source)
+            source.close()
+        self.manifest['entries'].append(entry)
+
+    def add_stream(self, stream, arcname):
+        entry = {'name': arcname, 'mode': 0o644}
+        entry['chunks'], entry['size'] = self.store.put_stream(stream)
+        self.manifest['entries'].append(entry)
+        return entry['size']
+
+    def close(self):
+        self.store.close()
+        save_manifest(self.manifest_file, self.manifest)
+        print('Backup data: {0} bytes, {1} new chunks ({2} bytes compressed), {3} chunks reused from previous '
+              'backups'.format(self.store.raw_bytes, self.store.new_chunks, self.store.stored_bytes,
+                               self.store.reused_chunks))
+
+
 def backup_prepare():
     try:
-        local('mkdir {}'.format(temp_folder))
-        if args.configs != 'skip':
-            local('mkdir -p {0}conf'.format(temp_folder))
-        if args.keys != 'skip':
-            local('mkdir -p {}keys'.format(temp_folder))
-        if args.certs != 'skip':
-            local('mkdir -p {}certs'.format(temp_folder))
-        if args.jars != 'skip':
-            local('mkdir -p {}jars'.format(temp_folder))
-        if args.logs:
-            local('mkdir -p {}logs'.format(temp_folder))
-            local('mkdir -p {}logs/docker'.format(temp_folder))
+        if args.format == 'incremental':
+            return IncrementalBackupWriter(dest_file, args.store_path or '{}/store'.format(args.result_path))
+        return TarBackupWriter(dest_file)
     except Exception as err:
-        append_result(error='Failed to create temp folder. {}'.format(str(err)))
+        append_result(error='Failed to create backup file. {}'.format(str(err)))
         sys.exit(1)
 
 
@@ -65,10 +192,14 @@ def backup_configs():
         if args.configs == 'skip':
             print('Skipped config backup.')
         elif args.configs == 'all':
-            local("find {0}{2} -name '*yml' -exec cp {3} {1}{2} \;".format(args.dlab_path, temp_folder, conf_folder, "{}"))
+            for root, dirs, files in os.walk('{0}{1}'.format(args.dlab_path, conf_folder)):
+                for conf_file in files:
+                    if conf_file.endswith('yml'):
+                        writer.add_file(os.path.join(root, conf_file), '{0}{1}'.format(conf_folder, conf_file))
         else:
             for conf_file in args.configs.split(','):
-                local('cp {0}{2}{3} {1}{2}'.format(args.dlab_path, temp_folder, conf_folder, conf_file))
+                writer.add_file('{0}{1}{2}'.format(args.dlab_path, conf_folder, conf_file),
+                                '{0}{1}'.format(conf_folder, conf_file))
     except:
         append_result(error='Backup configs failed.')
         sys.exit(1)
@@ -80,10 +211,12 @@ def backup_keys():
         if args.keys == 'skip':
             print('Skipped keys backup.')
         elif args.keys == 'all':
-            local('cp {0}* {1}keys'.format(keys_folder, temp_folder))
+            for key_file in glob.glob('{}*'.format(keys_folder)):
+                if os.path.isfile(key_file):
+                    writer.add_file(key_file, 'keys/{}'.format(os.path.basename(key_file)))
         else:
             for key_file in args.keys.split(','):
-                local('cp {0}{1} {2}keys'.format(keys_folder, key_file, temp_folder))
+                writer.add_file('{0}{1}'.format(keys_folder, key_file), 'keys/{}'.format(key_file))
     except:
         append_result(error='Backup keys failed.')
         sys.exit(1)
@@ -94,14 +227,10 @@ def backup_certs():
         print('Backup certs: {}'.format(args.certs))
         if args.certs == 'skip':
             print('Skipped certs backup.')
-        elif args.certs == 'all':
-            for cert in all_certs:
-                local('sudo cp {0}{1} {2}certs'.format(certs_folder, cert, temp_folder))
-                local('sudo chown {0}:{0} {1}certs/{2} '.format(os_user, temp_folder, cert))
         else:
-            for cert in args.certs.split(','):
-                local('cp {0}{1} {2}certs'.format(certs_folder, cert, temp_folder))
-                local('sudo chown {0}:{0} {1}certs/{2} '.format(os_user, temp_folder, cert))
+            certs = all_certs if args.certs == 'all' else args.certs.split(',')
+            for cert in certs:
+                writer.add_file('{0}{1}'.format(certs_folder, cert), 'certs/{}'.format(cert), privileged=True)
     except:
         append_result(error='Backup certs failed.')
         sys.exit(1)
@@ -112,28 +241,75 @@ def backup_jars():
         print('Backup jars: {}'.format(args.jars))
         if args.jars == 'skip':
             print('Skipped jars backup.')
-        elif args.jars == 'all':
-            for root, dirs, files in os.walk('{0}{1}'.format(args.dlab_path, jars_folder)):
-                for service in dirs:
-                    local('cp -RP {0}{1}{2}* {3}jars'.format(args.dlab_path, jars_folder, service, temp_folder))
         else:
-            for service in args.jars.split(','):
-                local('cp -RP {0}{1}{2}* {3}jars'.format(args.dlab_path, jars_folder, service, temp_folder))
+            jars_path = '{0}{1}'.format(args.dlab_path, jars_folder)
+            if args.jars == 'all':
+                services = [dirs for root, dirs, files in os.walk(jars_path)][0]
+            else:
+                services = args.jars.split(',')
+            for service in services:
+                for service_path in glob.glob('{0}{1}*'.format(jars_path, service)):
+                    if os.path.islink(service_path) or not os.path.isdir(service_path):
+                        writer.add_file(service_path, 'jars/{}'.format(os.path.basename(service_path)))
+                        continue
+                    for root, dirs, files in os.walk(service_path):
+                        for filename in files + [i for i in dirs if os.path.islink(os.path.join(root, i))]:
+                            path = os.path.join(root, filename)
+                            writer.add_file(path, 'jars/{}'.format(os.path.relpath(path, jars_path)))
     except:
         append_result(error='Backup jars failed.')
         sys.exit(1)
 
 
+def dump_database(data, arcname, dump_args):
+    # mongodump writes the archive to stdout, which is piped straight into the backup writer
+    dump = subprocess.Popen(['mongodump', '--host', str(data['mongo']['host']), '--port', str(data['mongo']['port']),
+                             '--username', str(data['mongo']['username']),
+                             '--password', str(data['mongo']['password']),
+                             '--db={}'.format(data['mongo']['database']), '--archive'] + dump_args,
+                            stdout=subprocess.PIPE)
+    size = writer.add_stream(dump.stdout, arcname)
+    if dump.wait() != 0:
+        raise Exception('mongodump failed')
+    return size
+
+
 def backup_database():
     try:
         print('Backup db: {}'.format(args.db))
         if args.db:
             ssn_conf = open('{0}{1}ssn.yml'.format(args.dlab_path, conf_folder)).read()
             data = yaml.load('mongo{}'.format(ssn_conf.split('mongo')[-1]))
-            with settings(hide('running')):
-                local("mongodump --host {0} --port {1} --username {2} --password '{3}' --db={4} --archive={5}mongo.db" \
-                    .format(data['mongo']['host'], data['mongo']['port'], data['mongo']['username'],
-                            data['mongo']['password'], data['mongo']['database'], temp_folder))
+            parallel_args = ['--numParallelCollections={}'.format(args.db_parallel_collections)]
+            last_backup = dict()
+            if args.db_since_last and os.path.isfile(last_db_backup_file):
+                with open(last_db_backup_file) as f:
+                    last_backup = json.loads(f.read())
+            # The base is always the last full dump, so a dump since it needs no other backup than the base
+            if not last_backup.get('full'):
+                last_backup = dict()
+            start = time.time()
+            if last_backup:
+                collections = args.db_since_collections.split(',')
+                print('Dumping {0} since backup {1}'.format(', '.join(collections), last_backup['backup_file']))
+                # Restore puts back these collections from the base before the documents dumped since
+                writer.add_stream(io.BytesIO(json.dumps({'backup_file': last_backup['backup_file'],
+                                                         'time': last_backup['time'],
+                                                         'collections': collections})), 'mongo.base.json')
+                size = dump_database(data, 'mongo.db', parallel_args + ['--excludeCollection={}'.format(collection)
+                                                                        for collection in collections])
+                since_id = '{:08x}0000000000000000'.format(int(last_backup['time']))
+                for collection in collections:
+                    size += dump_database(data, 'mongo.since.{}.db'.format(collection), [
+                        '--collection={}'.format(collection),
+                        '--query={{"_id": {{"$gt": {{"$oid": "{}"}}}}}}'.format(since_id)])
+            else:
+                size = dump_database(data, 'mongo.db', parallel_args)
+            duration = max(time.time() - start, 0.001)
+            print('Database dump: {0:.1f} MB in {1:.1f}s ({2:.1f} MB/s), streamed into the backup without a '
+                  'temporary copy of {0:.1f} MB'.format(size / 1048576.0, duration, size / 1048576.0 / duration))
+            if not last_backup:
+                return start
     except:
         append_result(error='Backup db failed.')
         sys.exit(1)
@@ -144,10 +320,15 @@ def backup_logs():
         print('Backup logs: {}'.format(args.logs))
         if args.logs:
             print('Backup dlab logs')
-            local('cp -R {0}* {1}logs'.format(dlab_logs_folder, temp_folder))
+            for root, dirs, files in os.walk(dlab_logs_folder):
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    writer.add_file(path, 'logs/{}'.format(os.path.relpath(path, dlab_logs_folder)))
             print('Backup docker logs')
-            local("sudo find {0} -name '*log' -exec cp {2} {1}logs/docker \;".format(docker_logs_folder, temp_folder, "{}"))
-            local('sudo chown -R {0}:{0} {1}logs/docker'.format(os_user, temp_folder))
+            with settings(hide('running')):
+                docker_logs = local("sudo find {0} -name '*log'".format(docker_logs_folder), capture=True)
+            for path in docker_logs.splitlines():
+                writer.add_file(path, 'logs/docker/{}'.format(os.path.basename(path)), privileged=True)
     except:
         append_result(error='Backup logs failed.')
         print('Backup logs failed.')
@@ -156,20 +337,17 @@ def backup_logs():
 
 def backup_finalize():
     try:
-        print('Compressing all files to archive...')
-        local('cd {0} && tar -zcf {1} .'.format(temp_folder, dest_file))
+        print('Finalizing backup...')
+        writer.close()
+        if db_backup_time:
+            # Only a complete backup with a full dump may become the base of the next --db_since_last dump
+            with open(last_db_backup_file, 'w') as f:
+                f.write(json.dumps({'time': db_backup_time, 'backup_file': os.path.abspath(dest_file),
+                                    'full': True}))
     except Exception as err:
         append_result(error='Compressing backup failed. {}'.format(str(err)))
         sys.exit(1)
 
-    try:
-        print('Clear temp folder...')
-        if temp_folder != '/':
-            local('rm -rf {}'.format(temp_folder))
-    except Exception as err:
-        append_result(error='Clear temp folder failed. {}'.format(str(err)))
-        sys.exit(1)
-
 
 def append_result(status='failed', error='', backup_file=''):
     with open(dest_result, 'w') as result:
@@ -188,7 +366,6 @@ def append_result(status='failed', error='', backup_file=''):
 if __name__ == "__main__":
     backup_time = strftime('%d_%b_%Y_%H-%M-%S', gmtime())
     os_user = args.user
-    temp_folder = '/tmp/dlab_backup-{}/'.format(backup_time)
     conf_folder = 'conf/'
     keys_folder = '/home/{}/keys/'.format(os_user)
     certs_folder = '/etc/ssl/certs/'
@@ -197,20 +374,25 @@ if __name__ == "__main__":
     dlab_logs_folder = '/var/log/dlab/'
     docker_logs_folder = '/var/lib/docker/containers/'
     dest_result = '{0}/backup_{1}.json'.format(args.result_path, args.request_id)
-    dest_file = '{0}/backup_{1}.tar.gz'.format(args.result_path, args.request_id)
+    last_db_backup_file = '{0}/last_db_backup.json'.format(args.result_path)
+    stream_part_size = 64 * 1024 * 1024
+    if args.format == 'incremental':
+        dest_file = '{0}/backup_{1}{2}'.format(args.result_path, args.request_id, manifest_suffix)
+    else:
+        dest_file = '{0}/backup_{1}.tar.gz'.format(args.result_path, args.request_id)
 
     # Backup file section
-    backup_prepare()
+    writer = backup_prepare()
 
     # Backup section
     backup_configs()
     backup_keys()
     backup_certs()
     backup_jars()
-    backup_database()
+    db_backup_time = backup_database()
     backup_logs()
 
-    # Compressing & cleaning tmp folder
+    # Flushing archive or manifest
     backup_finalize()
 
-    append_result(status='created', error='Backup keys failed.', backup_file=dest_file)
\ No newline at end of file
+    append_result(status='created', error='Backup keys failed.', backup_file=dest_file)
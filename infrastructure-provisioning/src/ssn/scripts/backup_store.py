@@ -0,0 +1,166 @@
+# *****************************************************************************
+#
+# Copyright (c) 2016, EPAM SYSTEMS INC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+chunk_size = 4 * 1024 * 1024
+manifest_suffix = '.manifest.json'
+
+
+def is_manifest(path):
+    return path.endswith(manifest_suffix)
+
+
+class ChunkStore:
+    # Content-addressed store of compressed chunks shared by all backups, so unchanged
+    # files and unchanged parts of growing files (logs, dumps) are stored only once
+    def __init__(self, path, workers=0):
+        self.path = path
+        self.workers = workers or multiprocessing.cpu_count()
+        self.codec = 'zst' if zstandard else 'gz'
+        self.pool = None
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.new_chunks = 0
+        self.reused_chunks = 0
+
+    def chunk_path(self, chunk_id, codec):
+        return os.path.join(self.path, 'chunks', chunk_id[:2], '{0}.{1}'.format(chunk_id, codec))
+
+    def find_chunk(self, chunk_id):
+        for codec in ('zst', 'gz'):
+            path = self.chunk_path(chunk_id, codec)
+            if os.path.isfile(path):
+                return path, codec
+        return None, None
+
+    def compress(self, data):
+        if self.codec == 'zst':
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return zlib.compress(data, 6)
+
+    def store_chunk(self, data):
+        chunk_id = hashlib.sha256(data).hexdigest()
+        if self.find_chunk(chunk_id)[0]:
+            return chunk_id, 0
+        path = self.chunk_path(chunk_id, self.codec)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        compressed = self.compress(data)
+        # Unique temporary file per writer, threads of the pool may store the same chunk at the same time
+        descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(descriptor, 'wb') as chunk_file:
+            chunk_file.write(compressed)
+        os.chmod(temp_path, 0o644)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            os.remove(temp_path)
+            if not os.path.isfile(path):
+                raise
+        return chunk_id, len(compressed)
+
+    def collect(self, result, chunks):
+        chunk_id, stored = result.get()
+        chunks.append(chunk_id)
+        if stored:
+            self.new_chunks += 1
+            self.stored_bytes += stored
+        else:
+            self.reused_chunks += 1
+
+    def put_stream(self, stream):
+        # Chunks are hashed and compressed in parallel while the stream is being read,
+        # at most two chunks per worker are held in memory
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        chunks = list()
+        pending = list()
+        size = 0
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                break
+            size += len(data)
+            pending.append(self.pool.apply_async(self.store_chunk, (data,)))
+            if len(pending) >= self.workers * 2:
+                self.collect(pending.pop(0), chunks)
+        for result in pending:
+            self.collect(result, chunks)
+        self.raw_bytes += size
+        return chunks, size
+
+    def read_chunk(self, chunk_id):
+        path, codec = self.find_chunk(chunk_id)
+        if not path:
+            raise IOError('Chunk {} is missing in store {}'.format(chunk_id, self.path))
+        with open(path, 'rb') as chunk_file:
+            data = chunk_file.read()
+        if codec == 'zst':
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def write_chunks(self, chunks, output):
+        for chunk_id in chunks:
+            output.write(self.read_chunk(chunk_id))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def save_manifest(path, manifest):
+    with open(path + '.tmp', 'w') as manifest_file:
+        manifest_file.write(json.dumps(manifest, indent=1))
+    os.rename(path + '.tmp', path)
+
+
+def load_manifest(path):
+    with open(path) as manifest_file:
+        manifest = json.loads(manifest_file.read())
+    store_path = os.path.join(os.path.dirname(os.path.abspath(path)), manifest['store'])
+    return manifest, ChunkStore(store_path)
+
+
+def restore_entry(store, entry, destination):
+    # Writes one manifest entry to destination, which is a file path
+    parent = os.path.dirname(destination)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    if 'link' in entry:
+        if os.path.lexists(destination):
+            os.remove(destination)
+        os.symlink(entry['link'], destination)
+        return
+    with open(destination, 'wb') as output:
+        store.write_chunks(entry['chunks'], output)
+    os.chmod(destination, entry.get('mode', 0o644))
@@ -24,6 +24,7 @@ import json
 import sys
 from dlab.ssn_lib import *
 import os
+import time
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--hostname', type=str, default='')
@@ -43,7 +44,7 @@ def modify_conf_file(args):
     for os_var in os.environ:
         if "'" not in os.environ[os_var] and os_var != 'aws_access_key' and os_var != 'aws_secret_access_key':
             variables_list[os_var] = os.environ[os_var]
-    local('scp -r -i {} /project_tree/* {}:{}sources/'.format(args.keyfile, env.host_string, args.dlab_path))
+    sync_files('/project_tree/', '{}sources/'.format(args.dlab_path), args.keyfile, env.host_string)
     local('scp -i {} /root/scripts/configure_conf_file.py {}:/tmp/configure_conf_file.py'.format(args.keyfile,
                                                                                                  env.host_string))
     sudo("python /tmp/configure_conf_file.py --dlab_dir {} --variables_list '{}'".format(
@@ -57,6 +58,73 @@ def add_china_repository(dlab_path):
         sudo('sed -i "22i COPY general/files/os/debian/sources.list /etc/apt/sources.list" Dockerfile')
 
 
+def get_image_sources(name):
+    # Paths from COPY instructions of the image Dockerfile, used to compute its source tree hash
+    sources = ['general/files/{0}/{1}_Dockerfile'.format(args.cloud_provider, name),
+               'general/files/{0}/{1}_description.json'.format(args.cloud_provider, name)]
+    with open('/project_tree/general/files/{0}/{1}_Dockerfile'.format(args.cloud_provider, name)) as dockerfile:
+        for line in dockerfile:
+            if line.strip().startswith('COPY'):
+                sources.extend(line.split()[1:-1])
+    return [i.replace('${OS}', args.os_family).lstrip('/') for i in sources]
+
+
+def generate_build_script(image_list, dlab_path):
+    parallelism = os.environ.get('ssn_docker_build_parallelism', '4')
+    incremental = os.environ.get('ssn_docker_build_incremental', 'true') == 'true'
+    buildkit = os.environ.get('ssn_docker_buildkit', 'false') == 'true'
+    lines = ['#!/bin/bash',
+             'cd SOURCES_DIR',
+             'logs=LOGS_DIR',
+             'rm -rf $logs; mkdir -p $logs',
+             'source_hash() { cat $(find "$@" -type f 2>/dev/null | sort) < /dev/null | sha256sum | cut -d " " -f 1; }',
+             'build() {',
+             '  name=$1; tag=$2; hash=$3; start=$(date +%s.%N)',
+             '  current=$(docker inspect -f \'{{index .Config.Labels "dlab.source_hash"}}\' docker.dlab-$name:$tag 2>/dev/null)',
+             '  if [ "INCREMENTAL" == "true" ] && [ "$current" == "$hash" ]; then',
+             '    echo "$name skipped $start $(date +%s.%N)" > $logs/$name.result; return 0',
+             '  fi',
+             '  BUILDKIT_ENV docker build --build-arg OS=OS_FAMILY CACHE_ARGS --label dlab.source_hash=$hash '
+             '--file general/files/CLOUD/${name}_Dockerfile -t docker.dlab-$name:$tag . > $logs/$name.log 2>&1',
+             '  rc=$?; echo "$name $rc $start $(date +%s.%N)" > $logs/$name.result; return $rc',
+             '}',
+             'export -f build; export logs']
+    for image in image_list:
+        lines.append('cp general/files/CLOUD/{0}_description.json {0}/description.json'.format(image['name']))
+    base_images = [image for image in image_list if image['name'] == 'base']
+    child_images = [image for image in image_list if image['name'] != 'base']
+    lines.append('base_hash=$(source_hash {})'.format(' '.join(get_image_sources('base'))))
+    for image in base_images:
+        lines.append('build base {} $base_hash || exit 1'.format(image['tag']))
+    lines.append('cat /dev/null > $logs/images')
+    for image in child_images:
+        lines.append('echo {0} {1} $( (echo $base_hash; source_hash {2}) | sha256sum | cut -d " " -f 1) >> '
+                     '$logs/images'.format(image['name'], image['tag'], ' '.join(get_image_sources(image['name']))))
+    lines.append('xargs -P {} -L 1 bash -c \'build "$@"\' _ < $logs/images'.format(parallelism))
+    script = '\n'.join(lines) + '\n'
+    if buildkit:
+        script = script.replace('BUILDKIT_ENV', 'DOCKER_BUILDKIT=1').replace(
+            'CACHE_ARGS', '--build-arg BUILDKIT_INLINE_CACHE=1 --cache-from docker.dlab-$name:$tag')
+    else:
+        script = script.replace('BUILDKIT_ENV ', '').replace('CACHE_ARGS', '--cache-from docker.dlab-$name:$tag')
+    return script.replace('SOURCES_DIR', '{}sources/'.format(dlab_path)).replace(
+        'LOGS_DIR', '{}tmp/docker_build'.format(dlab_path)).replace('INCREMENTAL', str(incremental).lower()).replace(
+        'CLOUD', args.cloud_provider).replace('OS_FAMILY', args.os_family)
+
+
+def report_docker_build(dlab_path, total_time):
+    results = dict()
+    for line in sudo('cat {}tmp/docker_build/*.result'.format(dlab_path)).splitlines():
+        name, status, start, end = line.split()
+        results[name] = (status, float(end) - float(start))
+    print('Docker images build DAG: base -> [{}]'.format(', '.join(sorted(i for i in results if i != 'base'))))
+    for name in sorted(results, key=lambda i: (i != 'base', i)):
+        status, duration = results[name]
+        state = {'0': 'built', 'skipped': 'skipped'}.get(status, 'failed with code {}'.format(status))
+        print('  {0:<20} {1:<20} {2:8.1f}s'.format(name, state, duration))
+    print('  Total build time: {:.1f}s, per-image logs: {}tmp/docker_build/'.format(total_time, dlab_path))
+
+
 def build_docker_images(image_list, region, dlab_path):
     try:
         if os.environ['conf_cloud_provider'] == 'azure':
@@ -66,14 +134,15 @@ def build_docker_images(image_list, region, dlab_path):
             sudo('cp {0}sources/base/azure_auth.json /home/{1}/keys/azure_auth.json'.format(args.dlab_path, args.os_user))
         if region == 'cn-north-1':
             add_china_repository(dlab_path)
-        for image in image_list:
-            name = image['name']
-            tag = image['tag']
-            sudo('cd {0}sources/; cp general/files/{1}/{2}_description.json {2}/description.json'.format(args.dlab_path, args.cloud_provider, name))
-            sudo("cd {4}sources/; docker build --build-arg OS={2} --file general/files/{3}/{0}_Dockerfile -t docker.dlab-{0}:{1} ."
-                 .format(name, tag, args.os_family, args.cloud_provider, args.dlab_path))
+        with open('/tmp/build_docker_images.sh', 'w') as build_script:
+            build_script.write(generate_build_script(image_list, dlab_path))
+        put('/tmp/build_docker_images.sh', '/tmp/build_docker_images.sh')
+        start = time.time()
+        with settings(warn_only=True):
+            result = sudo('bash /tmp/build_docker_images.sh')
+        report_docker_build(dlab_path, time.time() - start)
         sudo('rm -f {}sources/base/azure_auth.json'.format(args.dlab_path))
-        return True
+        return result.succeeded
     except:
         return False
 
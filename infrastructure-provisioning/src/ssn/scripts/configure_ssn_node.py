@@ -52,6 +52,7 @@ def cp_backup_scripts(dlab_path):
         with cd(dlab_path + "tmp/"):
             put('/root/scripts/backup.py', "backup.py")
             put('/root/scripts/restore.py', "restore.py")
+            put('/root/scripts/backup_store.py', "backup_store.py")
             run('chmod +x backup.py restore.py')
         return True
     except:
@@ -17,7 +17,11 @@
 #
 # ******************************************************************************
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+import base64
+import json
+import time
 import sys
 import yaml
 import argparse
@@ -28,7 +32,7 @@ outfile = "/etc/mongo_params.yml"
 parser = argparse.ArgumentParser()
 parser.add_argument('--resource', type=str, default='')
 parser.add_argument('--status', type=str, default='')
-args = parser.parse_args()
+parser.add_argument('--updates', type=str, default='', help='Base64 encoded JSON list of [resource, status, time] updates')
 
 
 def read_yml_conf(path, section, param):
@@ -42,19 +46,54 @@ def read_yml_conf(path, section, param):
         return ''
 
 
-def update_resource_status(resource, status):
+def get_statuses_collection():
     path = "/etc/mongod.conf"
     mongo_passwd = "PASSWORD"
     mongo_ip = read_yml_conf(path, 'net', 'bindIp')
     mongo_port = read_yml_conf(path, 'net', 'port')
-    client = MongoClient(mongo_ip + ':' + str(mongo_port))
     client = MongoClient("mongodb://admin:" + mongo_passwd + "@" + mongo_ip + ':' + str(mongo_port) + "/dlabdb")
-    client.dlabdb.statuses.save({"_id": resource, "value": status})
+    return client.dlabdb.statuses
+
+
+def update_resource_statuses(updates, statuses=None, attempts=5):
+    # Only the latest update of every resource is written and only when the stored status is older,
+    # so batches sent by different provisioning containers or retried after a failure keep the order
+    latest = dict()
+    for resource, status, updated in updates:
+        if resource not in latest or latest[resource][1] <= updated:
+            latest[resource] = (status, updated)
+    requests = [UpdateOne({"_id": resource, "updated": {"$not": {"$gt": updated}}},
+                          {"$set": {"value": status, "updated": updated}}, upsert=True)
+                for resource, (status, updated) in latest.items()]
+    if statuses is None:
+        statuses = get_statuses_collection()
+    duplicates_resent = False
+    for attempt in range(attempts):
+        try:
+            statuses.bulk_write(requests, ordered=False)
+            return
+        except BulkWriteError as err:
+            # Duplicate key errors are upserts of updates which are older than the stored ones, or which lost
+            # the race to insert a new resource. Sent once more, the latter find the inserted document
+            if [error for error in err.details['writeErrors'] if error['code'] != 11000]:
+                raise
+            if duplicates_resent:
+                return
+            requests = [requests[error['index']] for error in err.details['writeErrors']]
+            duplicates_resent = True
+        except AutoReconnect:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(2 ** attempt)
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     try:
-        update_resource_status(args.resource, args.status)
+        if args.updates:
+            update_resource_statuses(json.loads(base64.b64decode(args.updates)))
+        else:
+            update_resource_statuses([[args.resource, args.status, time.time()]])
     except:
-        print("Unable to update status for the resource {}".format(args.resource))
-        sys.exit(1)
\ No newline at end of file
+        print("Unable to update status for the resource {}".format(args.resource or "in the batch"))
+        sys.exit(1)
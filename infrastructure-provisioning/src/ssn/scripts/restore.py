@@ -21,6 +21,15 @@
 from fabric.api import *
 import argparse
 import filecmp
+import glob
+from backup_store import chunk_size, is_manifest, load_manifest, restore_entry
+from multiprocessing.pool import ThreadPool
+import subprocess
+import hashlib
+import json
+import shutil
+import tarfile
+import tempfile
 import yaml
 import sys
 import os
@@ -34,6 +43,10 @@ parser.add_argument('--jars', type=str, default='skip', help='Comma separated na
 parser.add_argument('--db', action='store_true', default=False, help='Mongo DB. Key without arguments. Default: disable')
 parser.add_argument('--file', type=str, default='', required=True, help='Full or relative path to backup file or folder. Required field')
 parser.add_argument('--force', action='store_true', default=False, help='Force mode. Without any questions. Key without arguments. Default: disable')
+parser.add_argument('--plan', action='store_true', default=False, help='Show files which would be created or updated, without extracting the backup or changing anything. Key without arguments. Default: disable')
+parser.add_argument('--apply', action='store_true', default=False, help='Restore only changed files without any questions, extracting only them from the backup. Key without arguments. Default: disable')
+parser.add_argument('--workers', type=int, default=0, help='Number of files restored in parallel with --apply. Default: number of CPUs')
+parser.add_argument('--db_parallel_collections', type=int, default=4, help='Number of collections mongorestore restores in parallel. Default: 4')
 args = parser.parse_args()
 
 
@@ -55,7 +68,19 @@ def ask(question):
 
 def restore_prepare():
     try:
-        if os.path.isfile(backup_file):
+        if os.path.isfile(backup_file) and is_manifest(backup_file):
+            temp_folder = "/tmp/{}/".format(os.path.basename(backup_file)[:-len('.manifest.json')])
+            if os.path.isdir(temp_folder):
+                print("Temporary folder with this backup already exist.")
+                print("Use folder path '{}' in --file key".format(temp_folder))
+                raise Exception
+            print("Incremental backup will be restored to: {}".format(temp_folder))
+            manifest, store = load_manifest(backup_file)
+            pool = ThreadPool()
+            pool.map(lambda entry: restore_entry(store, entry, os.path.join(temp_folder, entry['name'])),
+                     manifest['entries'])
+            pool.close()
+        elif os.path.isfile(backup_file):
             head, tail = os.path.split(args.file)
             temp_folder = "/tmp/{}/".format(tail.split(".")[0])
             if os.path.isdir(temp_folder):
@@ -76,6 +101,11 @@ def restore_prepare():
         print("Failed to open backup.{}".format(str(err)))
         sys.exit(1)
 
+    stop_services()
+    return temp_folder
+
+
+def stop_services():
     try:
         if ask("Maybe you want to create backup of existing configuration before restoring?"):
             with settings(hide('everything')):
@@ -94,9 +124,178 @@ def restore_prepare():
         print("Failed to stop all services. Can not continue.")
         sys.exit(1)
 
+
+def is_selected(names, name):
+    return names == "all" or (names != "skip" and name in names.split(","))
+
+
+def is_database_dump(name):
+    return name == "mongo.db" or name.startswith("mongo.db.part")
+
+
+def plan_item(name, size, link):
+    # Describes how a member of the backup would be restored, None for members which are not selected
+    section, _, path = name.partition("/")
+    item = {"name": name, "size": size, "link": link, "privileged": False}
+    if is_database_dump(name) or name.startswith("mongo.since.") or name == "mongo.base.json":
+        if not args.db:
+            return None
+        item.update(destination="", action="restore")
+        return item
+    elif section == "conf" and is_selected(args.configs, path):
+        item["destination"] = "{0}{1}{2}".format(args.dlab_path, conf_folder, path)
+    elif section == "keys" and is_selected(args.keys, path):
+        item["destination"] = "{0}{1}".format(keys_folder, path)
+    elif section == "certs" and is_selected(args.certs, path):
+        item.update(destination="{0}{1}".format(certs_folder, path), privileged=True)
+    elif section == "jars" and is_selected(args.jars, path.split("/")[0]):
+        item["destination"] = "{0}{1}{2}".format(args.dlab_path, jars_folder, path)
+    else:
+        return None
+    destination = item["destination"]
+    if not os.path.lexists(destination):
+        item["action"] = "create"
+    elif link is not None:
+        item["action"] = "unchanged" if os.path.islink(destination) and os.readlink(destination) == link else "update"
+    elif os.path.islink(destination) or os.path.getsize(destination) != size:
+        item["action"] = "update"
+    else:
+        # Contents have to be compared
+        item["action"] = "compare"
+    return item
+
+
+def open_destination(item):
+    if item["privileged"]:
+        return subprocess.Popen(["sudo", "cat", item["destination"]], stdout=subprocess.PIPE).stdout
+    return open(item["destination"], "rb")
+
+
+def compare_contents(item, source):
+    destination = open_destination(item)
+    try:
+        while True:
+            data = source.read(1024 * 1024)
+            if data != destination.read(1024 * 1024):
+                return "update"
+            if not data:
+                return "unchanged"
+    finally:
+        destination.close()
+
+
+def compare_chunks(item, chunks):
+    # Incremental backups keep sha256 of every chunk, so only the destination file is read
+    destination = open_destination(item)
+    try:
+        for chunk_id in chunks:
+            if hashlib.sha256(destination.read(chunk_size)).hexdigest() != chunk_id:
+                return "update"
+        return "unchanged"
+    finally:
+        destination.close()
+
+
+def plan_restore():
+    # Computes changes from the backup metadata in a single pass, contents are read only for files of the same size
+    plan = list()
+    if os.path.isfile(backup_file) and is_manifest(backup_file):
+        manifest, store = load_manifest(backup_file)
+        for entry in manifest["entries"]:
+            item = plan_item(entry["name"], entry.get("size", 0), entry.get("link"))
+            if item and item["action"] == "compare":
+                item["action"] = compare_chunks(item, entry["chunks"])
+            plan.append(item)
+    elif os.path.isfile(backup_file):
+        tar = tarfile.open(backup_file, "r|*")
+        for member in tar:
+            if not member.isfile() and not member.issym():
+                continue
+            item = plan_item(os.path.normpath(member.name), member.size, member.linkname if member.issym() else None)
+            if item and item["action"] == "compare":
+                item["action"] = compare_contents(item, tar.extractfile(member))
+            plan.append(item)
+        tar.close()
+    elif os.path.isdir(backup_file):
+        for root, dirs, files in os.walk(backup_file):
+            for filename in files + [i for i in dirs if os.path.islink(os.path.join(root, i))]:
+                path = os.path.join(root, filename)
+                link = os.readlink(path) if os.path.islink(path) else None
+                item = plan_item(os.path.relpath(path, backup_file), 0 if link else os.path.getsize(path), link)
+                if item and item["action"] == "compare":
+                    with open(path, "rb") as source:
+                        item["action"] = compare_contents(item, source)
+                plan.append(item)
+    else:
+        print("Please, specify file or folder. Try --help for more details.")
+        sys.exit(1)
+    return sorted([item for item in plan if item], key=lambda item: item["name"])
+
+
+def print_plan(plan):
+    print("Restore plan for {}:".format(backup_file))
+    for item in plan:
+        if item["action"] == "restore":
+            print("  {0:<9} {1} ({2} bytes, existing collections are dropped)".format("restore", item["name"],
+                                                                                    item["size"]))
+        elif item["action"] != "unchanged":
+            print("  {0:<9} {1} -> {2}".format(item["action"], item["name"], item["destination"]))
+    actions = [item["action"] for item in plan]
+    print("{0} to create, {1} to update, {2} unchanged, {3} database files to restore".format(
+        actions.count("create"), actions.count("update"), actions.count("unchanged"), actions.count("restore")))
+
+
+def extract_changes(plan):
+    # Only members which are going to be restored are extracted
+    needed = set([item["name"] for item in plan if item["action"] != "unchanged"])
+    if os.path.isdir(backup_file):
+        return backup_file
+    if is_manifest(backup_file):
+        temp_folder = "/tmp/{}/".format(os.path.basename(backup_file)[:-len('.manifest.json')])
+    else:
+        temp_folder = "/tmp/{}/".format(os.path.basename(backup_file).split(".")[0])
+    if os.path.isdir(temp_folder):
+        print("Temporary folder with this backup already exist.")
+        print("Use folder path '{}' in --file key".format(temp_folder))
+        sys.exit(1)
+    print("Extracting {0} files to: {1}".format(len(needed), temp_folder))
+    os.makedirs(temp_folder)
+    if is_manifest(backup_file):
+        manifest, store = load_manifest(backup_file)
+        pool = ThreadPool(args.workers or None)
+        pool.map(lambda entry: restore_entry(store, entry, os.path.join(temp_folder, entry["name"])),
+                 [entry for entry in manifest["entries"] if entry["name"] in needed])
+        pool.close()
+    else:
+        tar = tarfile.open(backup_file, "r|*")
+        for member in tar:
+            if os.path.normpath(member.name) in needed:
+                tar.extract(member, temp_folder)
+        tar.close()
     return temp_folder
 
 
+def copy_item(item):
+    source = os.path.join(temp_folder, item["name"])
+    sudo = "sudo " if item["privileged"] else ""
+    local("{0}mkdir -p {1} && {0}cp -fP {2} {3}".format(sudo, os.path.dirname(item["destination"]), source,
+                                                          item["destination"]))
+    if item["privileged"]:
+        local("sudo chown {0}:{0} {1}".format("root", item["destination"]))
+
+
+def restore_changes(plan):
+    try:
+        items = [item for item in plan if item["action"] in ("create", "update")]
+        print("Restoring {} files".format(len(items)))
+        pool = ThreadPool(args.workers or None)
+        pool.map(copy_item, items)
+        pool.close()
+    except Exception as err:
+        print("Restore files failed. {}".format(str(err)))
+        sys.exit(1)
+
+
 def restore_configs():
     try:
         if not os.path.isdir("{0}{1}".format(temp_folder, conf_folder)):
@@ -239,25 +438,81 @@ def restore_jars():
         print("Restore jars failed.")
 
 
+def find_base_backup():
+    # Documents dumped with --db_since_last are the ones created after the full dump of the base backup
+    with open("{}mongo.base.json".format(temp_folder)) as base_file:
+        base = json.loads(base_file.read())
+    for path in (base["backup_file"], os.path.join(os.path.dirname(os.path.abspath(backup_file)),
+                                                   os.path.basename(base["backup_file"]))):
+        if os.path.isfile(path):
+            print("Documents of {0} were dumped since base backup {1}".format(", ".join(base["collections"]), path))
+            return path, base["collections"]
+    raise Exception("Base backup {} of the documents dumped since is not available".format(base["backup_file"]))
+
+
+def restore_base_collections(mongorestore, database, base_file, collections):
+    # Only the database dump is extracted from the base backup, its collections replace the live ones
+    base_folder = tempfile.mkdtemp()
+    try:
+        if is_manifest(base_file):
+            manifest, store = load_manifest(base_file)
+            for entry in manifest["entries"]:
+                if is_database_dump(entry["name"]):
+                    restore_entry(store, entry, os.path.join(base_folder, entry["name"]))
+        else:
+            tar = tarfile.open(base_file, "r|*")
+            for member in tar:
+                if is_database_dump(os.path.normpath(member.name)):
+                    tar.extract(member, base_folder)
+            tar.close()
+        parts = sorted(glob.glob("{}/mongo.db.part*".format(base_folder))) or \
+            glob.glob("{}/mongo.db".format(base_folder))
+        if not parts:
+            raise Exception("Base backup {} has no database dump".format(base_file))
+        print("Restoring {0} from base backup {1}".format(", ".join(collections), base_file))
+        local("cat {0} | {1} --drop --archive {2}".format(" ".join(parts), mongorestore, " ".join(
+            ["--nsInclude={0}.{1}".format(database, collection) for collection in collections])))
+    finally:
+        shutil.rmtree(base_folder)
+
+
 def restore_database():
     try:
         print("Restore database: {}".format(args.db))
         if args.db:
-            if not os.path.isfile("{0}{1}".format(temp_folder, "mongo.db")):
+            parts = sorted(glob.glob("{}mongo.db.part*".format(temp_folder)))
+            if not os.path.isfile("{0}{1}".format(temp_folder, "mongo.db")) and not parts:
                 print("File {} are not available in this backup.".format("mongo.db"))
                 raise Exception
             else:
                 if ask("Do you want to drop existing database and restore another from backup?"):
                     ssn_conf = open(args.dlab_path + conf_folder + 'ssn.yml').read()
                     data = yaml.load("mongo" + ssn_conf.split("mongo")[-1])
+                    mongorestore = "mongorestore --host {0} --port {1} --username {2} --password '{3}' " \
+                                   "--authenticationDatabase={4} --numParallelCollections={5}".format(
+                                       data['mongo']['host'], data['mongo']['port'], data['mongo']['username'],
+                                       data['mongo']['password'], data['mongo']['database'],
+                                       args.db_parallel_collections)
+                    since_dumps = sorted(glob.glob("{}mongo.since.*.db".format(temp_folder)))
+                    if since_dumps:
+                        # Checked before anything is dropped
+                        base_file, collections = find_base_backup()
                     print("Restoring database from backup")
-                    local("mongorestore --drop --host {0} --port {1} --archive={2}/mongo.db --username {3} --password '{4}' --authenticationDatabase={5}" \
-                            .format(data['mongo']['host'], data['mongo']['port'], temp_folder,
-                                    data['mongo']['username'], data['mongo']['password'], data['mongo']['database']))
+                    if parts:
+                        # Long dumps are stored as parts of a single archive
+                        local("cat {0} | {1} --drop --archive".format(" ".join(parts), mongorestore))
+                    else:
+                        local("{0} --drop --archive={1}/mongo.db".format(mongorestore, temp_folder))
+                    if since_dumps:
+                        restore_base_collections(mongorestore, data['mongo']['database'], base_file, collections)
+                    # Documents dumped with --db_since_last are added on top of the collections of the base
+                    for since_dump in since_dumps:
+                        print("Restoring documents from {}".format(os.path.basename(since_dump)))
+                        local("{0} --archive={1}".format(mongorestore, since_dump))
         else:
             print("Restore database was skipped.")
-    except:
-        print("Restore database failed.")
+    except Exception as err:
+        print("Restore database failed. {}".format(str(err)))
 
 
 def restore_finalize():
@@ -268,6 +523,8 @@ def restore_finalize():
         print("Failed to start all services.")
 
     try:
+        if temp_folder == backup_file and args.apply:
+            return
         if ask("Clean temporary folder {}?".format(temp_folder)) and temp_folder != "/":
             local("rm -rf {}".format(temp_folder))
     except Exception as err:
@@ -282,15 +539,29 @@ if __name__ == "__main__":
     jars_folder = "webapp/lib/"
     temp_folder = ""
 
-    # Backup file section
-    temp_folder = restore_prepare()
-
-    # Restore section
-    restore_configs()
-    restore_keys()
-    restore_certs()
-    restore_jars()
-    restore_database()
+    if args.plan or args.apply:
+        # Restore plan section
+        plan = plan_restore()
+        print_plan(plan)
+        if args.plan:
+            sys.exit(0)
+        args.force = True
+        temp_folder = extract_changes(plan)
+        stop_services()
+
+        # Restore section
+        restore_changes(plan)
+        restore_database()
+    else:
+        # Backup file section
+        temp_folder = restore_prepare()
+
+        # Restore section
+        restore_configs()
+        restore_keys()
+        restore_certs()
+        restore_jars()
+        restore_database()
 
     # Starting services & cleaning tmp folder
     restore_finalize()
@@ -74,7 +74,7 @@ gitlab_certfile = os.environ['conf_gitlab_certfile']
 
 
 def configure_zeppelin(os_user):
-    if not exists('/home/' + os_user + '/.ensure_dir/zeppelin_ensured'):
+    if not ensured(os_user, 'zeppelin_ensured'):
         try:
             sudo('wget ' + zeppelin_link + ' -O /tmp/zeppelin-' + zeppelin_version + '-bin-netinst.tgz')
             sudo('tar -zxvf /tmp/zeppelin-' + zeppelin_version + '-bin-netinst.tgz -C /opt/')
@@ -105,13 +105,13 @@ def configure_zeppelin(os_user):
             sudo("systemctl daemon-reload")
             sudo("systemctl enable zeppelin-notebook")
             sudo('echo \"d /var/run/zeppelin 0755 ' + os_user + '\" > /usr/lib/tmpfiles.d/zeppelin.conf')
-            sudo('touch /home/' + os_user + '/.ensure_dir/zeppelin_ensured')
+            set_ensured(os_user, 'zeppelin_ensured')
         except:
             sys.exit(1)
 
 
 def configure_local_livy_kernels(args):
-    if not exists('/home/' + args.os_user + '/.ensure_dir/local_livy_kernel_ensured'):
+    if not ensured(args.os_user, 'local_livy_kernel_ensured'):
         port_number_found = False
         default_port = 8998
         livy_port = ''
@@ -135,26 +135,26 @@ def configure_local_livy_kernels(args):
             sudo('sed -i "s/^/#/g" /opt/livy/conf/spark-blacklist.conf')
         sudo("systemctl start livy-server")
         sudo('chown ' + args.os_user + ':' + args.os_user + ' -R /opt/zeppelin/')
-        sudo('touch /home/' + args.os_user + '/.ensure_dir/local_livy_kernel_ensured')
+        set_ensured(args.os_user, 'local_livy_kernel_ensured')
     sudo("systemctl daemon-reload")
     sudo("systemctl start zeppelin-notebook")
 
 
 def configure_local_spark_kernels(args):
-    if not exists('/home/' + args.os_user + '/.ensure_dir/local_spark_kernel_ensured'):
+    if not ensured(args.os_user, 'local_spark_kernel_ensured'):
         put(templates_dir + 'interpreter_spark.json', '/tmp/interpreter.json')
         sudo('sed -i "s|ENDPOINTURL|' + args.endpoint_url + '|g" /tmp/interpreter.json')
         sudo('sed -i "s|OS_USER|' + args.os_user + '|g" /tmp/interpreter.json')
         update_zeppelin_interpreters(args.multiple_clusters, r_enabled, 'local')
         sudo('cp -f /tmp/interpreter.json /opt/zeppelin/conf/interpreter.json')
         sudo('chown ' + args.os_user + ':' + args.os_user + ' -R /opt/zeppelin/')
-        sudo('touch /home/' + args.os_user + '/.ensure_dir/local_spark_kernel_ensured')
+        set_ensured(args.os_user, 'local_spark_kernel_ensured')
     sudo("systemctl daemon-reload")
     sudo("systemctl start zeppelin-notebook")
 
 
 def install_local_livy(args):
-    if not exists('/home/' + args.os_user + '/.ensure_dir/local_livy_ensured'):
+    if not ensured(args.os_user, 'local_livy_ensured'):
         sudo('wget http://archive.cloudera.com/beta/livy/livy-server-' + args.livy_version + '.zip -O /opt/livy-server-'
              + args.livy_version + '.zip')
         sudo('unzip /opt/livy-server-' + args.livy_version + '.zip -d /opt/')
@@ -171,7 +171,7 @@ def install_local_livy(args):
         sudo('cp /tmp/livy-server.service /etc/systemd/system/livy-server.service')
         sudo("systemctl daemon-reload")
         sudo("systemctl enable livy-server")
-        sudo('touch /home/' + args.os_user + '/.ensure_dir/local_livy_ensured')
+        set_ensured(args.os_user, 'local_livy_ensured')
 
 
 ##############